@@ -1654,6 +1654,21 @@ if (window.aiCoachLauncherInitialized) {
             return likeBtn;
         }
 
+        // Polls a background clear_old_chats job until it finishes; resolves to the job status, or null if it is still running.
+        async function waitForClearOldChatsJob(jobId) {
+            for (let attempt = 0; attempt < 60; attempt++) {
+                const statusResponse = await fetch(`${HEROKU_API_BASE_URL}/clear_old_chats/${jobId}`);
+                if (statusResponse.ok) {
+                    const job = await statusResponse.json();
+                    if (job.status !== 'queued' && job.status !== 'running') {
+                        return job;
+                    }
+                }
+                await new Promise(resolve => setTimeout(resolve, 1000));
+            }
+            return null;
+        }
+
         // Clear old chats handler
         if (clearOldChatsBtn) {
             clearOldChatsBtn.addEventListener('click', async () => {
@@ -1675,8 +1690,16 @@ if (window.aiCoachLauncherInitialized) {
                     });
                     
                     if (response.ok) {
-                        const result = await response.json();
-                        alert(`Cleared ${result.deleted_count} old chats. You now have room for ${200 - result.remaining_count} new chats.`);
+                        let result = await response.json();
+                        if (response.status === 202 && result.job_id) {
+                            // The deletes run in the background; wait for the job to report what was actually deleted.
+                            result = await waitForClearOldChatsJob(result.job_id);
+                        }
+                        if (result) {
+                            alert(`Cleared ${result.deleted_count} old chats. You now have room for ${200 - result.remaining_count} new chats.`);
+                        } else {
+                            alert('Old chats are still being cleared. Your chat history will update shortly.');
+                        }
                         loadChatHistory(); // Reload to show updated counts
                     }
                 } catch (error) {
@@ -1,14 +1,33 @@
 import os
 import json
 # Removed: import csv 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, has_request_context, copy_current_request_context, Response, stream_with_context
+import click
 from flask_cors import CORS # Import CORS
 from dotenv import load_dotenv
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
 import logging # Add logging import
 import openai # Import the OpenAI library
 import time # Add time for cache expiry
-from datetime import datetime # Add datetime for timestamp
+import random
+from email.utils import parsedate_to_datetime
+import threading
+import sqlite3
+import copy
+import uuid
+import hashlib
+import re
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from collections import deque, OrderedDict
+from datetime import datetime, timedelta # Add datetime for timestamp
+
+try:
+    import redis # Optional: only needed when CACHE_BACKEND=redis / REDIS_URL is set
+except ImportError:
+    redis = None
 
 # Load environment variables from .env file
 load_dotenv()
@@ -39,12 +58,177 @@ OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 
 KNACK_BASE_URL = f"https://api.knack.com/v1/objects"
 
+# --- Knack HTTP Connection Pool ---
+# Each gunicorn worker keeps one pooled session to api.knack.com so that the
+# 6-10 Knack calls made by a single coaching request reuse warm connections.
+KNACK_POOL_CONNECTIONS = int(os.getenv('KNACK_POOL_CONNECTIONS', 4))
+# Sized so every gunicorn thread can hold a warm connection. gunicorn.conf.py exports
+# GUNICORN_THREADS with its default; the fallback here is the same.
+KNACK_POOL_MAXSIZE = int(os.getenv('KNACK_POOL_MAXSIZE', max(16, int(os.getenv('GUNICORN_THREADS', 256)))))
+KNACK_REQUEST_TIMEOUT_SECONDS = float(os.getenv('KNACK_REQUEST_TIMEOUT_SECONDS', 30))
+KNACK_ROWS_PER_PAGE = 1000 # Knack's maximum page size
+# Bounded so a paginated fetch never bursts past Knack's per-application request rate.
+KNACK_PAGE_FETCH_WORKERS = int(os.getenv('KNACK_PAGE_FETCH_WORKERS', 4))
+# Pages fetched ahead of a streaming consumer (see KnackPageStream); bounds its peak memory.
+KNACK_STREAM_PREFETCH_PAGES = int(os.getenv('KNACK_STREAM_PREFETCH_PAGES', 1))
+# Independent coaching_suggestions inputs are gathered in parallel on a pool of the request's own (see TaskGraph);
+# each task has its own deadline, counted from when it starts running.
+COACHING_TASK_TIMEOUT_SECONDS = float(os.getenv('COACHING_TASK_TIMEOUT_SECONDS', 45))
+
+# --- Knack Rate Limiting & Retries ---
+# Knack allows 10 API requests per second per application. The budget is shared by every
+# gunicorn worker, so by default each worker gets an equal slice of it. gunicorn.conf.py exports
+# WEB_CONCURRENCY with its default; the fallback here is the same.
+KNACK_PLAN_REQUESTS_PER_SECOND = float(os.getenv('KNACK_PLAN_REQUESTS_PER_SECOND', 10))
+KNACK_RATE_LIMIT_PER_SECOND = float(os.getenv('KNACK_RATE_LIMIT_PER_SECOND', KNACK_PLAN_REQUESTS_PER_SECOND / max(1, int(os.getenv('WEB_CONCURRENCY', 2)))))
+KNACK_RATE_LIMIT_BURST = float(os.getenv('KNACK_RATE_LIMIT_BURST', max(1.0, KNACK_RATE_LIMIT_PER_SECOND)))
+KNACK_MAX_RETRIES = int(os.getenv('KNACK_MAX_RETRIES', 4))
+KNACK_BACKOFF_BASE_SECONDS = float(os.getenv('KNACK_BACKOFF_BASE_SECONDS', 0.5))
+KNACK_BACKOFF_MAX_SECONDS = float(os.getenv('KNACK_BACKOFF_MAX_SECONDS', 8))
+KNACK_RETRY_AFTER_MAX_SECONDS = float(os.getenv('KNACK_RETRY_AFTER_MAX_SECONDS', 30))
+KNACK_RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# --- Shared Cache Backend ---
+# "memory" keeps caches per gunicorn worker; "sqlite" shares them between workers on one dyno;
+# "redis" shares them across the whole deployment. Defaults to redis when REDIS_URL is set.
+REDIS_URL = os.getenv('REDIS_URL')
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'redis' if REDIS_URL else 'memory').lower()
+CACHE_SQLITE_PATH = os.getenv('CACHE_SQLITE_PATH', '/tmp/vespa_coach_cache.sqlite3')
+CACHE_KEY_PREFIX = os.getenv('CACHE_KEY_PREFIX', 'vespa-coach:')
+# Budgets for the in-process caches. Least recently used entries are evicted once either limit is hit.
+MEMORY_CACHE_MAX_ENTRIES = int(os.getenv('MEMORY_CACHE_MAX_ENTRIES', 5000))
+MEMORY_CACHE_MAX_BYTES = int(os.getenv('MEMORY_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+CACHE_SWEEP_INTERVAL_SECONDS = int(os.getenv('CACHE_SWEEP_INTERVAL_SECONDS', 300))
+PARSED_PROFILE_CACHE_MAX_ENTRIES = int(os.getenv('PARSED_PROFILE_CACHE_MAX_ENTRIES', 2000))
+PARSED_PROFILE_CACHE_TTL_SECONDS = int(os.getenv('PARSED_PROFILE_CACHE_TTL_SECONDS', 3600))
+
+# --- Cache for Knack Identity Mappings ---
+# obj10->obj6, obj10->email->obj3 and obj3->obj112 links almost never change, so they are cached
+# for hours rather than re-resolved through Knack on every chat turn / report open.
+IDENTITY_CACHE_TTL_SECONDS = int(os.getenv('IDENTITY_CACHE_TTL_SECONDS', 6 * 3600))
+
 # --- Cache for School VESPA Averages ---
 # Simple in-memory cache with TTL
-SCHOOL_AVERAGES_CACHE = {}
+# Entries live in the shared cache backend (see SCHOOL_AVERAGES_CACHE below).
 CACHE_TTL_SECONDS = 3600  # 1 hour
+# Stale-while-revalidate: between CACHE_TTL_SECONDS and the hard expiry an expired entry is still
+# served immediately while one background thread per school recomputes it.
+SCHOOL_AVERAGES_STALE_WHILE_REVALIDATE = os.getenv('SCHOOL_AVERAGES_STALE_WHILE_REVALIDATE', 'true').lower() in ('1', 'true', 'yes')
+SCHOOL_AVERAGES_HARD_TTL_SECONDS = int(os.getenv('SCHOOL_AVERAGES_HARD_TTL_SECONDS', 6 * 3600))  # 6 hours
+# Pre-warming: compute every school's averages when a worker starts (gunicorn's post_worker_init hook
+# in gunicorn.conf.py, or `python app.py`; never on import). The warm-up always runs in a background
+# thread. PREWARM_ON_STARTUP is "off", "background" (serve meanwhile) or "blocking" (/api/v1/ready
+# reports 503 until the warm-up has finished).
+PREWARM_ON_STARTUP = os.getenv('PREWARM_ON_STARTUP', 'off').lower()
+PREWARM_WORKERS = int(os.getenv('PREWARM_WORKERS', 4))
+# Comma-separated school record ids. When unset, schools are listed from KNACK_SCHOOL_OBJECT_KEY.
+PREWARM_SCHOOL_IDS = [school_id.strip() for school_id in os.getenv('PREWARM_SCHOOL_IDS', '').split(',') if school_id.strip()]
+KNACK_SCHOOL_OBJECT_KEY = os.getenv('KNACK_SCHOOL_OBJECT_KEY', 'object_2')
+
+# --- Cache for LLM Coaching Summaries ---
+# generate_student_summary_with_llm results keyed by a hash of the full request, so reopening an
+# unchanged report costs no tokens. Bump LLM_SUMMARY_CACHE_VERSION to discard all entries.
+LLM_SUMMARY_CACHE_TTL_SECONDS = int(os.getenv('LLM_SUMMARY_CACHE_TTL_SECONDS', 30 * 24 * 3600))
+LLM_SUMMARY_CACHE_SQLITE_PATH = os.getenv('LLM_SUMMARY_CACHE_SQLITE_PATH', '/tmp/vespa_coach_llm_cache.sqlite3')
+LLM_SUMMARY_CACHE_VERSION = os.getenv('LLM_SUMMARY_CACHE_VERSION', '1')
+# "single" asks one completion for all seven summary sections; "sections" sends one smaller
+# completion per section concurrently, so the report waits for the slowest section, not the sum.
+LLM_SUMMARY_MODE = os.getenv('LLM_SUMMARY_MODE', 'single').lower()
+# Section completions share one pool per worker on purpose: it caps concurrent OpenAI calls.
+LLM_SUMMARY_SECTION_WORKERS = int(os.getenv('LLM_SUMMARY_SECTION_WORKERS', 14))
+LLM_SUMMARY_SECTION_TIMEOUT_SECONDS = float(os.getenv('LLM_SUMMARY_SECTION_TIMEOUT_SECONDS', 40))
+
+# --- Chat Message Write-Behind Journal ---
+# chat_turn journals messages to a local SQLite file and a background flusher writes them to Knack
+# (Object_118). The frontend gets a local id back and resolves it (status, likes) against the journal,
+# so the path must be on storage shared by every instance serving the API. The journal is therefore
+# only on by default when CHAT_JOURNAL_PATH is set; otherwise messages are saved synchronously.
+CHAT_JOURNAL_PATH = os.getenv('CHAT_JOURNAL_PATH', '/tmp/vespa_coach_chat_journal.sqlite3')
+CHAT_JOURNAL_ENABLED = os.getenv('CHAT_JOURNAL_ENABLED', 'true' if os.getenv('CHAT_JOURNAL_PATH') else 'false').lower() in ('1', 'true', 'yes')
+CHAT_JOURNAL_FLUSH_INTERVAL_SECONDS = float(os.getenv('CHAT_JOURNAL_FLUSH_INTERVAL_SECONDS', 1))
+CHAT_JOURNAL_BATCH_SIZE = int(os.getenv('CHAT_JOURNAL_BATCH_SIZE', 20))
+CHAT_JOURNAL_MAX_ATTEMPTS = int(os.getenv('CHAT_JOURNAL_MAX_ATTEMPTS', 10))
+CHAT_JOURNAL_RETRY_MAX_SECONDS = int(os.getenv('CHAT_JOURNAL_RETRY_MAX_SECONDS', 300))
+# Rows are claimed one at a time. A row claimed by a worker that died mid-POST becomes claimable again
+# after this long (and is looked up in Knack before being posted again); it must exceed one POST with its retries.
+CHAT_JOURNAL_CLAIM_TIMEOUT_SECONDS = int(os.getenv('CHAT_JOURNAL_CLAIM_TIMEOUT_SECONDS', 120))
+# Saved rows are deleted after this long; until then local ids still resolve for status and like calls.
+CHAT_JOURNAL_SAVED_RETENTION_SECONDS = int(os.getenv('CHAT_JOURNAL_SAVED_RETENTION_SECONDS', 900))
+
+# --- Local Mirror of Object_118 Chat Logs ---
+# chat_history and clear_old_chats read from an indexed SQLite copy of each student's chat log.
+# A student's copy is re-synced from Knack when older than CHAT_MIRROR_RECONCILE_SECONDS on read,
+# and a background reconciler refreshes recently read students on the same schedule. Chat writes
+# update the copy on the instance that made them, so a copy on per-instance storage (e.g. a dyno's
+# /tmp) misses other instances' writes until the next re-sync. Like the journal, the mirror is
+# therefore only on by default when CHAT_MIRROR_PATH is set, to storage every instance shares.
+CHAT_MIRROR_ENABLED = os.getenv('CHAT_MIRROR_ENABLED', 'true' if os.getenv('CHAT_MIRROR_PATH') else 'false').lower() in ('1', 'true', 'yes')
+CHAT_MIRROR_PATH = os.getenv('CHAT_MIRROR_PATH', '/tmp/vespa_coach_chat_mirror.sqlite3')
+CHAT_MIRROR_RECONCILE_SECONDS = int(os.getenv('CHAT_MIRROR_RECONCILE_SECONDS', 300))
+CHAT_MIRROR_ACTIVE_SECONDS = int(os.getenv('CHAT_MIRROR_ACTIVE_SECONDS', 24 * 3600))
+CHAT_MIRROR_RECONCILE_BATCH = int(os.getenv('CHAT_MIRROR_RECONCILE_BATCH', 20))
+
+# --- Background Chat Clearing Jobs ---
+# clear_old_chats deletes in the background; job progress is kept in SQLite so any worker can report it.
+CHAT_CLEAR_JOBS_PATH = os.getenv('CHAT_CLEAR_JOBS_PATH', '/tmp/vespa_coach_chat_clear_jobs.sqlite3')
+CHAT_CLEAR_MAX_CONCURRENT_JOBS = int(os.getenv('CHAT_CLEAR_MAX_CONCURRENT_JOBS', 2))
+# Shared by all jobs in a worker; the Knack rate limiter still caps the overall request rate.
+CHAT_CLEAR_DELETE_WORKERS = int(os.getenv('CHAT_CLEAR_DELETE_WORKERS', 4))
+# A running job whose progress has not moved for this long is reported as interrupted (e.g. its worker restarted).
+CHAT_CLEAR_JOB_STALE_SECONDS = int(os.getenv('CHAT_CLEAR_JOB_STALE_SECONDS', 300))
+
+# --- LLM Client ---
+# Every chat completion goes through LLM_CLIENT. Each call has an overall deadline (attempts are cut to
+# fit it), transient API errors are retried with jittered backoff, and a per-model circuit breaker fails
+# calls immediately while the API keeps failing instead of holding a gunicorn thread for every timeout.
+LLM_REQUEST_TIMEOUT_SECONDS = float(os.getenv('LLM_REQUEST_TIMEOUT_SECONDS', 30))  # per attempt
+LLM_CALL_DEADLINE_SECONDS = float(os.getenv('LLM_CALL_DEADLINE_SECONDS', 45))  # all attempts of one call
+CHAT_TURN_LLM_DEADLINE_SECONDS = float(os.getenv('CHAT_TURN_LLM_DEADLINE_SECONDS', 25))
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', 2))
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv('LLM_BACKOFF_BASE_SECONDS', 0.5))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv('LLM_BACKOFF_MAX_SECONDS', 4))
+LLM_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('LLM_CIRCUIT_FAILURE_THRESHOLD', 5))  # consecutive failures
+LLM_CIRCUIT_RESET_SECONDS = float(os.getenv('LLM_CIRCUIT_RESET_SECONDS', 30))  # open time before a probe call
+# Optional latency SLO per call site ("chat_turn", "chat_turn_stream", "student_summary"), e.g.
+# "chat_turn=6,chat_turn_stream=2" (streams are measured to the first token). While a call site's p95
+# over LLM_LATENCY_WINDOW_SECONDS is above its SLO, or its model's circuit is open, it uses the fallback
+# model from LLM_FALLBACK_MODELS, e.g. "gpt-4o-mini=gpt-3.5-turbo". Unset means no fallback.
+LLM_LATENCY_SLO_P95_SECONDS = {call_name: float(seconds) for call_name, seconds in
+                               (pair.split('=', 1) for pair in os.getenv('LLM_LATENCY_SLO_P95_SECONDS', '').replace(' ', '').split(',') if '=' in pair)}
+LLM_FALLBACK_MODELS = dict(pair.split('=', 1) for pair in os.getenv('LLM_FALLBACK_MODELS', '').replace(' ', '').split(',') if '=' in pair)
+LLM_LATENCY_WINDOW_SECONDS = int(os.getenv('LLM_LATENCY_WINDOW_SECONDS', 300))
+LLM_LATENCY_MIN_SAMPLES = int(os.getenv('LLM_LATENCY_MIN_SAMPLES', 20))
+# OpenAI serves a repeated prompt prefix of at least 1024 tokens (growing in 128-token steps) from its
+# prompt cache for several minutes and reports it as usage.prompt_tokens_details.cached_tokens.
+# LLM_CLIENT simulates the same cache per worker, so the expected and reported savings can be compared.
+PROMPT_CACHE_MIN_TOKENS = int(os.getenv('PROMPT_CACHE_MIN_TOKENS', 1024))
+PROMPT_CACHE_BLOCK_TOKENS = int(os.getenv('PROMPT_CACHE_BLOCK_TOKENS', 128))
+PROMPT_CACHE_TTL_SECONDS = int(os.getenv('PROMPT_CACHE_TTL_SECONDS', 600))
+PROMPT_CACHE_MAX_PREFIXES = int(os.getenv('PROMPT_CACHE_MAX_PREFIXES', 20000))
+
+# --- Chat Prompt Token Budgets ---
+# chat_turn prompts are assembled within a token budget per part (counted with estimate_tokens, which
+# needs no tokenizer download). Parts over budget are trimmed; older chat history beyond the budget is
+# replaced by a rolling summary, while liked messages and the last CHAT_HISTORY_RECENT_MESSAGES stay verbatim.
+CHAT_PROMPT_SYSTEM_TOKENS = int(os.getenv('CHAT_PROMPT_SYSTEM_TOKENS', 2600))
+CHAT_PROMPT_CONTEXT_TOKENS = int(os.getenv('CHAT_PROMPT_CONTEXT_TOKENS', 800))
+CHAT_PROMPT_RAG_TOKENS = int(os.getenv('CHAT_PROMPT_RAG_TOKENS', 1200))
+CHAT_PROMPT_HISTORY_TOKENS = int(os.getenv('CHAT_PROMPT_HISTORY_TOKENS', 2500))
+CHAT_HISTORY_RECENT_MESSAGES = int(os.getenv('CHAT_HISTORY_RECENT_MESSAGES', 6))
+CHAT_HISTORY_SUMMARY_TOKENS = int(os.getenv('CHAT_HISTORY_SUMMARY_TOKENS', 300))
+# Older messages are folded in chunks of CHAT_HISTORY_FOLD_CHUNK_MESSAGES, far enough that the verbatim rest drops to
+# CHAT_HISTORY_FOLD_LOW_WATER of its budget. The fold point then stays put (its summary cached) until the rest
+# overflows again, so the summary call and the change to the prompt prefix happen every few turns, not every turn.
+CHAT_HISTORY_FOLD_CHUNK_MESSAGES = int(os.getenv('CHAT_HISTORY_FOLD_CHUNK_MESSAGES', 10))
+CHAT_HISTORY_FOLD_LOW_WATER = float(os.getenv('CHAT_HISTORY_FOLD_LOW_WATER', 0.6))
+# The rolling summary is written by the LLM (and cached); set false to use the local extractive digest only.
+CHAT_HISTORY_SUMMARY_USE_LLM = os.getenv('CHAT_HISTORY_SUMMARY_USE_LLM', 'true').lower() in ('1', 'true', 'yes')
+CHAT_HISTORY_SUMMARY_DEADLINE_SECONDS = float(os.getenv('CHAT_HISTORY_SUMMARY_DEADLINE_SECONDS', 8))
+CHAT_HISTORY_SUMMARY_TTL_SECONDS = int(os.getenv('CHAT_HISTORY_SUMMARY_TTL_SECONDS', 7 * 24 * 3600))
 
 # Initialize OpenAI client
+# LLMClient owns retries and deadlines, so the SDK's own retry loop is turned off.
+openai.max_retries = 0
 if OPENAI_API_KEY:
     openai.api_key = OPENAI_API_KEY
 else:
@@ -277,40 +461,737 @@ def get_points(normalized_qual_type, grade_str, grade_points_map_data, app_logge
     return int(points)
 
 
-def get_knack_record(object_key, record_id=None, filters=None, page=1, rows_per_page=1000):
+# --- Metrics Counters ---
+# gthread workers serve requests on many threads at once, and += on a shared dict entry is not atomic.
+STATS_LOCK = threading.Lock()
+
+def increment_stat(stats, key, amount=1):
+    """Adds amount to stats[key] (a counter reported by /api/v1/metrics) under STATS_LOCK."""
+    with STATS_LOCK:
+        stats[key] += amount
+
+
+# --- Knack API Client ---
+class TokenBucket:
+    """Thread-safe token bucket. acquire() blocks until a token is available, queueing bursts instead of failing them."""
+
+    def __init__(self, rate_per_second, capacity):
+        self.rate_per_second = max(0.01, float(rate_per_second))
+        self.capacity = max(1.0, float(capacity))
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+        self.total_wait_seconds = 0.0
+
+    def acquire(self):
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate_per_second)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    self.total_wait_seconds += waited
+                    return waited
+                wait_seconds = (1 - self.tokens) / self.rate_per_second
+            time.sleep(wait_seconds)
+            waited += wait_seconds
+
+
+def knack_request_was_not_sent(error):
+    """True for requests exceptions raised before the request reached Knack (DNS, refused or timed-out connect, TLS handshake)."""
+    if isinstance(error, (requests.exceptions.ConnectTimeout, requests.exceptions.SSLError)):
+        return True
+    if isinstance(error, requests.exceptions.ConnectionError) and error.args:
+        return isinstance(getattr(error.args[0], 'reason', None), NewConnectionError)
+    return False
+
+
+class KnackClient:
+    """
+    Pooled, keep-alive client for the Knack REST API.
+    - Holds a single requests.Session so TCP+TLS connections to api.knack.com are reused.
+    - Owns the Knack auth headers so call sites no longer rebuild them.
+    - Every Knack read and write in this module should go through get_knack_client().
+    - Every request waits on a shared token bucket sized to the Knack plan, and 429s / transient
+      5xx / connection errors are retried with jittered exponential backoff (honouring Retry-After).
+    """
+
+    def __init__(self, app_id, api_key, base_url=KNACK_BASE_URL,
+                 pool_connections=KNACK_POOL_CONNECTIONS, pool_maxsize=KNACK_POOL_MAXSIZE,
+                 timeout=KNACK_REQUEST_TIMEOUT_SECONDS, rate_limiter=None, max_retries=KNACK_MAX_RETRIES):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter or TokenBucket(KNACK_RATE_LIMIT_PER_SECOND, KNACK_RATE_LIMIT_BURST)
+        self.max_retries = max_retries
+        self.retry_count = 0
+        self.session = requests.Session()
+        self.session.headers.update({
+            'X-Knack-Application-Id': app_id,
+            'X-Knack-REST-API-Key': api_key,
+            'Content-Type': 'application/json'
+        })
+        # pool_maxsize bounds the keep-alive connections held per host; extra concurrent
+        # requests still go through but their connections are discarded afterwards.
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def records_url(self, object_key, record_id=None):
+        if record_id:
+            return f"{self.base_url}/{object_key}/records/{record_id}"
+        return f"{self.base_url}/{object_key}/records"
+
+    @staticmethod
+    def backoff_delay(attempt):
+        """Full-jitter exponential backoff: uniform(0, min(max, base * 2^attempt))."""
+        return random.uniform(0, min(KNACK_BACKOFF_MAX_SECONDS, KNACK_BACKOFF_BASE_SECONDS * (2 ** attempt)))
+
+    @staticmethod
+    def retry_after_seconds(response):
+        """Parses a Retry-After header (delta-seconds or HTTP-date). Returns None if absent or invalid."""
+        retry_after = response.headers.get('Retry-After')
+        if not retry_after:
+            return None
+        try:
+            seconds = float(retry_after)
+        except ValueError:
+            try:
+                seconds = parsedate_to_datetime(retry_after).timestamp() - time.time()
+            except (TypeError, ValueError):
+                return None
+        return min(KNACK_RETRY_AFTER_MAX_SECONDS, max(0.0, seconds))
+
+    def request(self, method, object_key, record_id=None, **kwargs):
+        """
+        Sends a request for an object's records and returns the raw requests.Response.
+        POSTs are only retried when Knack cannot have created the record (a 429, or an error for which
+        knack_request_was_not_sent holds), so a retry never duplicates a chat log entry. The chat
+        journal uses the same check to decide whether a failed POST may be posted again.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        url = self.records_url(object_key, record_id)
+        is_idempotent = method.upper() != 'POST'
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                can_retry = is_idempotent or knack_request_was_not_sent(e)
+                if not can_retry or attempt >= self.max_retries:
+                    raise
+                delay = self.backoff_delay(attempt)
+                app.logger.warning(f"Knack {method} {object_key} failed with {type(e).__name__} (attempt {attempt + 1}/{self.max_retries + 1}). Retrying in {delay:.2f}s.")
+            else:
+                retryable_status = response.status_code in KNACK_RETRY_STATUS_CODES and (is_idempotent or response.status_code == 429)
+                if not retryable_status or attempt >= self.max_retries:
+                    return response
+                retry_after = self.retry_after_seconds(response)
+                delay = retry_after if retry_after is not None else self.backoff_delay(attempt)
+                app.logger.warning(f"Knack {method} {object_key} returned {response.status_code} (attempt {attempt + 1}/{self.max_retries + 1}). Retrying in {delay:.2f}s{' (Retry-After)' if retry_after is not None else ''}.")
+            with STATS_LOCK:
+                self.retry_count += 1
+            attempt += 1
+            time.sleep(delay)
+
+    def get(self, object_key, record_id=None, params=None):
+        return self.request('GET', object_key, record_id, params=params)
+
+    def post(self, object_key, payload):
+        return self.request('POST', object_key, json=payload)
+
+    def put(self, object_key, record_id, payload):
+        return self.request('PUT', object_key, record_id, json=payload)
+
+    def delete(self, object_key, record_id):
+        return self.request('DELETE', object_key, record_id)
+
+
+_knack_client = None
+_knack_client_pid = None
+_knack_client_lock = threading.Lock()
+
+def get_knack_client():
+    """
+    Returns this worker process's KnackClient, creating it on first use.
+    The pid check makes sure a client (and its sockets) is never shared across a fork.
+    """
+    global _knack_client, _knack_client_pid
+    if not KNACK_APP_ID or not KNACK_API_KEY:
+        app.logger.error("Knack App ID or API Key is missing.")
+        return None
+    current_pid = os.getpid()
+    if _knack_client is None or _knack_client_pid != current_pid:
+        with _knack_client_lock:
+            if _knack_client is None or _knack_client_pid != current_pid:
+                _knack_client = KnackClient(KNACK_APP_ID, KNACK_API_KEY)
+                _knack_client_pid = current_pid
+                app.logger.info(f"Created pooled Knack client for worker pid {current_pid} (pool_maxsize={KNACK_POOL_MAXSIZE}).")
+    return _knack_client
+
+
+# --- LLM Client ---
+class LLMUnavailableError(Exception):
+    """Raised without calling the API while a model's circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker. After failure_threshold failures in a row it opens and
+    allow() fails fast; once reset_seconds have passed a single probe call is let through, which
+    closes the circuit on success or re-opens it on failure.
+    """
+
+    def __init__(self, name, failure_threshold=LLM_CIRCUIT_FAILURE_THRESHOLD, reset_seconds=LLM_CIRCUIT_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_seconds = reset_seconds
+        self.lock = threading.Lock()
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.open_count = 0
+
+    def is_open(self):
+        """True while calls are being refused (open, and not yet due a probe)."""
+        with self.lock:
+            return self.state == "half_open" or (self.state == "open" and time.monotonic() - self.opened_at < self.reset_seconds)
+
+    def allow(self):
+        with self.lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = "half_open" # This caller is the probe; everyone else keeps failing fast.
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            if self.state != "closed":
+                app.logger.info(f"Circuit for {self.name} closed.")
+            self.state = "closed"
+            self.consecutive_failures = 0
+
+    def record_failure(self):
+        with self.lock:
+            self.consecutive_failures += 1
+            if self.state == "half_open" or (self.state == "closed" and self.consecutive_failures >= self.failure_threshold):
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self.open_count += 1
+                app.logger.error(f"Circuit for {self.name} opened after {self.consecutive_failures} consecutive failures; failing fast for {self.reset_seconds:.0f}s.")
+
+    def stats(self):
+        with self.lock:
+            return {"state": self.state, "consecutive_failures": self.consecutive_failures, "open_count": self.open_count}
+
+
+class PromptPrefixCache:
+    """
+    Local stand-in for provider prompt caching. observe() returns how many of a request's prompt tokens
+    a provider cache would serve: the longest prefix (at least min_tokens, then in block_tokens steps)
+    already sent to the same model within ttl_seconds. Token counts use estimate_tokens.
+    """
+
+    def __init__(self, min_tokens=PROMPT_CACHE_MIN_TOKENS, block_tokens=PROMPT_CACHE_BLOCK_TOKENS,
+                 ttl_seconds=PROMPT_CACHE_TTL_SECONDS, max_prefixes=PROMPT_CACHE_MAX_PREFIXES):
+        self.min_tokens = min_tokens
+        self.block_tokens = max(1, block_tokens)
+        self.ttl_seconds = ttl_seconds
+        self.max_prefixes = max_prefixes
+        self.lock = threading.Lock()
+        self.prefixes = OrderedDict()  # chained prefix hash -> last seen (monotonic)
+
+    def prefix_hashes(self, model, messages):
+        """(prefix_tokens, hash) at each cacheable boundary; each hash covers the model and everything before it."""
+        serialized = "".join(f"<|{message.get('role')}|>{message.get('content') or ''}" for message in messages)
+        digest = hashlib.sha256(model.encode('utf-8'))
+        boundaries = []
+        used_tokens, hashed_up_to, next_boundary = 0, 0, self.min_tokens
+        for match in TOKEN_ESTIMATE_PATTERN.finditer(serialized):
+            used_tokens += estimated_piece_tokens(match.group(0))
+            if used_tokens >= next_boundary:
+                digest.update(serialized[hashed_up_to:match.end()].encode('utf-8'))
+                hashed_up_to = match.end()
+                boundaries.append((used_tokens, digest.hexdigest()))
+                next_boundary = used_tokens + self.block_tokens
+        return boundaries
+
+    def observe(self, model, messages):
+        boundaries = self.prefix_hashes(model, messages)
+        now = time.monotonic()
+        cached_tokens = 0
+        with self.lock:
+            for prefix_tokens, prefix_hash in boundaries:
+                last_seen = self.prefixes.get(prefix_hash)
+                if last_seen is None or now - last_seen > self.ttl_seconds:
+                    break
+                cached_tokens = prefix_tokens
+            for _, prefix_hash in boundaries:
+                self.prefixes[prefix_hash] = now
+                self.prefixes.move_to_end(prefix_hash)
+            while len(self.prefixes) > self.max_prefixes:
+                self.prefixes.popitem(last=False)
+        return cached_tokens
+
+
+class LLMClient:
+    """
+    Shared wrapper around openai.chat.completions.create. Every LLM call in this module should go
+    through LLM_CLIENT.create(call_name, **request), which:
+    - gives the call an overall deadline and each attempt the time left of it (up to LLM_REQUEST_TIMEOUT_SECONDS),
+    - retries timeouts, connection errors, 429s and 5xx with full-jitter exponential backoff,
+    - fails fast with LLMUnavailableError while the model's circuit breaker is open,
+    - switches to the model's LLM_FALLBACK_MODELS entry while that circuit is open or the call
+      site's p95 latency is over its LLM_LATENCY_SLO_P95_SECONDS, and
+    - records latency and token usage per call site, including the prompt tokens the API served from
+      its prompt cache next to the number PromptPrefixCache expected it to.
+    """
+
+    TRANSIENT_ERRORS = (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
+
+    def __init__(self, timeout=LLM_REQUEST_TIMEOUT_SECONDS, deadline_seconds=LLM_CALL_DEADLINE_SECONDS, max_retries=LLM_MAX_RETRIES,
+                 latency_slos=None, fallback_models=None, prompt_cache=None):
+        self.timeout = timeout
+        self.deadline_seconds = deadline_seconds
+        self.max_retries = max_retries
+        self.latency_slos = LLM_LATENCY_SLO_P95_SECONDS if latency_slos is None else latency_slos
+        self.fallback_models = LLM_FALLBACK_MODELS if fallback_models is None else fallback_models
+        self.lock = threading.Lock()
+        self.breakers = {}
+        self.latency_samples = {}  # (call_name, model) -> deque of (finished_at, seconds)
+        self.call_stats = {}
+        self.prompt_cache = prompt_cache or PromptPrefixCache()
+
+    @staticmethod
+    def backoff_delay(attempt):
+        """Full-jitter exponential backoff: uniform(0, min(max, base * 2^attempt))."""
+        return random.uniform(0, min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_BASE_SECONDS * (2 ** attempt)))
+
+    def breaker(self, model):
+        with self.lock:
+            if model not in self.breakers:
+                self.breakers[model] = CircuitBreaker(f"LLM model {model}")
+            return self.breakers[model]
+
+    def _stats_for(self, call_name):
+        # Callers hold self.lock.
+        return self.call_stats.setdefault(call_name, {
+            "calls": 0, "errors": 0, "retries": 0, "short_circuited": 0, "fallbacks": 0,
+            "total_seconds": 0.0, "prompt_tokens": 0, "completion_tokens": 0,
+            "cached_prompt_tokens": 0, "expected_cached_prompt_tokens": 0
+        })
+
+    def _count(self, call_name, counter):
+        with self.lock:
+            self._stats_for(call_name)[counter] += 1
+
+    def p95_latency(self, call_name, model):
+        """p95 latency in seconds over the recent window, or None with fewer than LLM_LATENCY_MIN_SAMPLES samples."""
+        with self.lock:
+            samples = self.latency_samples.get((call_name, model))
+            if not samples:
+                return None
+            cutoff = time.monotonic() - LLM_LATENCY_WINDOW_SECONDS
+            while samples and samples[0][0] < cutoff:
+                samples.popleft()
+            if len(samples) < LLM_LATENCY_MIN_SAMPLES:
+                return None
+            latencies = sorted(seconds for _, seconds in samples)
+        return latencies[int(0.95 * (len(latencies) - 1))]
+
+    def route_model(self, call_name, model):
+        """
+        The model to use for this call. Once the primary is routed around it gets no new latency
+        samples, so it is tried again when its slow samples age out of the window.
+        """
+        fallback_model = self.fallback_models.get(model)
+        if not fallback_model or fallback_model == model:
+            return model
+        if self.breaker(model).is_open() and not self.breaker(fallback_model).is_open():
+            return fallback_model
+        slo_seconds = self.latency_slos.get(call_name)
+        if slo_seconds:
+            p95_seconds = self.p95_latency(call_name, model)
+            if p95_seconds is not None and p95_seconds > slo_seconds:
+                return fallback_model
+        return model
+
+    def _record(self, call_name, model, seconds, usage=None, latency_seconds=None, expected_cached_tokens=0):
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        cached_tokens = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", 0) or 0
+        with self.lock:
+            call_stats = self._stats_for(call_name)
+            call_stats["calls"] += 1
+            call_stats["total_seconds"] = round(call_stats["total_seconds"] + seconds, 3)
+            call_stats["prompt_tokens"] += prompt_tokens
+            call_stats["completion_tokens"] += completion_tokens
+            call_stats["cached_prompt_tokens"] += cached_tokens
+            call_stats["expected_cached_prompt_tokens"] += expected_cached_tokens
+            if latency_seconds is not None:
+                self.latency_samples.setdefault((call_name, model), deque(maxlen=1000)).append((time.monotonic(), latency_seconds))
+        app.logger.info(f"LLM {call_name} ({model}): {seconds:.2f}s, {prompt_tokens} prompt ({cached_tokens} cached, ~{expected_cached_tokens} expected) + {completion_tokens} completion tokens.")
+
+    def create(self, call_name, deadline_seconds=None, **request):
+        """
+        Calls openai.chat.completions.create(**request) and returns (response, model_used).
+        model_used differs from request["model"] when the fallback model answered. With stream=True
+        the response is a generator of chunks; pass stream_options={"include_usage": True} to record tokens.
+        """
+        requested_model = request["model"]
+        model = self.route_model(call_name, requested_model)
+        if model != requested_model:
+            self._count(call_name, "fallbacks")
+            request = dict(request, model=model)
+        breaker = self.breaker(model)
+        if not breaker.allow():
+            self._count(call_name, "short_circuited")
+            raise LLMUnavailableError(f"LLM model {model} is unavailable (circuit open); not calling the API for {call_name}.")
+        expected_cached_tokens = self.prompt_cache.observe(model, request.get("messages", []))
+
+        deadline = time.monotonic() + (deadline_seconds or self.deadline_seconds)
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            try:
+                response = openai.chat.completions.create(timeout=max(0.1, min(self.timeout, deadline - started)), **request)
+            except Exception as e:
+                transient = isinstance(e, self.TRANSIENT_ERRORS)
+                if transient or not isinstance(e, openai.APIStatusError):
+                    breaker.record_failure()
+                else:
+                    breaker.record_success() # The API answered; it rejected this request.
+                delay = self.backoff_delay(attempt)
+                if not transient or attempt >= self.max_retries or breaker.is_open() or time.monotonic() + delay >= deadline:
+                    self._count(call_name, "errors")
+                    raise
+                app.logger.warning(f"LLM {call_name} ({model}) failed with {type(e).__name__} (attempt {attempt + 1}/{self.max_retries + 1}). Retrying in {delay:.2f}s.")
+                self._count(call_name, "retries")
+                attempt += 1
+                time.sleep(delay)
+                continue
+
+            breaker.record_success()
+            if request.get("stream"):
+                return self._observe_stream(response, call_name, model, started, expected_cached_tokens), model
+            seconds = time.monotonic() - started
+            self._record(call_name, model, seconds, getattr(response, "usage", None), latency_seconds=seconds, expected_cached_tokens=expected_cached_tokens)
+            return response, model
+
+    def _observe_stream(self, stream, call_name, model, started, expected_cached_tokens=0):
+        """Passes chunks through, recording time to first chunk (the latency sample) and the final usage chunk."""
+        first_chunk_seconds = None
+        usage = None
+        try:
+            for chunk in stream:
+                if first_chunk_seconds is None:
+                    first_chunk_seconds = time.monotonic() - started
+                usage = getattr(chunk, "usage", None) or usage
+                yield chunk
+        except Exception:
+            self._count(call_name, "errors")
+            raise
+        finally:
+            close_stream = getattr(stream, "close", None)
+            if close_stream:
+                close_stream() # Releases the HTTP connection if the consumer stopped early.
+            self._record(call_name, model, time.monotonic() - started, usage, latency_seconds=first_chunk_seconds, expected_cached_tokens=expected_cached_tokens)
+
+    def stats(self):
+        with self.lock:
+            call_stats = {call_name: dict(counters) for call_name, counters in self.call_stats.items()}
+            sample_keys = list(self.latency_samples)
+            breakers = dict(self.breakers)
+        for call_name, model in sample_keys:
+            if call_name in call_stats:
+                call_stats[call_name].setdefault("p95_seconds", {})[model] = self.p95_latency(call_name, model)
+        return {"calls": call_stats, "circuits": {model: breaker.stats() for model, breaker in breakers.items()}}
+
+
+LLM_CLIENT = LLMClient()
+
+
+# --- Request Coalescing (Singleflight) ---
+class SingleFlight:
+    """
+    Collapses concurrent identical calls into one upstream call.
+    The first caller for a key (the leader) runs the function; callers arriving while it is
+    in flight wait for the leader and share its result (or its exception).
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.leader_calls = 0
+        self.collapsed_calls = 0
+
+    def do(self, key, fn):
+        """Returns (result, shared) where shared is True if the result came from another caller's in-flight call."""
+        with self.lock:
+            call = self.in_flight.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = {'event': threading.Event(), 'result': None, 'error': None}
+                self.in_flight[key] = call
+                self.leader_calls += 1
+            else:
+                self.collapsed_calls += 1
+
+        if not is_leader:
+            call['event'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['result'], True
+
+        try:
+            call['result'] = fn()
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self.lock:
+                self.in_flight.pop(key, None)
+            call['event'].set()
+        return call['result'], False
+
+    def stats(self):
+        with self.lock:
+            total_calls = self.leader_calls + self.collapsed_calls
+            return {
+                "upstream_calls": self.leader_calls,
+                "collapsed_calls": self.collapsed_calls,
+                "collapse_ratio": round(self.collapsed_calls / total_calls, 4) if total_calls else 0.0,
+                "in_flight": len(self.in_flight)
+            }
+
+
+KNACK_RECORD_SINGLEFLIGHT = SingleFlight("get_knack_record")
+KNACK_ALL_RECORDS_SINGLEFLIGHT = SingleFlight("get_all_knack_records")
+
+def knack_query_key(*parts):
+    """Stable key for a Knack query (object_key, record_id, filters, paging...)."""
+    return json.dumps(parts, sort_keys=True, default=str)
+
+
+# --- Request-Scoped Record Memo ---
+# Identity map stored on flask.g: within one request, a record fetched by id (e.g. the student's
+# Object_10) is only fetched from Knack once, however many helpers ask for it.
+REQUEST_MEMO_STATS = {"hits": 0, "misses": 0}
+
+def _get_request_record_memo():
+    if not has_request_context():
+        return None
+    if 'knack_record_memo' not in g:
+        g.knack_record_memo = {}
+    return g.knack_record_memo
+
+def remember_request_record(object_key, record_id, record):
+    memo = _get_request_record_memo()
+    if memo is not None and record_id and isinstance(record, dict):
+        memo[(object_key, record_id)] = record
+
+def forget_request_record(object_key, record_id):
+    """Drops a memoised record, e.g. after it has been written to."""
+    memo = _get_request_record_memo()
+    if memo is not None:
+        memo.pop((object_key, record_id), None)
+
+def bind_request_context(fn):
+    """
+    Wraps fn so it can run on a worker thread with the current request's context and record memo.
+    Pushing a copied request context gives the thread a fresh flask.g, so the memo is re-attached.
+    """
+    if not has_request_context():
+        return fn
+    memo = _get_request_record_memo()
+
+    @copy_current_request_context
+    def run_in_request_context(*args, **kwargs):
+        g.knack_record_memo = memo
+        return fn(*args, **kwargs)
+    return run_in_request_context
+
+
+# --- Parallel Task Graph ---
+class TaskGraph:
+    """
+    Runs named tasks on a thread pool as soon as their dependencies have finished.
+    Each task receives its dependencies' results as keyword arguments. A task that fails or
+    misses its deadline yields its default instead, so one slow Knack lookup cannot stall the rest.
+    End-to-end latency becomes the longest dependency path rather than the sum of all tasks.
+    Without a shared executor each run gets its own pool with a thread per task, so tasks never queue
+    behind other requests and a timed-out task's thread is not taken from anyone else. Deadlines
+    count from when a task starts running, not from when it was queued.
+    """
+    stats_lock = threading.Lock()
+    stats = {}
+    QUEUE_POLL_SECONDS = 0.05 # How often queued tasks are checked for having started (their deadline begins then)
+
+    def __init__(self, name, executor=None):
+        self.name = name
+        self.executor = executor
+        self.tasks = {}
+
+    def add(self, task_name, fn, deps=(), timeout=None, default=None):
+        for dep in deps:
+            if dep not in self.tasks:
+                raise ValueError(f"Task '{task_name}' depends on unknown task '{dep}'.")
+        self.tasks[task_name] = {"fn": fn, "deps": tuple(deps), "timeout": timeout, "default": default}
+        return self
+
+    def _record(self, task_name, status, seconds):
+        with TaskGraph.stats_lock:
+            task_stats = TaskGraph.stats.setdefault(f"{self.name}.{task_name}", {"ok": 0, "timeout": 0, "error": 0, "total_seconds": 0.0})
+            task_stats[status] += 1
+            task_stats["total_seconds"] = round(task_stats["total_seconds"] + seconds, 3)
+
+    def run(self):
+        """Executes the graph and returns (results, report); report maps task name to status and seconds."""
+        results, report = {}, {}
+        for task_name, result, task_report in self.iter_results():
+            results[task_name] = result
+            report[task_name] = task_report
+        return results, report
+
+    @staticmethod
+    def _start_clock(fn, task_name, run_started_at):
+        def run_and_record_start(**kwargs):
+            run_started_at[task_name] = time.time()
+            return fn(**kwargs)
+        return run_and_record_start
+
+    def iter_results(self):
+        """Executes the graph, yielding (task_name, result, task_report) as each task finishes, fails or times out."""
+        if self.executor is not None:
+            yield from self._iter_results(self.executor)
+            return
+        executor = ThreadPoolExecutor(max_workers=max(1, len(self.tasks)), thread_name_prefix=f"task-graph-{self.name}")
+        try:
+            yield from self._iter_results(executor)
+        finally:
+            # Does not wait: a timed-out task's thread finishes in the background and then exits.
+            executor.shutdown(wait=False)
+
+    def _iter_results(self, executor):
+        results, report = {}, {}
+        running = {}  # future -> (task_name, submitted_at)
+        run_started_at = {}  # task_name -> when its function began running (set by the worker thread)
+        pending = dict(self.tasks)
+        graph_started_at = time.time()
+
+        def deadline_of(task_name):
+            timeout = self.tasks[task_name]["timeout"]
+            started_at = run_started_at.get(task_name)
+            return started_at + timeout if timeout and started_at is not None else None
+
+        while pending or running:
+            for task_name in [name for name, task in pending.items() if all(dep in results for dep in task["deps"])]:
+                task = pending.pop(task_name)
+                dep_results = {dep: results[dep] for dep in task["deps"]}
+                future = executor.submit(bind_request_context(self._start_clock(task["fn"], task_name, run_started_at)), **dep_results)
+                running[future] = (task_name, time.time())
+
+            deadlines = [deadline_of(task_name) for task_name, _ in running.values()]
+            wait_seconds = max(0, min(deadline for deadline in deadlines if deadline is not None) - time.time()) \
+                if any(deadline is not None for deadline in deadlines) else None
+            if any(self.tasks[task_name]["timeout"] and task_name not in run_started_at for task_name, _ in running.values()):
+                # A queued task's deadline only starts once a thread picks it up.
+                wait_seconds = min(wait_seconds, self.QUEUE_POLL_SECONDS) if wait_seconds is not None else self.QUEUE_POLL_SECONDS
+            done, _ = wait(list(running), timeout=wait_seconds, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                task_name, started_at = running.pop(future)
+                elapsed = time.time() - started_at
+                try:
+                    results[task_name] = future.result()
+                    report[task_name] = {"status": "ok", "seconds": round(elapsed, 3)}
+                except Exception as e:
+                    app.logger.error(f"Task graph '{self.name}': task '{task_name}' failed after {elapsed:.2f}s: {e}")
+                    results[task_name] = self.tasks[task_name]["default"]
+                    report[task_name] = {"status": "error", "seconds": round(elapsed, 3)}
+                self._record(task_name, report[task_name]["status"], elapsed)
+                yield task_name, results[task_name], report[task_name]
+
+            now = time.time()
+            for future, (task_name, started_at) in list(running.items()):
+                deadline = deadline_of(task_name)
+                if deadline is not None and now >= deadline:
+                    # The thread cannot be interrupted; it finishes in the background and its result is ignored.
+                    running.pop(future)
+                    app.logger.warning(f"Task graph '{self.name}': task '{task_name}' timed out after {now - run_started_at[task_name]:.2f}s of running "
+                                       f"({now - started_at:.2f}s since it was queued); using its default.")
+                    results[task_name] = self.tasks[task_name]["default"]
+                    report[task_name] = {"status": "timeout", "seconds": round(now - started_at, 3)}
+                    self._record(task_name, "timeout", now - started_at)
+                    yield task_name, results[task_name], report[task_name]
+
+        app.logger.info(f"Task graph '{self.name}' finished in {time.time() - graph_started_at:.2f}s: {report}")
+
+    @classmethod
+    def collect_stats(cls):
+        with cls.stats_lock:
+            return {task_name: dict(task_stats) for task_name, task_stats in cls.stats.items()}
+
+
+def get_knack_record(object_key, record_id=None, filters=None, page=1, rows_per_page=1000, sort_field=None, sort_order=None):
     """
     Fetches records from a Knack object.
-    - If record_id is provided, fetches a specific record.
+    - If record_id is provided, fetches a specific record (memoised for the current request).
     - If filters are provided, fetches records matching the filters.
     - Handles pagination for fetching multiple records.
+    - sort_field/sort_order ('asc' or 'desc') sort on the Knack side, before pagination.
+    - Concurrent identical queries share one upstream call (see SingleFlight).
     """
-    if not KNACK_APP_ID or not KNACK_API_KEY:
-        app.logger.error("Knack App ID or API Key is missing.")
+    memo = _get_request_record_memo() if record_id else None
+    if memo is not None:
+        memoised_record = memo.get((object_key, record_id))
+        if memoised_record is not None:
+            increment_stat(REQUEST_MEMO_STATS, "hits")
+            app.logger.info(f"Using request-memoised {object_key} record {record_id}.")
+            return copy.deepcopy(memoised_record)
+        increment_stat(REQUEST_MEMO_STATS, "misses")
+
+    query_key = knack_query_key(object_key, record_id, filters, page, rows_per_page, sort_field, sort_order)
+    result, shared = KNACK_RECORD_SINGLEFLIGHT.do(
+        query_key, lambda: _fetch_knack_record(object_key, record_id, filters, page, rows_per_page, sort_field, sort_order))
+    if shared:
+        app.logger.info(f"Coalesced Knack fetch for {object_key} (record_id={record_id}, page {page}) with an identical in-flight request.")
+        # Each caller gets its own copy, down to the records list and its dicts, so in-place edits don't leak between requests.
+        result = copy.deepcopy(result)
+    if memo is not None and result:
+        remember_request_record(object_key, record_id, copy.deepcopy(result))
+    return result
+
+
+def _fetch_knack_record(object_key, record_id=None, filters=None, page=1, rows_per_page=1000, sort_field=None, sort_order=None):
+    knack_client = get_knack_client()
+    if not knack_client:
         return None
 
-    headers = {
-        'X-Knack-Application-Id': KNACK_APP_ID,
-        'X-Knack-REST-API-Key': KNACK_API_KEY,
-        'Content-Type': 'application/json'
-    }
-    
     params = {'page': page, 'rows_per_page': rows_per_page}
     if filters:
         params['filters'] = json.dumps(filters)
+    if sort_field:
+        params['sort_field'] = sort_field
+        params['sort_order'] = sort_order or 'asc'
 
     if record_id:
-        url = f"{KNACK_BASE_URL}/{object_key}/records/{record_id}"
         action = "fetch specific record"
         current_params = {} # No params for specific record ID fetch typically
     else:
-        url = f"{KNACK_BASE_URL}/{object_key}/records"
         action = f"fetch records (page {page}) with filters: {filters if filters else 'None'}"
         current_params = params
 
+    url = knack_client.records_url(object_key, record_id)
     app.logger.info(f"Attempting to {action} from Knack: object_key={object_key}, URL={url}, Params={current_params}")
 
     try:
-        response = requests.get(url, headers=headers, params=current_params)
+        response = knack_client.get(object_key, record_id, params=current_params)
         response.raise_for_status()  # Raises an HTTPError for bad responses (4XX or 5XX)
         
         app.logger.info(f"Knack API response status: {response.status_code} for object {object_key} (page {page})")
@@ -327,115 +1208,685 @@ def get_knack_record(object_key, record_id=None, filters=None, page=1, rows_per_
     return None
 
 
-# --- Function to fetch Academic Profile (Object_112) ---
-def get_academic_profile(actual_student_obj3_id, student_name_for_fallback, student_obj10_id_log_ref):
-    app.logger.info(f"Starting academic profile fetch. Target Student's Object_3 ID: '{actual_student_obj3_id}', Fallback Name: '{student_name_for_fallback}', Original Obj10 ID for logging: {student_obj10_id_log_ref}.")
-    
-    academic_profile_record = None
-    subjects_summary = []
+# --- Bounded In-Process Cache ---
+def estimate_cache_entry_size(value):
+    """Rough in-memory footprint of a cache value, measured as its JSON length."""
+    try:
+        return len(json.dumps(value, default=str))
+    except (TypeError, ValueError):
+        return len(str(value))
 
-    # Attempt 1: Fetch Object_112 using actual_student_obj3_id against Object_112.field_3064 (UserId - Short Text field)
-    if actual_student_obj3_id:
-        app.logger.info(f"Attempt 1: Fetching Object_112 where field_3064 (UserId Text) is '{actual_student_obj3_id}'.")
-        filters_obj112_via_field3064 = [{'field': 'field_3064', 'operator': 'is', 'value': actual_student_obj3_id}]
-        obj112_response_attempt1 = get_knack_record("object_112", filters=filters_obj112_via_field3064)
-
-        temp_profiles_list_attempt1 = []
-        if obj112_response_attempt1 and isinstance(obj112_response_attempt1, dict) and \
-           'records' in obj112_response_attempt1 and isinstance(obj112_response_attempt1['records'], list):
-            temp_profiles_list_attempt1 = obj112_response_attempt1['records']
-            app.logger.info(f"Attempt 1: Found {len(temp_profiles_list_attempt1)} candidate profiles via field_3064.")
-        else:
-            app.logger.info(f"Attempt 1: Knack response for field_3064 query was not in expected format or no records. Response: {str(obj112_response_attempt1)[:200]}")
-
-        if temp_profiles_list_attempt1: # Check if list is not empty
-            if isinstance(temp_profiles_list_attempt1[0], dict):
-                academic_profile_record = temp_profiles_list_attempt1[0]
-                app.logger.info(f"Attempt 1 SUCCESS: Found Object_112 record ID {academic_profile_record.get('id')} using field_3064 with Obj3 ID '{actual_student_obj3_id}'. Profile Name: {academic_profile_record.get('field_3066')}")
-                subjects_summary = parse_subjects_from_profile_record(academic_profile_record)
-                if not subjects_summary or (len(subjects_summary) == 1 and subjects_summary[0]["subject"].startswith("No academic subjects")):
-                    app.logger.info(f"Object_112 ID {academic_profile_record.get('id')} (via field_3064) yielded no valid subjects. Will try other methods.")
-                    academic_profile_record = None # Keep it None to fall through
-                else:
-                    app.logger.info(f"Object_112 ID {academic_profile_record.get('id')} (via field_3064) has valid subjects. Using this profile.")
-                    return {"subjects": subjects_summary, "profile_record": academic_profile_record} # MODIFIED RETURN
-            else:
-                app.logger.warning(f"Attempt 1: First item in profiles_via_field3064 is not a dict: {type(temp_profiles_list_attempt1[0])}")
+
+class BoundedCache:
+    """
+    Thread-safe TTL cache with LRU eviction under an entry-count and byte budget.
+    Expired entries are dropped on read and by a periodic sweep, so keys that are never
+    read again do not pin memory in long-running workers.
+    """
+
+    def __init__(self, name, max_entries, max_bytes=None, default_ttl_seconds=None,
+                 sweep_interval_seconds=CACHE_SWEEP_INTERVAL_SECONDS, size_of=estimate_cache_entry_size):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.default_ttl_seconds = default_ttl_seconds
+        self.sweep_interval_seconds = sweep_interval_seconds
+        self.size_of = size_of
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> (value, expires_at, size_bytes); oldest use first
+        self.total_bytes = 0
+        self.next_sweep_at = time.time() + sweep_interval_seconds
+        self.counters = {"hits": 0, "misses": 0, "sets": 0, "evictions": 0, "expirations": 0}
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry[2]
+        return entry
+
+    def _sweep_if_due(self, now):
+        if now < self.next_sweep_at:
+            return
+        self.next_sweep_at = now + self.sweep_interval_seconds
+        for key in [k for k, entry in self.entries.items() if entry[1] is not None and entry[1] <= now]:
+            self._remove(key)
+            self.counters["expirations"] += 1
+
+    def _evict_to_budget(self):
+        while self.entries and (len(self.entries) > self.max_entries or
+                                (self.max_bytes is not None and self.total_bytes > self.max_bytes)):
+            self._remove(next(iter(self.entries)))
+            self.counters["evictions"] += 1
+
+    def _live_entry(self, key, now):
+        entry = self.entries.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= now:
+            self._remove(key)
+            self.counters["expirations"] += 1
+            return None
+        return entry
+
+    def _store(self, key, value, ttl_seconds, now):
+        ttl_seconds = ttl_seconds if ttl_seconds is not None else self.default_ttl_seconds
+        size_bytes = self.size_of(value)
+        self._remove(key)
+        self.entries[key] = (value, now + ttl_seconds if ttl_seconds is not None else None, size_bytes)
+        self.total_bytes += size_bytes
+        self.counters["sets"] += 1
+        self._evict_to_budget()
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self.lock:
+            self._sweep_if_due(now)
+            entry = self._live_entry(key, now)
+            if entry is None:
+                self.counters["misses"] += 1
+                return default
+            self.entries.move_to_end(key)
+            self.counters["hits"] += 1
+            return entry[0]
+
+    def set(self, key, value, ttl_seconds=None):
+        now = time.time()
+        with self.lock:
+            self._sweep_if_due(now)
+            self._store(key, value, ttl_seconds, now)
+
+    def add(self, key, value, ttl_seconds=None):
+        """Stores value only if key is absent or expired. Returns True if it was stored."""
+        now = time.time()
+        with self.lock:
+            if self._live_entry(key, now) is not None:
+                return False
+            self._store(key, value, ttl_seconds, now)
+            return True
+
+    def pop(self, key, default=None):
+        with self.lock:
+            entry = self._remove(key)
+            return entry[0] if entry is not None else default
+
+    def pop_if_equal(self, key, value):
+        """Removes key only if it still holds value. Returns True if it was removed."""
+        with self.lock:
+            entry = self._live_entry(key, time.time())
+            if entry is None or entry[0] != value:
+                return False
+            self._remove(key)
+            return True
+
+    def delete_prefix(self, prefix):
+        with self.lock:
+            for key in [k for k in self.entries if isinstance(k, str) and k.startswith(prefix)]:
+                self._remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def sweep(self):
+        """Drops every expired entry now, regardless of the sweep interval."""
+        with self.lock:
+            self.next_sweep_at = 0
+            self._sweep_if_due(time.time())
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, name=self.name, size=len(self.entries), bytes=self.total_bytes,
+                        max_entries=self.max_entries, max_bytes=self.max_bytes)
+
+
+# --- Shared Cache Backends ---
+class CacheBackend:
+    """
+    Interface for the key/value store behind the app's caches.
+    Values must be JSON-serialisable. Implementations must never raise: a cache failure is
+    logged and treated as a miss so requests fall back to Knack.
+    """
+    name = "base"
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl_seconds):
+        raise NotImplementedError
+
+    def add(self, key, value, ttl_seconds):
+        """Sets key only if it is absent (or expired). Returns True if it was set; used as a cross-worker lock."""
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def delete_if_equal(self, key, value):
+        """Deletes key only if it still holds value, atomically. Returns True if it was deleted; used to release a lock taken with add()."""
+        raise NotImplementedError
+
+    def delete_prefix(self, prefix):
+        raise NotImplementedError
+
+
+class MemoryCacheBackend(CacheBackend):
+    """Per-process store with expiry and an LRU budget. Each gunicorn worker has its own copy."""
+    name = "memory"
+
+    def __init__(self, max_entries=MEMORY_CACHE_MAX_ENTRIES, max_bytes=MEMORY_CACHE_MAX_BYTES):
+        # Values are kept JSON-encoded, so len() of the stored string is an honest size estimate.
+        self.entries = BoundedCache("shared_memory", max_entries=max_entries, max_bytes=max_bytes, size_of=len)
+
+    def get(self, key):
+        raw_value = self.entries.get(key)
+        return json.loads(raw_value) if raw_value is not None else None
+
+    def set(self, key, value, ttl_seconds):
+        self.entries.set(key, json.dumps(value), ttl_seconds)
+
+    def add(self, key, value, ttl_seconds):
+        return self.entries.add(key, json.dumps(value), ttl_seconds)
+
+    def delete(self, key):
+        self.entries.pop(key)
+
+    def delete_if_equal(self, key, value):
+        return self.entries.pop_if_equal(key, json.dumps(value))
+
+    def delete_prefix(self, prefix):
+        self.entries.delete_prefix(prefix)
+
+    def stats(self):
+        return self.entries.stats()
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """
+    Local stand-in for a shared cache: a SQLite file that every worker on the same host opens.
+    Useful for testing cross-worker sharing without a Redis server.
+    """
+    name = "sqlite"
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        with self._connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS cache_entries (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)")
+
+    def _connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or getattr(self.local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        try:
+            row = self._connection().execute("SELECT value, expires_at FROM cache_entries WHERE key = ?", (key,)).fetchone()
+            if row is None or row[1] <= time.time():
+                return None
+            return json.loads(row[0])
+        except (sqlite3.Error, ValueError) as e:
+            app.logger.warning(f"SQLite cache get failed for {key}: {e}")
+            return None
+
+    def set(self, key, value, ttl_seconds):
+        try:
+            self._connection().execute("INSERT OR REPLACE INTO cache_entries (key, value, expires_at) VALUES (?, ?, ?)",
+                                       (key, json.dumps(value), time.time() + ttl_seconds))
+        except sqlite3.Error as e:
+            app.logger.warning(f"SQLite cache set failed for {key}: {e}")
+
+    def add(self, key, value, ttl_seconds):
+        try:
+            conn = self._connection()
+            conn.execute("DELETE FROM cache_entries WHERE key = ? AND expires_at <= ?", (key, time.time()))
+            cursor = conn.execute("INSERT OR IGNORE INTO cache_entries (key, value, expires_at) VALUES (?, ?, ?)",
+                                  (key, json.dumps(value), time.time() + ttl_seconds))
+            return cursor.rowcount == 1
+        except sqlite3.Error as e:
+            app.logger.warning(f"SQLite cache add failed for {key}: {e}")
+            return False
+
+    def delete(self, key):
+        try:
+            self._connection().execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+        except sqlite3.Error as e:
+            app.logger.warning(f"SQLite cache delete failed for {key}: {e}")
+
+    def delete_if_equal(self, key, value):
+        try:
+            cursor = self._connection().execute("DELETE FROM cache_entries WHERE key = ? AND value = ? AND expires_at > ?",
+                                                (key, json.dumps(value), time.time()))
+            return cursor.rowcount == 1
+        except sqlite3.Error as e:
+            app.logger.warning(f"SQLite cache delete_if_equal failed for {key}: {e}")
+            return False
+
+    def delete_prefix(self, prefix):
+        try:
+            escaped_prefix = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            self._connection().execute("DELETE FROM cache_entries WHERE key LIKE ? ESCAPE '\\'", (escaped_prefix + '%',))
+        except sqlite3.Error as e:
+            app.logger.warning(f"SQLite cache delete_prefix failed for {prefix}: {e}")
+
+
+class RedisCacheBackend(CacheBackend):
+    """Deployment-wide cache on any Redis-protocol server (Heroku Redis, KeyDB, Valkey...)."""
+    name = "redis"
+    # GET and DEL in one server-side step, so a lock that expired and was re-taken is not released by its old owner.
+    DELETE_IF_EQUAL_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+
+    def __init__(self, url):
+        self.client = redis.Redis.from_url(url, socket_timeout=2, socket_connect_timeout=2, health_check_interval=30)
+        self.delete_if_equal_script = self.client.register_script(self.DELETE_IF_EQUAL_SCRIPT)
+
+    def get(self, key):
+        try:
+            raw_value = self.client.get(key)
+            return json.loads(raw_value) if raw_value is not None else None
+        except (redis.RedisError, ValueError) as e:
+            app.logger.warning(f"Redis cache get failed for {key}: {e}")
+            return None
+
+    def set(self, key, value, ttl_seconds):
+        try:
+            self.client.set(key, json.dumps(value), ex=max(1, int(ttl_seconds)))
+        except redis.RedisError as e:
+            app.logger.warning(f"Redis cache set failed for {key}: {e}")
+
+    def add(self, key, value, ttl_seconds):
+        try:
+            return bool(self.client.set(key, json.dumps(value), ex=max(1, int(ttl_seconds)), nx=True))
+        except redis.RedisError as e:
+            app.logger.warning(f"Redis cache add failed for {key}: {e}")
+            return False
+
+    def delete(self, key):
+        try:
+            self.client.delete(key)
+        except redis.RedisError as e:
+            app.logger.warning(f"Redis cache delete failed for {key}: {e}")
+
+    def delete_if_equal(self, key, value):
+        try:
+            return bool(self.delete_if_equal_script(keys=[key], args=[json.dumps(value)]))
+        except redis.RedisError as e:
+            app.logger.warning(f"Redis cache delete_if_equal failed for {key}: {e}")
+            return False
+
+    def delete_prefix(self, prefix):
+        try:
+            for key in self.client.scan_iter(match=prefix + '*', count=500):
+                self.client.delete(key)
+        except redis.RedisError as e:
+            app.logger.warning(f"Redis cache delete_prefix failed for {prefix}: {e}")
+
+
+def create_cache_backend():
+    """Builds the backend selected by CACHE_BACKEND, falling back to the in-process store."""
+    if CACHE_BACKEND == 'redis':
+        if redis is None:
+            app.logger.error("CACHE_BACKEND is 'redis' but the redis package is not installed. Falling back to in-memory caches.")
+        elif not REDIS_URL:
+            app.logger.error("CACHE_BACKEND is 'redis' but REDIS_URL is not set. Falling back to in-memory caches.")
         else:
-            app.logger.info(f"Attempt 1 FAILED (empty list): No Object_112 profile found where field_3064 (UserId Text) is '{actual_student_obj3_id}'.")
+            try:
+                backend = RedisCacheBackend(REDIS_URL)
+                app.logger.info("Using Redis shared cache backend.")
+                return backend
+            except (redis.RedisError, ValueError) as e:
+                app.logger.error(f"Could not set up the Redis cache backend: {e}. Falling back to in-memory caches.")
+    elif CACHE_BACKEND == 'sqlite':
+        try:
+            app.logger.info(f"Using SQLite shared cache backend at {CACHE_SQLITE_PATH}.")
+            return SQLiteCacheBackend(CACHE_SQLITE_PATH)
+        except sqlite3.Error as e:
+            app.logger.error(f"Could not open SQLite cache at {CACHE_SQLITE_PATH}: {e}. Falling back to in-memory caches.")
+    elif CACHE_BACKEND != 'memory':
+        app.logger.warning(f"Unknown CACHE_BACKEND '{CACHE_BACKEND}'. Using in-memory caches.")
+    return MemoryCacheBackend()
 
-    # Attempt 2: Fetch Object_112 using actual_student_obj3_id against Object_112.field_3070 (Account Connection field)
-    if not academic_profile_record and actual_student_obj3_id: 
-        app.logger.info(f"Attempt 2: Fetching Object_112 where field_3070 (Account Connection) is '{actual_student_obj3_id}'.")
-        filters_obj112_via_field3070 = [{'field': 'field_3070_raw', 'operator': 'is', 'value': actual_student_obj3_id}]
-        obj112_response_attempt2 = get_knack_record("object_112", filters=filters_obj112_via_field3070)
-        
-        temp_profiles_list_attempt2 = []
-        if not (obj112_response_attempt2 and isinstance(obj112_response_attempt2, dict) and 'records' in obj112_response_attempt2 and isinstance(obj112_response_attempt2['records'], list) and obj112_response_attempt2['records']):
-            app.logger.info(f"Attempt 2 (field_3070_raw): No records or unexpected format. Trying 'field_3070' (non-raw). Response: {str(obj112_response_attempt2)[:200]}" )
-            filters_obj112_via_field3070_alt = [{'field': 'field_3070', 'operator': 'is', 'value': actual_student_obj3_id}]
-            obj112_response_attempt2 = get_knack_record("object_112", filters=filters_obj112_via_field3070_alt)
-
-        if obj112_response_attempt2 and isinstance(obj112_response_attempt2, dict) and \
-           'records' in obj112_response_attempt2 and isinstance(obj112_response_attempt2['records'], list):
-            temp_profiles_list_attempt2 = obj112_response_attempt2['records']
-            app.logger.info(f"Attempt 2: Found {len(temp_profiles_list_attempt2)} candidate profiles via field_3070 logic.")
-
-        if temp_profiles_list_attempt2: # Check if list is not empty
-            if isinstance(temp_profiles_list_attempt2[0], dict):
-                academic_profile_record = temp_profiles_list_attempt2[0]
-                app.logger.info(f"Attempt 2 SUCCESS: Found Object_112 record ID {academic_profile_record.get('id')} using field_3070 (Account Connection) with Obj3 ID '{actual_student_obj3_id}'. Profile Name: {academic_profile_record.get('field_3066')}")
-                subjects_summary = parse_subjects_from_profile_record(academic_profile_record)
-                if not subjects_summary or (len(subjects_summary) == 1 and subjects_summary[0]["subject"].startswith("No academic subjects")):
-                    app.logger.info(f"Object_112 ID {academic_profile_record.get('id')} (via field_3070) yielded no valid subjects. Will try name fallback.")
-                    academic_profile_record = None # Keep it None to fall through
-                else:
-                    app.logger.info(f"Object_112 ID {academic_profile_record.get('id')} (via field_3070) has valid subjects. Using this profile.")
-                    return {"subjects": subjects_summary, "profile_record": academic_profile_record} # MODIFIED RETURN
-            else:
-                app.logger.warning(f"Attempt 2: First item in profiles_via_field3070 is not a dict: {type(temp_profiles_list_attempt2[0])}")
+
+class CacheNamespace:
+    """A prefixed view of the shared cache backend, e.g. all school averages entries."""
+
+    def __init__(self, backend, namespace, default_ttl_seconds):
+        self.backend = backend
+        self.prefix = f"{CACHE_KEY_PREFIX}{namespace}:"
+        self.default_ttl_seconds = default_ttl_seconds
+
+    def get(self, key):
+        return self.backend.get(self.prefix + str(key))
+
+    def _ttl(self, ttl_seconds):
+        return self.default_ttl_seconds if ttl_seconds is None else ttl_seconds
+
+    def set(self, key, value, ttl_seconds=None):
+        self.backend.set(self.prefix + str(key), value, self._ttl(ttl_seconds))
+
+    def add(self, key, value, ttl_seconds=None):
+        return self.backend.add(self.prefix + str(key), value, self._ttl(ttl_seconds))
+
+    def delete(self, key):
+        self.backend.delete(self.prefix + str(key))
+
+    def delete_if_equal(self, key, value):
+        return self.backend.delete_if_equal(self.prefix + str(key), value)
+
+    def clear(self):
+        self.backend.delete_prefix(self.prefix)
+
+
+SHARED_CACHE = create_cache_backend()
+# School averages are kept until the stale-while-revalidate hard expiry; freshness is judged from the stored timestamp.
+SCHOOL_AVERAGES_CACHE = CacheNamespace(SHARED_CACHE, "school_averages", max(CACHE_TTL_SECONDS, SCHOOL_AVERAGES_HARD_TTL_SECONDS))
+SCHOOL_AVERAGES_REFRESH_LOCKS = CacheNamespace(SHARED_CACHE, "school_averages_refresh_lock", 300)
+
+
+# --- Knack Identity Mapping Cache ---
+class IdentityMapCache:
+    """
+    TTL cache for identity mappings between Knack objects, stored in the shared cache backend
+    so every worker benefits from a mapping resolved by any of them.
+    Entries are grouped by mapping name (e.g. "obj10_to_obj6") so each mapping reports its own load.
+    """
+
+    def __init__(self, backend, ttl_seconds):
+        self.store = CacheNamespace(backend, "identity", ttl_seconds)
+        self.lock = threading.Lock()
+        self.counters = {}
+
+    def _count(self, mapping, counter):
+        with self.lock:
+            mapping_counters = self.counters.setdefault(mapping, {"hits": 0, "misses": 0, "sets": 0, "invalidations": 0})
+            mapping_counters[counter] += 1
+
+    def get(self, mapping, key):
+        if not key:
+            return None
+        value = self.store.get(f"{mapping}:{key}")
+        self._count(mapping, "hits" if value is not None else "misses")
+        return value
+
+    def peek(self, mapping, key):
+        """Like get(), but without touching the hit/miss counters."""
+        return self.store.get(f"{mapping}:{key}") if key else None
+
+    def set(self, mapping, key, value):
+        if not key or value is None:
+            return
+        self.store.set(f"{mapping}:{key}", value)
+        self._count(mapping, "sets")
+
+    def invalidate(self, mapping, key):
+        if not key:
+            return
+        self.store.delete(f"{mapping}:{key}")
+        self._count(mapping, "invalidations")
+
+    def clear(self):
+        self.store.clear()
+
+    def stats(self):
+        with self.lock:
+            return {mapping: dict(counters) for mapping, counters in self.counters.items()}
+
+
+IDENTITY_CACHE = IdentityMapCache(SHARED_CACHE, IDENTITY_CACHE_TTL_SECONDS)
+
+def invalidate_student_identity(student_obj10_id=None, student_obj3_id=None):
+    """Explicitly drops every cached identity mapping for a student."""
+    if student_obj10_id:
+        cached_obj3 = IDENTITY_CACHE.peek("obj10_to_obj3", student_obj10_id)
+        if cached_obj3 and not student_obj3_id:
+            student_obj3_id = cached_obj3.get("object3_id")
+        IDENTITY_CACHE.invalidate("obj10_to_obj6", student_obj10_id)
+        IDENTITY_CACHE.invalidate("obj10_to_obj3", student_obj10_id)
+    if student_obj3_id:
+        IDENTITY_CACHE.invalidate("obj3_to_obj112", student_obj3_id)
+        IDENTITY_CACHE.invalidate("obj3_to_obj112_strategy", student_obj3_id)
+    app.logger.info(f"Invalidated identity mappings for Object_10 '{student_obj10_id}' / Object_3 '{student_obj3_id}'.")
+
+
+def get_student_object6_id(student_obj10_id):
+    """Resolves the student's Object_6 id via Object_10.field_132, using the identity cache."""
+    student_object_6_id = IDENTITY_CACHE.get("obj10_to_obj6", student_obj10_id)
+    if student_object_6_id:
+        app.logger.info(f"Using cached Object_6 ID {student_object_6_id} for Object_10 {student_obj10_id}.")
+        return student_object_6_id
+
+    object_10_record = get_knack_record("object_10", record_id=student_obj10_id)
+    if object_10_record and isinstance(object_10_record, dict): # specific record fetch returns dict directly
+        # field_132 in Object_10 is 'Student' connecting to Object_6 'Students'
+        student_connection_raw = object_10_record.get("field_132_raw")
+        if isinstance(student_connection_raw, list) and student_connection_raw:
+            student_object_6_id = student_connection_raw[0].get('id')
+            app.logger.info(f"Found student Object_6 ID: {student_object_6_id} from Object_10.field_132_raw")
+            IDENTITY_CACHE.set("obj10_to_obj6", student_obj10_id, student_object_6_id)
         else:
-            app.logger.info(f"Attempt 2 FAILED (empty list): No Object_112 profile found where field_3070 (Account Connection) is '{actual_student_obj3_id}'.")
+            app.logger.warning(f"Could not extract student Object_6 ID from Object_10 record's field_132_raw. Data: {student_connection_raw}")
+    else:
+        app.logger.warning(f"Could not fetch Object_10 record for ID: {student_obj10_id} to get student connection.")
+    return student_object_6_id
 
-    # Attempt 3: Fallback to fetch by student name
-    if not academic_profile_record and student_name_for_fallback and student_name_for_fallback != "N/A":
-        app.logger.info(f"Attempt 3: Fallback search for Object_112 by student name ('{student_name_for_fallback}') via field_3066.")
-        filters_object112_name = [{'field': 'field_3066', 'operator': 'is', 'value': student_name_for_fallback}]
-        obj112_response_attempt3 = get_knack_record("object_112", filters=filters_object112_name)
-        
-        temp_profiles_list_attempt3 = []
-        if obj112_response_attempt3 and isinstance(obj112_response_attempt3, dict) and \
-           'records' in obj112_response_attempt3 and isinstance(obj112_response_attempt3['records'], list):
-            temp_profiles_list_attempt3 = obj112_response_attempt3['records']
-            app.logger.info(f"Attempt 3: Found {len(temp_profiles_list_attempt3)} candidate profiles via name fallback.")
-
-        if temp_profiles_list_attempt3: # Check if list is not empty
-            if isinstance(temp_profiles_list_attempt3[0], dict):
-                academic_profile_record = temp_profiles_list_attempt3[0]
-                app.logger.info(f"Attempt 3 SUCCESS: Found Object_112 record ID {academic_profile_record.get('id')} via NAME fallback ('{student_name_for_fallback}'). Profile Name: {academic_profile_record.get('field_3066')}")
-                subjects_summary = parse_subjects_from_profile_record(academic_profile_record)
-                if not subjects_summary or (len(subjects_summary) == 1 and subjects_summary[0]["subject"].startswith("No academic subjects")):
-                    app.logger.info(f"Object_112 ID {academic_profile_record.get('id')} (via name fallback) yielded no valid subjects.")
-                    # Fall through to the final default return
-                else:
-                    app.logger.info(f"Object_112 ID {academic_profile_record.get('id')} (via name fallback) has valid subjects. Using this profile.")
-                    return {"subjects": subjects_summary, "profile_record": academic_profile_record} # MODIFIED RETURN
+
+def get_student_object3_id(student_obj10_id, student_email, student_name_for_log="N/A"):
+    """
+    Resolves the student's Object_3 (user account) id from their email via a field_70 query.
+    The cached entry remembers the email it was resolved from, so an email change is a cache miss.
+    """
+    if not student_email:
+        app.logger.warning(f"No student email from Object_10, cannot determine actual_student_object3_id for profile lookup (Student Obj10 ID: {student_obj10_id}).")
+        return None
+
+    cached_mapping = IDENTITY_CACHE.get("obj10_to_obj3", student_obj10_id)
+    if cached_mapping and cached_mapping.get("email") == student_email:
+        app.logger.info(f"Using cached Object_3 ID {cached_mapping['object3_id']} for Object_10 {student_obj10_id} ({student_email}).")
+        return cached_mapping["object3_id"]
+    if cached_mapping:
+        app.logger.info(f"Cached Object_3 mapping for Object_10 {student_obj10_id} was for a different email; re-resolving.")
+        IDENTITY_CACHE.invalidate("obj10_to_obj3", student_obj10_id)
+
+    actual_student_object3_id = None
+    filters_object3_for_id = [{'field': 'field_70', 'operator': 'is', 'value': student_email}]
+    object3_response = get_knack_record("object_3", filters=filters_object3_for_id)
+
+    user_accounts_list = []
+    if object3_response and isinstance(object3_response, dict) and 'records' in object3_response and isinstance(object3_response['records'], list):
+        user_accounts_list = object3_response['records']
+        app.logger.info(f"Found {len(user_accounts_list)} records in Object_3 for email {student_email}.")
+    else:
+        app.logger.warning(f"Object_3 response for email {student_email} was not in the expected format or missing 'records' list. Response: {str(object3_response)[:200]}")
+
+    if user_accounts_list:
+        if isinstance(user_accounts_list[0], dict):
+            actual_student_object3_id = user_accounts_list[0].get('id')
+            if actual_student_object3_id:
+                app.logger.info(f"Determined actual Object_3 ID for student ({student_name_for_log}, {student_email}): {actual_student_object3_id}")
+                IDENTITY_CACHE.set("obj10_to_obj3", student_obj10_id, {"email": student_email, "object3_id": actual_student_object3_id})
             else:
-                app.logger.warning(f"Attempt 3: First item in homepage_profiles_name_search is not a dict: {type(temp_profiles_list_attempt3[0])}")
+                app.logger.warning(f"Found Object_3 record for {student_email}, but it has no 'id' attribute: {str(user_accounts_list[0])[:100]}")
         else:
-            app.logger.warning(f"Attempt 3 FAILED (empty list): Fallback search: No Object_112 found for student name: '{student_name_for_fallback}'.")
-    
+            app.logger.warning(f"First item in user_accounts_list for {student_email} is not a dictionary: {type(user_accounts_list[0])} - {str(user_accounts_list[0])[:100]}")
+    else:
+        app.logger.warning(f"Could not find any Object_3 records for email {student_email} to get actual_student_object3_id.")
+    return actual_student_object3_id
+
+
+# --- Function to fetch Academic Profile (Object_112) ---
+def profile_has_valid_subjects(subjects_summary):
+    """False for the empty/placeholder list parse_subjects_from_profile_record returns for an unusable profile."""
+    return bool(subjects_summary) and not (len(subjects_summary) == 1 and subjects_summary[0]["subject"].startswith("No academic subjects"))
+
+
+def _first_profile_from_response(response, strategy_name):
+    if response and isinstance(response, dict) and isinstance(response.get('records'), list) and response['records']:
+        candidate = response['records'][0]
+        if isinstance(candidate, dict):
+            app.logger.info(f"{strategy_name}: Found {len(response['records'])} candidate profiles.")
+            return candidate
+        app.logger.warning(f"{strategy_name}: First candidate profile is not a dict: {type(candidate)}")
+        return None
+    app.logger.info(f"{strategy_name}: No records or unexpected format. Response: {str(response)[:200]}")
+    return None
+
+
+def _lookup_profile_by_user_id(actual_student_obj3_id, student_name_for_fallback):
+    """Object_112.field_3064 (UserId - Short Text field) equals the student's Object_3 id."""
+    if not actual_student_obj3_id:
+        return None
+    filters_obj112_via_field3064 = [{'field': 'field_3064', 'operator': 'is', 'value': actual_student_obj3_id}]
+    return _first_profile_from_response(get_knack_record("object_112", filters=filters_obj112_via_field3064), "user_id (field_3064)")
+
+
+def _lookup_profile_by_account_connection(actual_student_obj3_id, student_name_for_fallback):
+    """Object_112.field_3070 (Account Connection field) points at the student's Object_3 record."""
+    if not actual_student_obj3_id:
+        return None
+    filters_obj112_via_field3070 = [{'field': 'field_3070_raw', 'operator': 'is', 'value': actual_student_obj3_id}]
+    profile_record = _first_profile_from_response(get_knack_record("object_112", filters=filters_obj112_via_field3070), "account_connection (field_3070_raw)")
+    if profile_record:
+        return profile_record
+    filters_obj112_via_field3070_alt = [{'field': 'field_3070', 'operator': 'is', 'value': actual_student_obj3_id}]
+    return _first_profile_from_response(get_knack_record("object_112", filters=filters_obj112_via_field3070_alt), "account_connection (field_3070)")
+
+
+def _lookup_profile_by_name(actual_student_obj3_id, student_name_for_fallback):
+    """Fallback: Object_112.field_3066 equals the student's name."""
+    if not student_name_for_fallback or student_name_for_fallback == "N/A":
+        return None
+    filters_object112_name = [{'field': 'field_3066', 'operator': 'is', 'value': student_name_for_fallback}]
+    return _first_profile_from_response(get_knack_record("object_112", filters=filters_object112_name), "name (field_3066)")
+
+
+# Id-based strategies are raced against each other; the name match is only a fallback.
+PROFILE_ID_LOOKUP_STRATEGIES = {
+    "user_id": _lookup_profile_by_user_id,
+    "account_connection": _lookup_profile_by_account_connection,
+}
+PROFILE_FALLBACK_LOOKUP_STRATEGIES = {
+    "name": _lookup_profile_by_name,
+}
+PROFILE_LOOKUP_STATS_LOCK = threading.Lock()
+PROFILE_LOOKUP_STATS = {"wins": {}, "remembered_strategy_hits": 0, "not_found": 0}
+
+
+def _run_profile_strategy(strategy_name, strategy, actual_student_obj3_id, student_name_for_fallback):
+    """Runs one lookup strategy and returns (strategy_name, record, subjects) if the profile has usable subjects."""
+    try:
+        profile_record = strategy(actual_student_obj3_id, student_name_for_fallback)
+    except Exception as e:
+        app.logger.error(f"Object_112 lookup strategy '{strategy_name}' raised: {e}")
+        return None
+    if not profile_record:
+        return None
+    subjects_summary = parse_subjects_from_profile_record(profile_record)
+    if not profile_has_valid_subjects(subjects_summary):
+        app.logger.info(f"Object_112 ID {profile_record.get('id')} (via {strategy_name}) yielded no valid subjects.")
+        return None
+    return strategy_name, profile_record, subjects_summary
+
+
+def _race_profile_strategies(strategies, actual_student_obj3_id, student_name_for_fallback):
+    """
+    Runs strategies concurrently and returns the first valid result; slower strategies are left to finish unobserved.
+    Each call gets its own pool (one thread per strategy), so lookups from concurrent requests never queue behind each other.
+    """
+    if len(strategies) == 1:
+        (strategy_name, strategy), = strategies.items()
+        return _run_profile_strategy(strategy_name, strategy, actual_student_obj3_id, student_name_for_fallback)
+    executor = ThreadPoolExecutor(max_workers=len(strategies), thread_name_prefix="profile-lookup")
+    try:
+        futures = [executor.submit(_run_profile_strategy, strategy_name, strategy, actual_student_obj3_id, student_name_for_fallback)
+                   for strategy_name, strategy in strategies.items()]
+        for future in as_completed(futures):
+            result = future.result()
+            if result:
+                return result
+        return None
+    finally:
+        executor.shutdown(wait=False)
+
+
+def get_academic_profile(actual_student_obj3_id, student_name_for_fallback, student_obj10_id_log_ref):
+    app.logger.info(f"Starting academic profile fetch. Target Student's Object_3 ID: '{actual_student_obj3_id}', Fallback Name: '{student_name_for_fallback}', Original Obj10 ID for logging: {student_obj10_id_log_ref}.")
+
+    # Attempt 0: Use the cached Object_3 -> Object_112 mapping to fetch the profile directly by record id
+    cached_obj112_id = IDENTITY_CACHE.get("obj3_to_obj112", actual_student_obj3_id)
+    if cached_obj112_id:
+        app.logger.info(f"Attempt 0: Fetching cached Object_112 record {cached_obj112_id} for Obj3 ID '{actual_student_obj3_id}'.")
+        cached_profile_record = get_knack_record("object_112", record_id=cached_obj112_id)
+        if cached_profile_record and isinstance(cached_profile_record, dict) and cached_profile_record.get('id'):
+            subjects_summary = parse_subjects_from_profile_record(cached_profile_record)
+            if profile_has_valid_subjects(subjects_summary):
+                app.logger.info(f"Attempt 0 SUCCESS: Cached Object_112 ID {cached_obj112_id} has valid subjects. Using this profile.")
+                return {"subjects": subjects_summary, "profile_record": cached_profile_record}
+        app.logger.info(f"Attempt 0 FAILED: Cached Object_112 ID {cached_obj112_id} is missing or has no valid subjects. Invalidating mapping.")
+        IDENTITY_CACHE.invalidate("obj3_to_obj112", actual_student_obj3_id)
+
+    remembered_strategy = IDENTITY_CACHE.get("obj3_to_obj112_strategy", actual_student_obj3_id)
+    rounds = [PROFILE_ID_LOOKUP_STRATEGIES, PROFILE_FALLBACK_LOOKUP_STRATEGIES]
+    if remembered_strategy in PROFILE_ID_LOOKUP_STRATEGIES:
+        # Go straight to the strategy that found this student last time; the others remain as fallbacks.
+        app.logger.info(f"Trying remembered Object_112 lookup strategy '{remembered_strategy}' first for Obj3 ID '{actual_student_obj3_id}'.")
+        rounds = [{remembered_strategy: PROFILE_ID_LOOKUP_STRATEGIES[remembered_strategy]}] + \
+                 [{name: strategy for name, strategy in round_strategies.items() if name != remembered_strategy} for round_strategies in rounds]
+
+    for round_index, round_strategies in enumerate(rounds):
+        if not round_strategies:
+            continue
+        app.logger.info(f"Object_112 lookup round {round_index + 1}: {list(round_strategies)} for Obj3 ID '{actual_student_obj3_id}'.")
+        result = _race_profile_strategies(round_strategies, actual_student_obj3_id, student_name_for_fallback)
+        if result:
+            strategy_name, academic_profile_record, subjects_summary = result
+            app.logger.info(f"Object_112 lookup SUCCESS via '{strategy_name}': record ID {academic_profile_record.get('id')}, Profile Name: {academic_profile_record.get('field_3066')}")
+            with PROFILE_LOOKUP_STATS_LOCK:
+                PROFILE_LOOKUP_STATS["wins"][strategy_name] = PROFILE_LOOKUP_STATS["wins"].get(strategy_name, 0) + 1
+                if strategy_name == remembered_strategy:
+                    PROFILE_LOOKUP_STATS["remembered_strategy_hits"] += 1
+            # A name match can belong to another student with the same name, so only id-based matches are
+            # cached as this student's profile.
+            if strategy_name in PROFILE_ID_LOOKUP_STRATEGIES:
+                IDENTITY_CACHE.set("obj3_to_obj112", actual_student_obj3_id, academic_profile_record.get('id'))
+                IDENTITY_CACHE.set("obj3_to_obj112_strategy", actual_student_obj3_id, strategy_name)
+            elif remembered_strategy:
+                IDENTITY_CACHE.invalidate("obj3_to_obj112_strategy", actual_student_obj3_id)
+            return {"subjects": subjects_summary, "profile_record": academic_profile_record}
+
+    with PROFILE_LOOKUP_STATS_LOCK:
+        PROFILE_LOOKUP_STATS["not_found"] += 1
+    if remembered_strategy:
+        IDENTITY_CACHE.invalidate("obj3_to_obj112_strategy", actual_student_obj3_id)
     app.logger.warning(f"All attempts to fetch Object_112 failed (Student's Obj3 ID: '{actual_student_obj3_id}', Fallback name: '{student_name_for_fallback}').")
     default_subjects = [{"subject": "Academic profile not found by any method.", "currentGrade": "N/A", "targetGrade": "N/A", "effortGrade": "N/A", "examType": "N/A"}]
     return {"subjects": default_subjects, "profile_record": None} # MODIFIED RETURN
 
 
 # Helper function to parse subjects from a given academic_profile_record
+PARSED_PROFILE_CACHE = BoundedCache("parsed_profiles", max_entries=PARSED_PROFILE_CACHE_MAX_ENTRIES,
+                                    default_ttl_seconds=PARSED_PROFILE_CACHE_TTL_SECONDS)
+
+
 def parse_subjects_from_profile_record(academic_profile_record):
     if not academic_profile_record:
         app.logger.error("parse_subjects_from_profile_record called with no record.")
         return [] # Or a default indicating no data
 
+    # Key on the subject field contents as well as the record id, so an edited profile is re-parsed.
+    subject_fields = tuple((str(academic_profile_record.get(f"field_30{79+i}")), str(academic_profile_record.get(f"field_30{79+i}_raw")))
+                           for i in range(1, 16))
+    cache_key = (academic_profile_record.get('id'), hash(subject_fields))
+    cached_summary = PARSED_PROFILE_CACHE.get(cache_key)
+    if cached_summary is not None:
+        return copy.deepcopy(cached_summary)
+    subjects_summary = _parse_subjects_from_profile_record(academic_profile_record)
+    PARSED_PROFILE_CACHE.set(cache_key, copy.deepcopy(subjects_summary))
+    return subjects_summary
+
+
+def _parse_subjects_from_profile_record(academic_profile_record):
     app.logger.info(f"Parsing subjects for Object_112 record ID: {academic_profile_record.get('id')}. Record (first 500 chars): {str(academic_profile_record)[:500]}")
     subjects_summary = []
     # Subject fields are field_3080 (Sub1) to field_3094 (Sub15)
@@ -478,7 +1929,124 @@ def parse_subjects_from_profile_record(academic_profile_record):
 
 
 # --- Function to Generate Student Summary with LLM (Now with active LLM call) ---
+# --- Cache for LLM Coaching Summaries ---
+def create_llm_summary_cache_backend():
+    """LLM outputs should outlive a restart: use the shared backend unless it is per-process memory."""
+    if SHARED_CACHE.name != "memory":
+        return SHARED_CACHE
+    try:
+        return SQLiteCacheBackend(LLM_SUMMARY_CACHE_SQLITE_PATH)
+    except sqlite3.Error as e:
+        app.logger.error(f"Could not open LLM summary cache at {LLM_SUMMARY_CACHE_SQLITE_PATH}: {e}. Using the in-memory cache.")
+        return SHARED_CACHE
+
+
+def llm_request_cache_key(llm_request, volatile_text=None):
+    """
+    Stable content hash of an LLM request (prompt messages and every model parameter). volatile_text,
+    if given, is removed from the messages first, for prompt content that should not change the key.
+    """
+    if volatile_text:
+        llm_request = dict(llm_request, messages=[dict(message, content=message["content"].replace(volatile_text, ""))
+                                                  for message in llm_request["messages"]])
+    canonical_request = json.dumps({"version": LLM_SUMMARY_CACHE_VERSION, "request": llm_request}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(canonical_request.encode('utf-8')).hexdigest()
+
+
+LLM_SUMMARY_CACHE = CacheNamespace(create_llm_summary_cache_backend(), "llm_summary", LLM_SUMMARY_CACHE_TTL_SECONDS)
+LLM_SUMMARY_SINGLEFLIGHT = SingleFlight("llm_summary")
+LLM_SUMMARY_CACHE_STATS = {"hits": 0, "misses": 0, "stores": 0}
+
+# --- Coaching Summary Sections ---
+# The seven keys of the coaching summary JSON, each with the example line shown to the model under
+# REQUIRED OUTPUT STRUCTURE and its output budget when requested on its own (LLM_SUMMARY_MODE=sections).
+LLM_SUMMARY_SECTIONS = [
+    {
+        "key": "student_overview_summary",
+        "max_tokens": 220,
+        "spec": "  \"student_overview_summary\": \"Concise 2-3 sentence AI Student Snapshot for the tutor, highlighting 1-2 key strengths and 1-2 primary areas for development, rooted in VESPA principles. Max 100-120 words.\",",
+    },
+    {
+        "key": "chart_comparative_insights",
+        "max_tokens": 160,
+        "spec": "  \"chart_comparative_insights\": \"Provide 2-3 bullet points or a short paragraph (max 80 words) analyzing the student\\'s VESPA scores in comparison to school averages (if available). What could these differences or similarities mean?\",",
+    },
+    {
+        "key": "most_important_coaching_questions",
+        "max_tokens": 220,
+        "spec": "  \"most_important_coaching_questions\": [\"Based on the student\\'s profile (scores, level, comments, academic performance vs MEGs), list 3-5 most impactful coaching questions selected from the provided Coaching Questions Knowledge Base.\", \"Question 2...\"],",
+    },
+    {
+        "key": "student_comment_analysis",
+        "max_tokens": 200,
+        "spec": "  \"student_comment_analysis\": \"Analyze the student\\'s RRC/Goal comments (text provided: RRC='{RRC_COMMENT_PLACEHOLDER}', Goal='{GOAL_COMMENT_PLACEHOLDER}'). What insights can be gained? Specifically look for language indicating locus of control (e.g., 'receive a grade' vs 'achieve a grade'). Max 100 words.\",",
+    },
+    {
+        "key": "suggested_student_goals",
+        "max_tokens": 200,
+        "spec": "  \"suggested_student_goals\": [\"Based on the analysis, and inspired by the 100 Statements KB, suggest 2-3 S.M.A.R.T. goals for the student, reframed to their context.\", \"Goal 2...\"],",
+    },
+    {
+        "key": "academic_benchmark_analysis",
+        "max_tokens": 320,
+        "spec": "  \"academic_benchmark_analysis\": \"Provide a supportive and encouraging analysis (approx. 150-180 words) of the student's academic performance. Start by looking at their current grades in relation to their Subject Target Grades (STGs) and their 75th percentile Minimum Expected Grades (MEGs). Explain to the tutor that MEGs are derived from national data for students with similar prior GCSE attainment, representing what the top 25% achieve and are thus aspirational. Note that MEGs are a baseline and don't account for subject-specific difficulty, individual student factors, or wider context. Then, explain that the STG is a more nuanced target, calculated by applying a subject-specific Value Added (VA) factor to the MEG. This VA factor (e.g., 1.05 for Further Maths, 0.90 for Biology) adjusts for the typical grade distribution and relative difficulty of a subject, aiming for fairer, more realistic targets. Emphasize that the comparison between current grades, MEGs, and STGs should foster a positive discussion about the student's progress, strengths, and potential next steps. Crucially, advise the tutor that while these benchmarks are informative, the most effective targets consider all factors: prior attainment, subject difficulty, individual student needs, and school context. The goal is to use this information to identify areas for support or challenge, always contextualized within a broader understanding of the student.\",",
+    },
+    {
+        "key": "questionnaire_interpretation_and_reflection_summary",
+        "max_tokens": 280,
+        "spec": "  \"questionnaire_interpretation_and_reflection_summary\": \"Provide a concise summary (approx. 100-150 words) interpreting the overall distribution of the student's questionnaire responses (e.g., tendencies towards 'Strongly Disagree' or 'Strongly Agree', as indicated by the counts of 1s, 2s, etc., from 'Overall Questionnaire Statement Response Distribution' provided above). Highlight any notable patterns, such as a concentration of low or high responses in specific VESPA elements (refer to the Top/Bottom scoring statements for VESPA categories from 'Top & Bottom Scoring Questionnaire Questions'). Also, briefly compare and contrast these questionnaire insights with the student's own RRC/Goal comments (text provided: RRC='{RRC_COMMENT_PLACEHOLDER}', Goal='{GOAL_COMMENT_PLACEHOLDER}'), noting any consistencies or discrepancies that could be valuable for the tutor to explore.\",",
+    },
+]
+LLM_SUMMARY_SECTION_KEYS = [section["key"] for section in LLM_SUMMARY_SECTIONS]
+# Used when the LLM leaves a section out or the section could not be generated.
+LLM_SUMMARY_SECTION_FALLBACKS = {
+    "student_overview_summary": "Error: LLM did not provide a valid overview.",
+    "chart_comparative_insights": "Error: LLM did not provide valid chart insights.",
+    "most_important_coaching_questions": ["Error: LLM did not provide valid questions."],
+    "student_comment_analysis": "Error: LLM did not provide valid comment analysis.",
+    "suggested_student_goals": ["Error: LLM did not provide valid goal suggestions."],
+    "academic_benchmark_analysis": "Error: LLM did not provide valid academic benchmark analysis.",
+    "questionnaire_interpretation_and_reflection_summary": "Error: LLM did not provide questionnaire interpretation."
+}
+LLM_SUMMARY_SECTION_EXECUTOR = ThreadPoolExecutor(max_workers=LLM_SUMMARY_SECTION_WORKERS, thread_name_prefix="llm-summary")
+
+
+def compose_student_summary_prompt(context_parts, guidance_parts, section_keys, cleaned_rrc_placeholder, cleaned_goal_placeholder):
+    """
+    Assembles the coaching summary prompt: student data, the task brief, knowledge-base guidance and
+    the output structure, asking for the given section keys only.
+    """
+    sections = [section for section in LLM_SUMMARY_SECTIONS if section["key"] in section_keys]
+    prompt_parts = list(context_parts)
+    prompt_parts.append("\n\n--- TASKS FOR THE AI ACADEMIC MENTOR ---")
+    prompt_parts.append("Based ONLY on the data provided above for the student, and the knowledge base excerpts below, provide the following insights for the student's TUTOR. ")
+    prompt_parts.append("The tone should be objective, analytical, and supportive, aimed at helping the tutor quickly grasp the student's profile to effectively prepare for a coaching conversation focused on student ownership.")
+    prompt_parts.append("IMPORTANT: Do NOT directly ask questions TO THE STUDENT or give direct advice TO THE STUDENT in your outputs. Instead, provide insights and talking points that will help the TUTOR facilitate these conversations effectively. Do not use conversational filler like 'Okay, let's look at...'.")
+    prompt_parts.append("Format your entire response as a single JSON object with the following EXACT keys: " + ", ".join(f'"{section["key"]}"' for section in sections) + ".")
+    prompt_parts.append("Ensure all string values within the JSON are properly escaped.")
+
+    prompt_parts.extend(guidance_parts)
+
+    prompt_parts.append("\n\n--- REQUIRED OUTPUT STRUCTURE (JSON Object) ---")
+    prompt_parts.append("Please provide your response as a single, valid JSON object. Example:")
+    prompt_parts.append("'''")
+    prompt_parts.append("{")
+    prompt_parts.extend(section["spec"] for section in sections)
+    prompt_parts.append("}")
+    prompt_parts.append("'''")
+    if any("PLACEHOLDER" in section["spec"] for section in sections):
+        prompt_parts.append(f"REMEMBER to replace RRC_COMMENT_PLACEHOLDER with: '{cleaned_rrc_placeholder}...' and GOAL_COMMENT_PLACEHOLDER with: '{cleaned_goal_placeholder}...' in your actual student_comment_analysis output.")
+
+    prompt_to_send = "\n".join(prompt_parts)
+    # Ensure the placeholders are correctly substituted in the final prompt string itself.
+    # The placeholders in the prompt_to_send string are 'RRC_COMMENT_PLACEHOLDER' and 'GOAL_COMMENT_PLACEHOLDER'
+    prompt_to_send = prompt_to_send.replace("'{RRC_COMMENT_PLACEHOLDER}'", f"'{cleaned_rrc_placeholder}...'")
+    prompt_to_send = prompt_to_send.replace("'{GOAL_COMMENT_PLACEHOLDER}'", f"'{cleaned_goal_placeholder}...'")
+    return prompt_to_send
+
+
 def generate_student_summary_with_llm(student_data_dict, coaching_kb_data, student_goals_statements_text, all_scored_questionnaire_statements=None): # Added all_scored_questionnaire_statements
+    # Returns (llm_outputs, from_cache); from_cache is True when every output came from LLM_SUMMARY_CACHE.
     app.logger.info(f"Attempting to generate LLM summary for student: {student_data_dict.get('student_name', 'N/A')}")
     
     if not OPENAI_API_KEY:
@@ -491,7 +2059,7 @@ def generate_student_summary_with_llm(student_data_dict, coaching_kb_data, stude
             "suggested_student_goals": ["Goal suggestions unavailable (AI key not configured)."],
             # ADDED: Default for new key
             "questionnaire_interpretation_and_reflection_summary": "Questionnaire interpretation unavailable (AI key not configured)."
-        }
+        }, False
 
     student_level = student_data_dict.get('student_level', 'N/A')
     student_name = student_data_dict.get('student_name', 'Unknown Student')
@@ -630,19 +2198,18 @@ def generate_student_summary_with_llm(student_data_dict, coaching_kb_data, stude
         prompt_parts.append("  Detailed questionnaire response distribution data (all_scored_questionnaire_statements) is not available or not in the expected list format.")
 
     # Previous Interaction Summary
+    # It is this endpoint's own last student_overview_summary (written back to field_3271), so it is
+    # left out of the cache key; otherwise every reopen of an unchanged report would miss.
     prev_summary = student_data_dict.get('previous_interaction_summary')
+    previous_summary_prompt_text = None
     if prev_summary and prev_summary != "No previous AI coaching summary found.":
         prompt_parts.append("\n--- Previous AI Interaction Summary (For Context) ---")
         prev_summary_clean = str(prev_summary)[:300].replace('\n', ' ')
         prompt_parts.append(f"  {prev_summary_clean}...")
+        # Includes the separator the final "\n".join puts before it, so removing it restores the prompt exactly.
+        previous_summary_prompt_text = "\n" + "\n".join(prompt_parts[-2:])
 
-    prompt_parts.append("\n\n--- TASKS FOR THE AI ACADEMIC MENTOR ---")
-    prompt_parts.append("Based ONLY on the data provided above for the student, and the knowledge base excerpts below, provide the following insights for the student's TUTOR. ")
-    prompt_parts.append("The tone should be objective, analytical, and supportive, aimed at helping the tutor quickly grasp the student's profile to effectively prepare for a coaching conversation focused on student ownership.")
-    prompt_parts.append("IMPORTANT: Do NOT directly ask questions TO THE STUDENT or give direct advice TO THE STUDENT in your outputs. Instead, provide insights and talking points that will help the TUTOR facilitate these conversations effectively. Do not use conversational filler like 'Okay, let's look at...'.")
-    prompt_parts.append("Format your entire response as a single JSON object with the following EXACT keys: \"student_overview_summary\", \"chart_comparative_insights\", \"most_important_coaching_questions\", \"student_comment_analysis\", \"suggested_student_goals\", \"academic_benchmark_analysis\", \"questionnaire_interpretation_and_reflection_summary\".") # ADDED new key
-    prompt_parts.append("Ensure all string values within the JSON are properly escaped.")
-
+    guidance_parts = []
     # --- RAG for Coaching Suggestions and Goals (within generate_student_summary_with_llm) ---
     retrieved_rag_items_for_prompt_structured = {
         "insights": [],
@@ -687,18 +2254,18 @@ def generate_student_summary_with_llm(student_data_dict, coaching_kb_data, stude
                     if len(retrieved_rag_items_for_prompt_structured["statements"]) >= 1: break
     
     if any(retrieved_rag_items_for_prompt_structured.values()):
-        prompt_parts.append("\n\n--- Dynamically Retrieved Context (Strongly consider these for formulating Most Important Coaching Questions and Suggested Student Goals) ---")
-        prompt_parts.append(f"The student\'s lowest VESPA score is in '{lowest_vespa_element}'. Based on this, please incorporate the following into your suggestions:")
+        guidance_parts.append("\n\n--- Dynamically Retrieved Context (Strongly consider these for formulating Most Important Coaching Questions and Suggested Student Goals) ---")
+        guidance_parts.append(f"The student\'s lowest VESPA score is in '{lowest_vespa_element}'. Based on this, please incorporate the following into your suggestions:")
         if retrieved_rag_items_for_prompt_structured["insights"]:
-            prompt_parts.append("\nRelevant Coaching Insight(s):")
-            prompt_parts.extend(retrieved_rag_items_for_prompt_structured["insights"])
+            guidance_parts.append("\nRelevant Coaching Insight(s):")
+            guidance_parts.extend(retrieved_rag_items_for_prompt_structured["insights"])
         if retrieved_rag_items_for_prompt_structured["activities"]:
-            prompt_parts.append("\nRelevant VESPA Activity/ies (Include name and ID if suggesting one):")
-            prompt_parts.extend(retrieved_rag_items_for_prompt_structured["activities"])
+            guidance_parts.append("\nRelevant VESPA Activity/ies (Include name and ID if suggesting one):")
+            guidance_parts.extend(retrieved_rag_items_for_prompt_structured["activities"])
         if retrieved_rag_items_for_prompt_structured["statements"]:
-            prompt_parts.append("\nRelevant Reflective Statement(s) to adapt:")
-            prompt_parts.extend(retrieved_rag_items_for_prompt_structured["statements"])
-        prompt_parts.append("Tailor your coaching questions and goal suggestions to be practical and actionable, leveraging these specific resources.")
+            guidance_parts.append("\nRelevant Reflective Statement(s) to adapt:")
+            guidance_parts.extend(retrieved_rag_items_for_prompt_structured["statements"])
+        guidance_parts.append("Tailor your coaching questions and goal suggestions to be practical and actionable, leveraging these specific resources.")
 
     # --- Include Divers vs. Thrivers insight for comment analysis --- 
     divers_thrivers_insight_text = ""
@@ -711,65 +2278,39 @@ def generate_student_summary_with_llm(student_data_dict, coaching_kb_data, stude
         # Add this specifically to the description of the student_comment_analysis task
         # This requires finding where student_comment_analysis is defined in the prompt_parts for the JSON structure
         # For now, I'll add it as a general instruction before the JSON output structure definition.
-        prompt_parts.append(f"\n\n--- Special Instruction for Student Comment Analysis ---")
-        prompt_parts.append(divers_thrivers_insight_text)
+        guidance_parts.append(f"\n\n--- Special Instruction for Student Comment Analysis ---")
+        guidance_parts.append(divers_thrivers_insight_text)
 
 
-    prompt_parts.append("\n\n--- Knowledge Base: Coaching Questions (Excerpt) ---")
-    prompt_parts.append("Use these to select questions. Consider student's level, VESPA scores, and academic performance relative to MEGs.") # Added academic context
+    guidance_parts.append("\n\n--- Knowledge Base: Coaching Questions (Excerpt) ---")
+    guidance_parts.append("Use these to select questions. Consider student's level, VESPA scores, and academic performance relative to MEGs.") # Added academic context
     # Simplified coaching_kb injection for brevity in prompt - real version would be more selective or summarized
     if coaching_kb_data:
         general_q = coaching_kb_data.get('generalIntroductoryQuestions', [])
         if general_q:
-            prompt_parts.append("General Introductory Questions:")
-            for q_text in general_q[:2]: prompt_parts.append(f"- {q_text}") # Limit for prompt
+            guidance_parts.append("General Introductory Questions:")
+            for q_text in general_q[:2]: guidance_parts.append(f"- {q_text}") # Limit for prompt
         
         vespa_q = coaching_kb_data.get('vespaSpecificCoachingQuestions', {})
         if vespa_q.get("Vision") and vespa_q["Vision"].get(student_level):
-            prompt_parts.append(f"Vision Questions ({student_level}):")
-            for q_text in vespa_q["Vision"][student_level].get("Low", [])[:1]: prompt_parts.append(f"- {q_text}") # Example
+            guidance_parts.append(f"Vision Questions ({student_level}):")
+            for q_text in vespa_q["Vision"][student_level].get("Low", [])[:1]: guidance_parts.append(f"- {q_text}") # Example
     else:
-        prompt_parts.append("Coaching questions knowledge base not available for this request.")
+        guidance_parts.append("Coaching questions knowledge base not available for this request.")
 
 
-    prompt_parts.append("\n\n--- Knowledge Base: Reflective Statements (Excerpt - for inspiration) ---")
-    prompt_parts.append("Use these statements as INSPIRATION when formulating suggested goals. Do not just copy them. Reframe them based on the student's specific context.")
+    guidance_parts.append("\n\n--- Knowledge Base: Reflective Statements (Excerpt - for inspiration) ---")
+    guidance_parts.append("Use these statements as INSPIRATION when formulating suggested goals. Do not just copy them. Reframe them based on the student's specific context.")
     if REFLECTIVE_STATEMENTS_DATA: # Use the new global variable
         # Include a small, relevant snippet of the statements
         snippet = "\n".join(REFLECTIVE_STATEMENTS_DATA[:5]) # First 5 statements, escaped for JSON in prompt
-        prompt_parts.append(snippet + "\n...")
+        guidance_parts.append(snippet + "\n...")
     else:
-        prompt_parts.append("Reflective statements knowledge base not available for this request.")
+        guidance_parts.append("Reflective statements knowledge base not available for this request.")
 
-    prompt_parts.append("\n\n--- REQUIRED OUTPUT STRUCTURE (JSON Object) ---")
-    prompt_parts.append("Please provide your response as a single, valid JSON object. Example:")
-    prompt_parts.append("'''")
-    prompt_parts.append("{")
-    prompt_parts.append("  \"student_overview_summary\": \"Concise 2-3 sentence AI Student Snapshot for the tutor, highlighting 1-2 key strengths and 1-2 primary areas for development, rooted in VESPA principles. Max 100-120 words.\",")
-    prompt_parts.append("  \"chart_comparative_insights\": \"Provide 2-3 bullet points or a short paragraph (max 80 words) analyzing the student\\'s VESPA scores in comparison to school averages (if available). What could these differences or similarities mean?\",")
-    prompt_parts.append("  \"most_important_coaching_questions\": [\"Based on the student\\'s profile (scores, level, comments, academic performance vs MEGs), list 3-5 most impactful coaching questions selected from the provided Coaching Questions Knowledge Base.\", \"Question 2...\"],")
-    prompt_parts.append("  \"student_comment_analysis\": \"Analyze the student\\'s RRC/Goal comments (text provided: RRC='{RRC_COMMENT_PLACEHOLDER}', Goal='{GOAL_COMMENT_PLACEHOLDER}'). What insights can be gained? Specifically look for language indicating locus of control (e.g., 'receive a grade' vs 'achieve a grade'). Max 100 words.\",")
-    prompt_parts.append("  \"suggested_student_goals\": [\"Based on the analysis, and inspired by the 100 Statements KB, suggest 2-3 S.M.A.R.T. goals for the student, reframed to their context.\", \"Goal 2...\"]," )
-    prompt_parts.append("  \"academic_benchmark_analysis\": \"Provide a supportive and encouraging analysis (approx. 150-180 words) of the student's academic performance. Start by looking at their current grades in relation to their Subject Target Grades (STGs) and their 75th percentile Minimum Expected Grades (MEGs). Explain to the tutor that MEGs are derived from national data for students with similar prior GCSE attainment, representing what the top 25% achieve and are thus aspirational. Note that MEGs are a baseline and don't account for subject-specific difficulty, individual student factors, or wider context. Then, explain that the STG is a more nuanced target, calculated by applying a subject-specific Value Added (VA) factor to the MEG. This VA factor (e.g., 1.05 for Further Maths, 0.90 for Biology) adjusts for the typical grade distribution and relative difficulty of a subject, aiming for fairer, more realistic targets. Emphasize that the comparison between current grades, MEGs, and STGs should foster a positive discussion about the student's progress, strengths, and potential next steps. Crucially, advise the tutor that while these benchmarks are informative, the most effective targets consider all factors: prior attainment, subject difficulty, individual student needs, and school context. The goal is to use this information to identify areas for support or challenge, always contextualized within a broader understanding of the student.\",") # Ensure comma if not last
-    prompt_parts.append("  \"questionnaire_interpretation_and_reflection_summary\": \"Provide a concise summary (approx. 100-150 words) interpreting the overall distribution of the student's questionnaire responses (e.g., tendencies towards 'Strongly Disagree' or 'Strongly Agree', as indicated by the counts of 1s, 2s, etc., from 'Overall Questionnaire Statement Response Distribution' provided above). Highlight any notable patterns, such as a concentration of low or high responses in specific VESPA elements (refer to the Top/Bottom scoring statements for VESPA categories from 'Top & Bottom Scoring Questionnaire Questions'). Also, briefly compare and contrast these questionnaire insights with the student's own RRC/Goal comments (text provided: RRC='{RRC_COMMENT_PLACEHOLDER}', Goal='{GOAL_COMMENT_PLACEHOLDER}'), noting any consistencies or discrepancies that could be valuable for the tutor to explore.\",") # ADDED new key & description
-    prompt_parts.append("}")
-    prompt_parts.append("'''")
     # Prepare cleaned versions of current_rrc_text and current_goal_text for the prompt placeholder replacement
     cleaned_rrc_placeholder = current_rrc_text[:100].replace('\n', ' ').replace("'", "\\'").replace('"', '\\"')
     cleaned_goal_placeholder = current_goal_text[:100].replace('\n', ' ').replace("'", "\\'").replace('"', '\\"')
-    prompt_parts.append(f"REMEMBER to replace RRC_COMMENT_PLACEHOLDER with: '{cleaned_rrc_placeholder}...' and GOAL_COMMENT_PLACEHOLDER with: '{cleaned_goal_placeholder}...' in your actual student_comment_analysis output.")
-
-
-    prompt_to_send = "\n".join(prompt_parts)
-    # Ensure the placeholders are correctly substituted in the final prompt string itself.
-    # The placeholders in the prompt_to_send string are 'RRC_COMMENT_PLACEHOLDER' and 'GOAL_COMMENT_PLACEHOLDER'
-    prompt_to_send = prompt_to_send.replace("'{RRC_COMMENT_PLACEHOLDER}'", f"'{cleaned_rrc_placeholder}...'")
-    prompt_to_send = prompt_to_send.replace("'{GOAL_COMMENT_PLACEHOLDER}'", f"'{cleaned_goal_placeholder}...'")
-
-
-    app.logger.info(f"Generated LLM Prompt (first 500 chars): {prompt_to_send[:500]}")
-    app.logger.info(f"Generated LLM Prompt (last 500 chars): {prompt_to_send[-500:]}")
-    app.logger.info(f"Total LLM Prompt length: {len(prompt_to_send)} characters")
 
     system_message_content = (
         f"You are a professional academic mentor with significant experience working with school-age students, "
@@ -779,23 +2320,86 @@ def generate_student_summary_with_llm(student_data_dict, coaching_kb_data, stude
         f"Your role is to provide concise, data-driven, structured insights to the TUTOR in JSON format."
     )
 
+    if LLM_SUMMARY_MODE == "sections":
+        return _generate_student_summary_by_section(prompt_parts, guidance_parts, system_message_content, cleaned_rrc_placeholder, cleaned_goal_placeholder, student_name, previous_summary_prompt_text)
+
+    prompt_to_send = compose_student_summary_prompt(prompt_parts, guidance_parts, LLM_SUMMARY_SECTION_KEYS, cleaned_rrc_placeholder, cleaned_goal_placeholder)
+    app.logger.info(f"Generated LLM Prompt (first 500 chars): {prompt_to_send[:500]}")
+    app.logger.info(f"Generated LLM Prompt (last 500 chars): {prompt_to_send[-500:]}")
+    app.logger.info(f"Total LLM Prompt length: {len(prompt_to_send)} characters")
+
+    llm_request = {
+        "model": "gpt-3.5-turbo",
+        "messages": [
+            {"role": "system", "content": system_message_content},
+            {"role": "user", "content": prompt_to_send}
+        ],
+        # max_tokens set to a higher value to accommodate the detailed JSON structure
+        "max_tokens": 700, # Increased from 120
+        "temperature": 0.5, # Slightly lower for more factual JSON
+        # Ensure the model is encouraged to output JSON
+        "response_format": {"type": "json_object"}
+    }
+
+    return _cached_student_summary_request(llm_request, student_name, LLM_SUMMARY_SECTION_KEYS, previous_summary_prompt_text)
+
+
+def _generate_student_summary_by_section(context_parts, guidance_parts, system_message_content, cleaned_rrc_placeholder, cleaned_goal_placeholder, student_name, volatile_text=None):
+    """
+    Requests each summary section as its own completion, all at once, and merges them into the
+    usual response. A section that fails or times out gets its fallback text; the rest still arrive.
+    """
+    section_graph = TaskGraph("llm_summary_sections", LLM_SUMMARY_SECTION_EXECUTOR)
+    for section in LLM_SUMMARY_SECTIONS:
+        section_key = section["key"]
+        llm_request = {
+            "model": "gpt-3.5-turbo",
+            "messages": [
+                {"role": "system", "content": system_message_content},
+                {"role": "user", "content": compose_student_summary_prompt(context_parts, guidance_parts, [section_key], cleaned_rrc_placeholder, cleaned_goal_placeholder)}
+            ],
+            "max_tokens": section["max_tokens"],
+            "temperature": 0.5,
+            "response_format": {"type": "json_object"}
+        }
+        section_graph.add(section_key,
+                          lambda llm_request=llm_request, section_key=section_key: _cached_student_summary_request(llm_request, student_name, [section_key], volatile_text),
+                          timeout=LLM_SUMMARY_SECTION_TIMEOUT_SECONDS,
+                          default=({section_key: LLM_SUMMARY_SECTION_FALLBACKS[section_key]}, False))
+    section_results, _ = section_graph.run()
+    merged_outputs = {key: section_results[key][0].get(key, LLM_SUMMARY_SECTION_FALLBACKS[key]) for key in LLM_SUMMARY_SECTION_KEYS}
+    return merged_outputs, all(section_results[key][1] for key in LLM_SUMMARY_SECTION_KEYS)
+
+
+def _cached_student_summary_request(llm_request, student_name, section_keys, volatile_text=None):
+    """
+    Serves an LLM summary request from LLM_SUMMARY_CACHE, or makes it (once across concurrent callers).
+    Returns (outputs, from_cache).
+    """
+    # The prompt embeds every score, comment, cycle and profile detail, so an unchanged report maps
+    # to the same key and any data change produces a new one.
+    cache_key = llm_request_cache_key(llm_request, volatile_text)
+    cached_outputs = LLM_SUMMARY_CACHE.get(cache_key)
+    if cached_outputs is not None:
+        increment_stat(LLM_SUMMARY_CACHE_STATS, "hits")
+        app.logger.info(f"Returning cached LLM summary for {student_name} (key {cache_key[:12]}).")
+        return cached_outputs, True
+    increment_stat(LLM_SUMMARY_CACHE_STATS, "misses")
+
+    parsed_llm_outputs, shared = LLM_SUMMARY_SINGLEFLIGHT.do(
+        cache_key, lambda: _request_student_summary_from_llm(llm_request, cache_key, student_name, section_keys))
+    return (copy.deepcopy(parsed_llm_outputs) if shared else parsed_llm_outputs), False
+
+
+def _request_student_summary_from_llm(llm_request, cache_key, student_name, section_keys):
+    """
+    Calls the LLM for the given section keys, asking again if the reply is not valid JSON (API errors are
+    already retried by LLM_CLIENT). Complete, well-formed outputs from the requested model are stored under cache_key.
+    """
     max_retries = 2
     for attempt in range(max_retries):
         try:
-            response = openai.chat.completions.create(
-                model="gpt-3.5-turbo", 
-                messages=[
-                    {"role": "system", "content": system_message_content},
-                    {"role": "user", "content": prompt_to_send}
-                ],
-                # max_tokens set to a higher value to accommodate the detailed JSON structure
-                max_tokens=700, # Increased from 120
-                temperature=0.5, # Slightly lower for more factual JSON
-                n=1,
-                stop=None,
-                # Ensure the model is encouraged to output JSON
-                response_format={"type": "json_object"} 
-            )
+            response, model_used = LLM_CLIENT.create("student_summary", n=1, stop=None, **llm_request)
             
             raw_response_content = response.choices[0].message.content.strip()
             app.logger.info(f"LLM raw response: {raw_response_content}")
@@ -804,24 +2408,18 @@ def generate_student_summary_with_llm(student_data_dict, coaching_kb_data, stude
             parsed_llm_outputs = json.loads(raw_response_content)
             
             # Validate that all expected keys are in the parsed dictionary
-            expected_keys = ["student_overview_summary", "chart_comparative_insights", "most_important_coaching_questions", "student_comment_analysis", "suggested_student_goals", "academic_benchmark_analysis", "questionnaire_interpretation_and_reflection_summary"] # ADDED new key
-            if not all(key in parsed_llm_outputs for key in expected_keys):
+            expected_keys = list(section_keys)
+            if all(key in parsed_llm_outputs for key in expected_keys):
+                # A fallback model's answer is only served for this request, not cached for the report's lifetime.
+                if model_used == llm_request["model"]:
+                    LLM_SUMMARY_CACHE.set(cache_key, parsed_llm_outputs)
+                    increment_stat(LLM_SUMMARY_CACHE_STATS, "stores")
+            else:
                 app.logger.error(f"LLM response missing one or more expected keys. Response: {raw_response_content}")
-                # If keys are missing, construct a default error structure for those keys
-                # but keep any keys that *were* successfully returned.
-                default_error_response = {
-                    "student_overview_summary": "Error: LLM did not provide a valid overview.",
-                    "chart_comparative_insights": "Error: LLM did not provide valid chart insights.",
-                    "most_important_coaching_questions": ["Error: LLM did not provide valid questions."],
-                    "student_comment_analysis": "Error: LLM did not provide valid comment analysis.",
-                    "suggested_student_goals": ["Error: LLM did not provide valid goal suggestions."],
-                    "academic_benchmark_analysis": "Error: LLM did not provide valid academic benchmark analysis.",
-                    "questionnaire_interpretation_and_reflection_summary": "Error: LLM did not provide questionnaire interpretation." # ADDED new key error
-                }
-                # Update with any valid parts from the LLM, then fill missing with errors
+                # Keep any keys that *were* successfully returned and fill the missing ones with errors.
                 for key in expected_keys:
                     if key not in parsed_llm_outputs:
-                        parsed_llm_outputs[key] = default_error_response[key]
+                        parsed_llm_outputs[key] = LLM_SUMMARY_SECTION_FALLBACKS[key]
                 # No need to raise an exception here, just return the partially error-filled dict
             
             app.logger.info(f"LLM generated structured data: {parsed_llm_outputs}")
@@ -841,18 +2439,16 @@ def generate_student_summary_with_llm(student_data_dict, coaching_kb_data, stude
                     "questionnaire_interpretation_and_reflection_summary": "Error parsing LLM response." # ADDED
                 }
         except Exception as e:
-            app.logger.error(f"Error calling OpenAI API or processing response (Attempt {attempt + 1}/{max_retries}): {e}")
-            if attempt == max_retries - 1: # Last attempt
-                 return {
-                    "student_overview_summary": f"Error generating structured summary for {student_name} from LLM. (Details: {str(e)[:100]}...)",
-                    "chart_comparative_insights": "Error generating insights from LLM.",
-                    "most_important_coaching_questions": ["Error generating questions from LLM."],
-                    "student_comment_analysis": "Error generating analysis from LLM.",
-                    "suggested_student_goals": ["Error generating goals from LLM."],
-                    "academic_benchmark_analysis": "Error generating academic benchmark analysis from LLM.",
-                    "questionnaire_interpretation_and_reflection_summary": "Error generating questionnaire interpretation from LLM." # ADDED
-                }
-        time.sleep(1) # Wait a second before retrying if an error occurred
+            app.logger.error(f"Error calling OpenAI API or processing response: {e}")
+            return {
+                "student_overview_summary": f"Error generating structured summary for {student_name} from LLM. (Details: {str(e)[:100]}...)",
+                "chart_comparative_insights": "Error generating insights from LLM.",
+                "most_important_coaching_questions": ["Error generating questions from LLM."],
+                "student_comment_analysis": "Error generating analysis from LLM.",
+                "suggested_student_goals": ["Error generating goals from LLM."],
+                "academic_benchmark_analysis": "Error generating academic benchmark analysis from LLM.",
+                "questionnaire_interpretation_and_reflection_summary": "Error generating questionnaire interpretation from LLM." # ADDED
+            }
 
     # Fallback if all retries fail (though individual try/excepts should handle returning)
     return {
@@ -952,154 +2548,32 @@ def get_meg_for_prior_attainment(prior_attainment_score, benchmark_table_data, n
         app.logger.warning(f"MEG lookup error: Could not process prior attainment score '{prior_attainment_score}' or table for {normalized_qualification_type}. Error: {e}")
         return "N/A"
 
-@app.route('/api/v1/coaching_suggestions', methods=['POST'])
-def coaching_suggestions():
-    app.logger.info("Received request for /api/v1/coaching_suggestions")
-    data = request.get_json()
-
-    if not data or 'student_object10_record_id' not in data:
-        app.logger.error("Missing 'student_object10_record_id' in request.")
-        return jsonify({"error": "Missing 'student_object10_record_id'"}), 400
-
-    student_obj10_id_from_request = data['student_object10_record_id']
-    app.logger.info(f"Processing request for student_object10_record_id: {student_obj10_id_from_request}")
-
-    # --- Phase 1: Data Gathering ---
-    student_vespa_data_response = get_knack_record("object_10", record_id=student_obj10_id_from_request)
-
-    if not student_vespa_data_response:
-        app.logger.error(f"Could not retrieve data for student_object10_record_id: {student_obj10_id_from_request} from Knack Object_10.")
-        return jsonify({"error": f"Could not retrieve data for student {student_obj10_id_from_request}"}), 404
-    
-    student_vespa_data = student_vespa_data_response 
-    app.logger.info(f"Successfully fetched Object_10 data for ID {student_obj10_id_from_request}")
-
-    # Determine School ID for the student
-    school_id = None
-    school_connection_raw = student_vespa_data.get("field_133_raw")
-    if isinstance(school_connection_raw, list) and school_connection_raw:
-        school_id = school_connection_raw[0].get('id')
-        app.logger.info(f"Extracted school_id '{school_id}' from student's Object_10 field_133_raw (list).")
-    elif isinstance(school_connection_raw, str):
-        school_id = school_connection_raw # Assuming the string itself is the ID
-        app.logger.info(f"Extracted school_id '{school_id}' (string) from student's Object_10 field_133_raw.")
-    else:
-        # Attempt to get from non-raw field if raw is not helpful
-        school_connection_obj = student_vespa_data.get("field_133")
-        if isinstance(school_connection_obj, list) and school_connection_obj: # Knack connection fields are lists of dicts
-             school_id = school_connection_obj[0].get('id')
-             app.logger.info(f"Extracted school_id '{school_id}' from student's Object_10 field_133 (non-raw object).")
-        else:
-            app.logger.warning(f"Could not determine school_id from field_133_raw or field_133 for student {student_obj10_id_from_request}. Data (raw): {school_connection_raw}, Data (obj): {school_connection_obj}")
-
-
-    school_wide_vespa_averages = None
-    if school_id:
-        school_wide_vespa_averages = get_school_vespa_averages(school_id)
-        if school_wide_vespa_averages:
-            app.logger.info(f"Successfully retrieved school-wide VESPA averages for school {school_id}: {school_wide_vespa_averages}")
-        else:
-            app.logger.warning(f"Failed to retrieve school-wide VESPA averages for school {school_id}.")
-    else:
-        app.logger.warning("Cannot fetch school-wide VESPA averages as school_id is unknown.")
-
-    student_name_for_profile_lookup = student_vespa_data.get("field_187_raw", {}).get("full", "N/A")
-    student_email_obj = student_vespa_data.get("field_197_raw") 
-    student_email = None
-    if isinstance(student_email_obj, dict) and 'email' in student_email_obj:
-        student_email = student_email_obj['email']
-    elif isinstance(student_email_obj, str): # If it's already a string
-        student_email = student_email_obj
-
-    actual_student_object3_id = None
-    if student_email:
-        filters_object3_for_id = [{'field': 'field_70', 'operator': 'is', 'value': student_email}]
-        object3_response = get_knack_record("object_3", filters=filters_object3_for_id)
-        
-        user_accounts_list = [] 
-        if object3_response and isinstance(object3_response, dict) and 'records' in object3_response and isinstance(object3_response['records'], list):
-            user_accounts_list = object3_response['records']
-            app.logger.info(f"Found {len(user_accounts_list)} records in Object_3 for email {student_email}.")
-        else:
-            app.logger.warning(f"Object_3 response for email {student_email} was not in the expected format or missing 'records' list. Response: {str(object3_response)[:200]}")
-
-        if user_accounts_list: 
-            if isinstance(user_accounts_list[0], dict):
-                actual_student_object3_id = user_accounts_list[0].get('id')
-                if actual_student_object3_id:
-                    app.logger.info(f"Determined actual Object_3 ID for student ({student_name_for_profile_lookup}, {student_email}): {actual_student_object3_id}")
-                else:
-                    app.logger.warning(f"Found Object_3 record for {student_email}, but it has no 'id' attribute: {str(user_accounts_list[0])[:100]}")
-            else:
-                app.logger.warning(f"First item in user_accounts_list for {student_email} is not a dictionary: {type(user_accounts_list[0])} - {str(user_accounts_list[0])[:100]}")
-        else:
-            app.logger.warning(f"Could not find any Object_3 records for email {student_email} to get actual_student_object3_id.")
-    else:
-        app.logger.warning(f"No student email from Object_10, cannot determine actual_student_object3_id for profile lookup (Student Obj10 ID: {student_obj10_id_from_request}).")
-
-    student_level = student_vespa_data.get("field_568_raw", "N/A") 
-    current_m_cycle_str = student_vespa_data.get("field_146_raw", "0")
+# --- Coaching Suggestions Report ---
+def get_score_profile_text(score_value):
+    if score_value is None: return "N/A"
     try:
-        # Ensure current_m_cycle_str is treated as a string for isdigit(), then convert to int
-        current_m_cycle_str_for_check = str(current_m_cycle_str) if current_m_cycle_str is not None else "0"
-        current_m_cycle = int(current_m_cycle_str_for_check) if current_m_cycle_str_for_check.isdigit() else 0
-    except ValueError:
-        app.logger.warning(f"Could not parse current_m_cycle '{current_m_cycle_str}' to int. Defaulting to 0.")
-        current_m_cycle = 0
-    
-    previous_interaction_summary = student_vespa_data.get("field_3271", "No previous AI coaching summary found.")
-
-    vespa_scores = {
-        "Vision": student_vespa_data.get("field_147"), "Effort": student_vespa_data.get("field_148"),
-        "Systems": student_vespa_data.get("field_149"), "Practice": student_vespa_data.get("field_150"),
-        "Attitude": student_vespa_data.get("field_151"), "Overall": student_vespa_data.get("field_152"),
-    }
-
-    historical_scores = {
-        "cycle1": {
-            "Vision": student_vespa_data.get("field_155"), "Effort": student_vespa_data.get("field_156"),
-            "Systems": student_vespa_data.get("field_157"), "Practice": student_vespa_data.get("field_158"),
-            "Attitude": student_vespa_data.get("field_159"), "Overall": student_vespa_data.get("field_160"),
-        },
-        "cycle2": {
-            "Vision": student_vespa_data.get("field_161"), "Effort": student_vespa_data.get("field_162"),
-            "Systems": student_vespa_data.get("field_163"), "Practice": student_vespa_data.get("field_164"),
-            "Attitude": student_vespa_data.get("field_165"), "Overall": student_vespa_data.get("field_166"),
-        },
-        "cycle3": {
-            "Vision": student_vespa_data.get("field_167"), "Effort": student_vespa_data.get("field_168"),
-            "Systems": student_vespa_data.get("field_169"), "Practice": student_vespa_data.get("field_170"),
-            "Attitude": student_vespa_data.get("field_171"), "Overall": student_vespa_data.get("field_172"),
-        }
-    }
-
-    student_reflections_and_goals = {
-        "rrc1_comment": student_vespa_data.get("field_2302"),
-        "rrc2_comment": student_vespa_data.get("field_2303"),
-        "rrc3_comment": student_vespa_data.get("field_2304"),
-        "goal1": student_vespa_data.get("field_2499"),
-        "goal2": student_vespa_data.get("field_2493"),
-        "goal3": student_vespa_data.get("field_2494"),
-    }
-    for key, value in student_reflections_and_goals.items():
-        if value is None:
-            student_reflections_and_goals[key] = "Not specified"
-    
-    app.logger.info(f"Object_10 Reflections and Goals: {student_reflections_and_goals}")
+        score = float(score_value) # Knack scores are usually numeric but can be strings
+        if score >= 8: return "High"
+        if score >= 6: return "Medium"
+        if score >= 4: return "Low"
+        if score >= 0: return "Very Low" # VESPA scores 1-10
+        return "N/A"
+    except (ValueError, TypeError):
+        app.logger.warning(f"Could not convert score '{score_value}' to float for profile text.")
+        return "N/A"
 
 
+def extract_object29_insights(object29_response, obj10_id_for_o29, current_m_cycle):
+    """
+    Reads the student's Object_29 questionnaire record for the current cycle. Returns
+    (key_individual_question_insights, object29_top_bottom_questions, all_scored_questions_from_object29).
+    """
     key_individual_question_insights = ["No questionnaire data processed."] 
     object29_top_bottom_questions = { "top_3": [], "bottom_3": [] }
     all_scored_questions_from_object29 = []
 
-    obj10_id_for_o29 = student_vespa_data.get('id')
     if obj10_id_for_o29 and current_m_cycle > 0:
-        app.logger.info(f"Fetching Object_29 for Object_10 ID: {obj10_id_for_o29} and Cycle: {current_m_cycle}")
-        filters_object29 = [
-            {'field': 'field_792', 'operator': 'is', 'value': obj10_id_for_o29},
-            {'field': 'field_863_raw', 'operator': 'is', 'value': str(current_m_cycle)}
-        ]
-        object29_response = get_knack_record("object_29", filters=filters_object29)
+        app.logger.info(f"Using Object_29 fetched for Object_10 ID: {obj10_id_for_o29} and Cycle: {current_m_cycle}")
         
         temp_o29_list = [] 
         if object29_response and isinstance(object29_response, dict) and 'records' in object29_response and isinstance(object29_response['records'], list):
@@ -1185,53 +2659,11 @@ def coaching_suggestions():
         app.logger.warning("Missing Object_10 ID or current_m_cycle is 0, skipping Object_29 fetch.")
         key_individual_question_insights = ["Skipped fetching questionnaire data (missing ID or cycle is 0)."]
 
-    # --- Phase 2: Knowledge Base Lookup & Data Structuring for LLM ---
-    def get_score_profile_text(score_value):
-        if score_value is None: return "N/A"
-        try:
-            score = float(score_value) # Knack scores are usually numeric but can be strings
-            if score >= 8: return "High"
-            if score >= 6: return "Medium"
-            if score >= 4: return "Low"
-            if score >= 0: return "Very Low" # VESPA scores 1-10
-            return "N/A"
-        except (ValueError, TypeError):
-            app.logger.warning(f"Could not convert score '{score_value}' to float for profile text.")
-            return "N/A"
+    return key_individual_question_insights, object29_top_bottom_questions, all_scored_questions_from_object29
 
-    vespa_profile_details_for_llm = {} # This will be a part of student_data_for_llm
-    for element, score_value in vespa_scores.items():
-        if element == "Overall": continue # Overall score handled separately if needed by LLM
-        score_profile_text = get_score_profile_text(score_value)
-        
-        # Find matching report text from report_text_data (Object_33)
-        matching_report_text_record = None
-        if report_text_data: # This KB is loaded globally
-            for record in report_text_data:
-                if (record.get('field_848') == student_level and 
-                    record.get('field_844') == element and 
-                    record.get('field_842') == score_profile_text):
-                    matching_report_text_record = record
-                    break
-        
-        element_specific_insights_from_o29 = []
-        if key_individual_question_insights and isinstance(key_individual_question_insights, list) and not key_individual_question_insights[0].startswith("No questionnaire data") and not key_individual_question_insights[0].startswith("Psychometric question details mapping not loaded") and not key_individual_question_insights[0].startswith("No questionnaire data found for cycle") and not key_individual_question_insights[0].startswith("Skipped fetching questionnaire data"):
-            for insight in key_individual_question_insights:
-                if isinstance(insight, str) and insight.upper().startswith(element.upper()):
-                    element_specific_insights_from_o29.append(insight)
-        
-        vespa_profile_details_for_llm[element] = {
-            "score_1_to_10": score_value if score_value is not None else "N/A",
-            "score_profile_text": score_profile_text,
-            # Primary tutor coaching comments are more for direct display, not LLM summary input unless crucial
-            "primary_tutor_coaching_comments": matching_report_text_record.get('field_853', "Coaching comments not found.") if matching_report_text_record else "Coaching comments not found.",
-            "key_individual_question_insights_from_object29": element_specific_insights_from_o29 if element_specific_insights_from_o29 else ["No specific insights for this category from questionnaire."]
-            # We don't pass all historical scores directly to LLM prompt to save tokens, unless specifically needed for a task
-        }
 
-    # Fetch Academic Profile Data (Object_112)
-    # academic_profile_summary_data = get_academic_profile(actual_student_object3_id, student_name_for_profile_lookup, student_obj10_id_from_request)
-    academic_profile_response = get_academic_profile(actual_student_object3_id, student_name_for_profile_lookup, student_obj10_id_from_request)
+def build_academic_benchmarks(academic_profile_response):
+    """Adds grade points and MEGs to the student's Object_112 subjects. Returns (academic_profile_summary, academic_megs)."""
     academic_profile_summary_data = academic_profile_response.get("subjects")
     object112_profile_record = academic_profile_response.get("profile_record") # This is the Object_112 record
     
@@ -1378,85 +2810,11 @@ def coaching_suggestions():
                          subject_summary['megPoints90'] = 0
                          subject_summary['megPoints100'] = 0
 
-
-    # Data structure to pass to the LLM
-    student_data_for_llm = {
-        "student_name": student_name_for_profile_lookup,
-        "student_level": student_level,
-        "current_cycle": current_m_cycle,
-        "vespa_profile": vespa_profile_details_for_llm, # Uses the processed details
-        "school_vespa_averages": school_wide_vespa_averages, # Pass school averages to LLM
-        "academic_profile_summary": academic_profile_summary_data,
-        "student_reflections_and_goals": student_reflections_and_goals,
-        "object29_question_highlights": object29_top_bottom_questions,
-        "previous_interaction_summary": previous_interaction_summary,
-        "academic_megs": academic_megs_data # Add MEGs to data for LLM
-        # key_individual_question_insights is indirectly included via vespa_profile_details_for_llm
-    }
-    
-    # Load full KBs here to pass to LLM function (or relevant parts)
-    # coaching_kb is already loaded globally
-    # Load 100 statements text
-    statements_file_path = os.path.join(os.path.dirname(__file__), 'knowledge_base', '100 statements - 2023.txt')
-    # Corrected path relative to app.py
-    alt_statements_file_path = os.path.join(os.path.dirname(__file__), '..', 'VESPA Contextual Information', '100 statements - 2023.txt')
-    # Normalise path for OS compatibility
-    alt_statements_file_path = os.path.normpath(alt_statements_file_path)
-
-    student_goals_statements_content = None
-    try:
-        app.logger.info(f"Attempting to load 100 statements from: {alt_statements_file_path}")
-        with open(alt_statements_file_path, 'r', encoding='utf-8') as f:
-            student_goals_statements_content = f.read()
-        app.logger.info("Successfully loaded '100 statements - 2023.txt' using UTF-8")
-    except FileNotFoundError:
-        app.logger.error(f"'100 statements - 2023.txt' not found at {alt_statements_file_path}. Also tried {statements_file_path}")
-    except UnicodeDecodeError:
-        app.logger.warning(f"UTF-8 decoding failed for '100 statements - 2023.txt' at {alt_statements_file_path}. Attempting with latin-1.")
-        try:
-            with open(alt_statements_file_path, 'r', encoding='latin-1') as f:
-                student_goals_statements_content = f.read()
-            app.logger.info("Successfully loaded '100 statements - 2023.txt' using latin-1 fallback.")
-        except Exception as e_latin1:
-            app.logger.error(f"Error loading '100 statements - 2023.txt' with latin-1 fallback: {e_latin1}")
-    except Exception as e:
-        app.logger.error(f"Error loading '100 statements - 2023.txt': {e}")
+    return academic_profile_summary_data, academic_megs_data
 
 
-    # Call LLM to get structured insights
-    # The coaching_kb (dict) and student_goals_statements_content (string) are passed here
-    llm_structured_output = generate_student_summary_with_llm(student_data_for_llm, coaching_kb, REFLECTIVE_STATEMENTS_DATA, all_scored_questions_from_object29) # Pass all_scored_questions
-    
-    # --- Update Object_10 with the new AI summary for field_3271 ---
-    if llm_structured_output and isinstance(llm_structured_output, dict) and llm_structured_output.get('student_overview_summary'):
-        summary_to_save = llm_structured_output['student_overview_summary']
-        # Ensure summary is not an error message before saving
-        if "error" not in summary_to_save.lower() and "unavailable" not in summary_to_save.lower() and summary_to_save:
-            update_payload_obj10 = {
-                "field_3271": summary_to_save
-            }
-            headers_knack_update = {
-                'X-Knack-Application-Id': KNACK_APP_ID,
-                'X-Knack-REST-API-Key': KNACK_API_KEY,
-                'Content-Type': 'application/json'
-            }
-            update_url_obj10 = f"{KNACK_BASE_URL}/object_10/records/{student_obj10_id_from_request}"
-            try:
-                app.logger.info(f"Attempting to update Object_10 record {student_obj10_id_from_request} with new summary for field_3271. Summary: '{summary_to_save[:100]}...'") # Log summary
-                update_response = requests.put(update_url_obj10, headers=headers_knack_update, json=update_payload_obj10)
-                update_response.raise_for_status()
-                app.logger.info(f"Successfully updated field_3271 for Object_10 record {student_obj10_id_from_request}.")
-            except requests.exceptions.HTTPError as e_http:
-                app.logger.error(f"HTTP error updating field_3271 for Object_10 {student_obj10_id_from_request}: {e_http}. Response: {update_response.content}")
-            except requests.exceptions.RequestException as e_req:
-                app.logger.error(f"Request exception updating field_3271 for Object_10 {student_obj10_id_from_request}: {e_req}")
-            except Exception as e_gen:
-                app.logger.error(f"General error updating field_3271 for Object_10 {student_obj10_id_from_request}: {e_gen}")
-        else:
-            app.logger.info(f"Skipping update of field_3271 for Object_10 {student_obj10_id_from_request} as LLM summary was an error or unavailable: '{summary_to_save}'")
-    else:
-        app.logger.warning(f"Could not update field_3271 for Object_10 {student_obj10_id_from_request} as llm_structured_output or student_overview_summary was missing/invalid. LLM Output: {str(llm_structured_output)[:200]}...")
-
+def build_vespa_profile_for_api(vespa_scores, historical_scores, student_level):
+    """Per-element VESPA details for the report: scores, report text, tutor questions and score history."""
     # --- Prepare Final API Response ---
     # The vespa_profile_details for the API response needs more than what LLM got (report_text etc.)
     # So, we rebuild it here for the API response.
@@ -1508,7 +2866,11 @@ def coaching_suggestions():
              final_vespa_profile_details_for_api[element].pop("report_questions_for_student", None)
              final_vespa_profile_details_for_api[element].pop("report_suggested_tools_for_student", None)
 
+    return final_vespa_profile_details_for_api
 
+
+def build_tutor_framing():
+    """General introductory questions and the overall framing statement from coaching_kb."""
     # Populate general introductory questions and overall framing statement from coaching_kb
     general_intro_questions = ["No general introductory questions found."]
     if coaching_kb and coaching_kb.get('generalIntroductoryQuestions'):
@@ -1526,33 +2888,372 @@ def coaching_suggestions():
             first_stmt = coaching_kb['conditionalFramingStatements'][0]
             overall_framing_statement = {"id": first_stmt.get('id', 'unknown_conditional'), "statement": first_stmt.get('statement', "Conditional statement text missing.")}
 
-    response_data = {
+    return overall_framing_statement, general_intro_questions
+
+
+def load_coaching_student_record():
+    """
+    Shared start of coaching_suggestions and coaching_suggestions_stream: validates the request and
+    fetches the student's Object_10 record. Returns (student_obj10_id, record, None) or (None, None, error_response).
+    """
+    app.logger.info(f"Received request for {request.path}")
+    data = request.get_json()
+
+    if not data or 'student_object10_record_id' not in data:
+        app.logger.error("Missing 'student_object10_record_id' in request.")
+        return None, None, (jsonify({"error": "Missing 'student_object10_record_id'"}), 400)
+
+    student_obj10_id_from_request = data['student_object10_record_id']
+    app.logger.info(f"Processing request for student_object10_record_id: {student_obj10_id_from_request}")
+
+    # --- Phase 1: Data Gathering ---
+    student_vespa_data_response = get_knack_record("object_10", record_id=student_obj10_id_from_request)
+
+    if not student_vespa_data_response:
+        app.logger.error(f"Could not retrieve data for student_object10_record_id: {student_obj10_id_from_request} from Knack Object_10.")
+        return None, None, (jsonify({"error": f"Could not retrieve data for student {student_obj10_id_from_request}"}), 404)
+    
+    student_vespa_data = student_vespa_data_response 
+    app.logger.info(f"Successfully fetched Object_10 data for ID {student_obj10_id_from_request}")
+    return student_obj10_id_from_request, student_vespa_data, None
+
+
+def iter_coaching_suggestion_blocks(student_obj10_id_from_request, student_vespa_data):
+    """
+    Builds the coaching_suggestions response as blocks of top-level response keys, yielding
+    (block_name, block) as each is ready: the Object_10-only blocks first, then school averages,
+    questionnaire and academic blocks in whichever order their Knack lookups finish, and the
+    LLM insights last. Merging every block gives the full response.
+    """
+    # Determine School ID for the student
+    school_id = None
+    school_connection_raw = student_vespa_data.get("field_133_raw")
+    if isinstance(school_connection_raw, list) and school_connection_raw:
+        school_id = school_connection_raw[0].get('id')
+        app.logger.info(f"Extracted school_id '{school_id}' from student's Object_10 field_133_raw (list).")
+    elif isinstance(school_connection_raw, str):
+        school_id = school_connection_raw # Assuming the string itself is the ID
+        app.logger.info(f"Extracted school_id '{school_id}' (string) from student's Object_10 field_133_raw.")
+    else:
+        # Attempt to get from non-raw field if raw is not helpful
+        school_connection_obj = student_vespa_data.get("field_133")
+        if isinstance(school_connection_obj, list) and school_connection_obj: # Knack connection fields are lists of dicts
+             school_id = school_connection_obj[0].get('id')
+             app.logger.info(f"Extracted school_id '{school_id}' from student's Object_10 field_133 (non-raw object).")
+        else:
+            app.logger.warning(f"Could not determine school_id from field_133_raw or field_133 for student {student_obj10_id_from_request}. Data (raw): {school_connection_raw}, Data (obj): {school_connection_obj}")
+
+
+    student_name_for_profile_lookup = student_vespa_data.get("field_187_raw", {}).get("full", "N/A")
+    student_email_obj = student_vespa_data.get("field_197_raw") 
+    student_email = None
+    if isinstance(student_email_obj, dict) and 'email' in student_email_obj:
+        student_email = student_email_obj['email']
+    elif isinstance(student_email_obj, str): # If it's already a string
+        student_email = student_email_obj
+
+    student_level = student_vespa_data.get("field_568_raw", "N/A") 
+    current_m_cycle_str = student_vespa_data.get("field_146_raw", "0")
+    try:
+        # Ensure current_m_cycle_str is treated as a string for isdigit(), then convert to int
+        current_m_cycle_str_for_check = str(current_m_cycle_str) if current_m_cycle_str is not None else "0"
+        current_m_cycle = int(current_m_cycle_str_for_check) if current_m_cycle_str_for_check.isdigit() else 0
+    except ValueError:
+        app.logger.warning(f"Could not parse current_m_cycle '{current_m_cycle_str}' to int. Defaulting to 0.")
+        current_m_cycle = 0
+
+    previous_interaction_summary = student_vespa_data.get("field_3271", "No previous AI coaching summary found.")
+
+    vespa_scores = {
+        "Vision": student_vespa_data.get("field_147"), "Effort": student_vespa_data.get("field_148"),
+        "Systems": student_vespa_data.get("field_149"), "Practice": student_vespa_data.get("field_150"),
+        "Attitude": student_vespa_data.get("field_151"), "Overall": student_vespa_data.get("field_152"),
+    }
+
+    historical_scores = {
+        "cycle1": {
+            "Vision": student_vespa_data.get("field_155"), "Effort": student_vespa_data.get("field_156"),
+            "Systems": student_vespa_data.get("field_157"), "Practice": student_vespa_data.get("field_158"),
+            "Attitude": student_vespa_data.get("field_159"), "Overall": student_vespa_data.get("field_160"),
+        },
+        "cycle2": {
+            "Vision": student_vespa_data.get("field_161"), "Effort": student_vespa_data.get("field_162"),
+            "Systems": student_vespa_data.get("field_163"), "Practice": student_vespa_data.get("field_164"),
+            "Attitude": student_vespa_data.get("field_165"), "Overall": student_vespa_data.get("field_166"),
+        },
+        "cycle3": {
+            "Vision": student_vespa_data.get("field_167"), "Effort": student_vespa_data.get("field_168"),
+            "Systems": student_vespa_data.get("field_169"), "Practice": student_vespa_data.get("field_170"),
+            "Attitude": student_vespa_data.get("field_171"), "Overall": student_vespa_data.get("field_172"),
+        }
+    }
+
+    student_reflections_and_goals = {
+        "rrc1_comment": student_vespa_data.get("field_2302"),
+        "rrc2_comment": student_vespa_data.get("field_2303"),
+        "rrc3_comment": student_vespa_data.get("field_2304"),
+        "goal1": student_vespa_data.get("field_2499"),
+        "goal2": student_vespa_data.get("field_2493"),
+        "goal3": student_vespa_data.get("field_2494"),
+    }
+    for key, value in student_reflections_and_goals.items():
+        if value is None:
+            student_reflections_and_goals[key] = "Not specified"
+    
+    app.logger.info(f"Object_10 Reflections and Goals: {student_reflections_and_goals}")
+
+    yield "student", {
         "student_name": student_name_for_profile_lookup,
         "student_level": student_level,
         "current_cycle": current_m_cycle,
-        "vespa_profile": final_vespa_profile_details_for_api, # Use the fully detailed one for API
-        "academic_profile_summary": academic_profile_summary_data,
         "student_reflections_and_goals": student_reflections_and_goals,
-        "object29_question_highlights": object29_top_bottom_questions,
+        "previous_interaction_summary": previous_interaction_summary,
+    }
+    yield "vespa_profile", {"vespa_profile": build_vespa_profile_for_api(vespa_scores, historical_scores, student_level)}
+    overall_framing_statement, general_intro_questions = build_tutor_framing()
+    yield "tutor_framing", {
         "overall_framing_statement_for_tutor": overall_framing_statement,
         "general_introductory_questions_for_tutor": general_intro_questions,
-        "llm_generated_insights": llm_structured_output, # This now holds the structured data
+    }
+
+    # Everything below only needs Object_10, so the remaining Knack lookups run as a task graph:
+    # school averages and Object_29 in parallel with the email -> Object_3 -> Object_112 chain.
+    obj10_id_for_o29 = student_vespa_data.get('id')
+    filters_object29 = [
+        {'field': 'field_792', 'operator': 'is', 'value': obj10_id_for_o29},
+        {'field': 'field_863_raw', 'operator': 'is', 'value': str(current_m_cycle)}
+    ]
+    profile_not_found = {"subjects": [{"subject": "Academic profile not found by any method.", "currentGrade": "N/A", "targetGrade": "N/A", "effortGrade": "N/A", "examType": "N/A"}], "profile_record": None}
+    coaching_data_graph = TaskGraph("coaching_suggestions")
+    coaching_data_graph.add("school_averages", lambda: get_school_vespa_averages(school_id) if school_id else None,
+                            timeout=COACHING_TASK_TIMEOUT_SECONDS)
+    coaching_data_graph.add("object29_response",
+                            lambda: get_knack_record("object_29", filters=filters_object29) if obj10_id_for_o29 and current_m_cycle > 0 else None,
+                            timeout=COACHING_TASK_TIMEOUT_SECONDS)
+    coaching_data_graph.add("object3_id", lambda: get_student_object3_id(student_obj10_id_from_request, student_email, student_name_for_profile_lookup),
+                            timeout=COACHING_TASK_TIMEOUT_SECONDS)
+    coaching_data_graph.add("academic_profile",
+                            lambda object3_id: get_academic_profile(object3_id, student_name_for_profile_lookup, student_obj10_id_from_request),
+                            deps=("object3_id",), timeout=COACHING_TASK_TIMEOUT_SECONDS, default=profile_not_found)
+
+    for task_name, task_result, _ in coaching_data_graph.iter_results():
+        if task_name == "school_averages":
+            school_wide_vespa_averages = task_result
+            if school_id and school_wide_vespa_averages:
+                app.logger.info(f"Successfully retrieved school-wide VESPA averages for school {school_id}: {school_wide_vespa_averages}")
+            elif school_id:
+                app.logger.warning(f"Failed to retrieve school-wide VESPA averages for school {school_id}.")
+            else:
+                app.logger.warning("Cannot fetch school-wide VESPA averages as school_id is unknown.")
+            yield "school_vespa_averages", {"school_vespa_averages": school_wide_vespa_averages}
+        elif task_name == "object29_response":
+            key_individual_question_insights, object29_top_bottom_questions, all_scored_questions_from_object29 = \
+                extract_object29_insights(task_result, obj10_id_for_o29, current_m_cycle)
+            yield "questionnaire", {
+                "object29_question_highlights": object29_top_bottom_questions,
+                "all_scored_questionnaire_statements": all_scored_questions_from_object29,
+            }
+        elif task_name == "academic_profile":
+            # Academic Profile Data (Object_112) with prior attainment and MEGs
+            academic_profile_summary_data, academic_megs_data = build_academic_benchmarks(task_result)
+            yield "academic_profile", {
+                "academic_profile_summary": academic_profile_summary_data,
+                "academic_megs": academic_megs_data,
+            }
+
+    # --- Phase 2: Knowledge Base Lookup & Data Structuring for LLM ---
+    vespa_profile_details_for_llm = {} # This will be a part of student_data_for_llm
+    for element, score_value in vespa_scores.items():
+        if element == "Overall": continue # Overall score handled separately if needed by LLM
+        score_profile_text = get_score_profile_text(score_value)
+        
+        # Find matching report text from report_text_data (Object_33)
+        matching_report_text_record = None
+        if report_text_data: # This KB is loaded globally
+            for record in report_text_data:
+                if (record.get('field_848') == student_level and 
+                    record.get('field_844') == element and 
+                    record.get('field_842') == score_profile_text):
+                    matching_report_text_record = record
+                    break
+        
+        element_specific_insights_from_o29 = []
+        if key_individual_question_insights and isinstance(key_individual_question_insights, list) and not key_individual_question_insights[0].startswith("No questionnaire data") and not key_individual_question_insights[0].startswith("Psychometric question details mapping not loaded") and not key_individual_question_insights[0].startswith("No questionnaire data found for cycle") and not key_individual_question_insights[0].startswith("Skipped fetching questionnaire data"):
+            for insight in key_individual_question_insights:
+                if isinstance(insight, str) and insight.upper().startswith(element.upper()):
+                    element_specific_insights_from_o29.append(insight)
+        
+        vespa_profile_details_for_llm[element] = {
+            "score_1_to_10": score_value if score_value is not None else "N/A",
+            "score_profile_text": score_profile_text,
+            # Primary tutor coaching comments are more for direct display, not LLM summary input unless crucial
+            "primary_tutor_coaching_comments": matching_report_text_record.get('field_853', "Coaching comments not found.") if matching_report_text_record else "Coaching comments not found.",
+            "key_individual_question_insights_from_object29": element_specific_insights_from_o29 if element_specific_insights_from_o29 else ["No specific insights for this category from questionnaire."]
+            # We don't pass all historical scores directly to LLM prompt to save tokens, unless specifically needed for a task
+        }
+
+    # Data structure to pass to the LLM
+    student_data_for_llm = {
+        "student_name": student_name_for_profile_lookup,
+        "student_level": student_level,
+        "current_cycle": current_m_cycle,
+        "vespa_profile": vespa_profile_details_for_llm, # Uses the processed details
+        "school_vespa_averages": school_wide_vespa_averages, # Pass school averages to LLM
+        "academic_profile_summary": academic_profile_summary_data,
+        "student_reflections_and_goals": student_reflections_and_goals,
+        "object29_question_highlights": object29_top_bottom_questions,
         "previous_interaction_summary": previous_interaction_summary,
-        "school_vespa_averages": school_wide_vespa_averages,
-        "academic_megs": academic_megs_data, # Add MEGs to API response
-        "all_scored_questionnaire_statements": all_scored_questions_from_object29 # ADDED for frontend chart
+        "academic_megs": academic_megs_data # Add MEGs to data for LLM
+        # key_individual_question_insights is indirectly included via vespa_profile_details_for_llm
     }
     
-    # For backward compatibility with old frontend's "llm_generated_summary_and_suggestions.student_overview_summary"
-    # We can also add the student_overview_summary at the top level of llm_generated_insights if it's not already there.
-    # The new llm_structured_output should already contain "student_overview_summary" as a key.
-    # If frontend expects "llm_generated_summary_and_suggestions", we might need to adapt.
-    # For now, sending "llm_generated_insights" as the main holder of new structured data.
+    # Load full KBs here to pass to LLM function (or relevant parts)
+    # coaching_kb is already loaded globally
+    # Load 100 statements text
+    statements_file_path = os.path.join(os.path.dirname(__file__), 'knowledge_base', '100 statements - 2023.txt')
+    # Corrected path relative to app.py
+    alt_statements_file_path = os.path.join(os.path.dirname(__file__), '..', 'VESPA Contextual Information', '100 statements - 2023.txt')
+    # Normalise path for OS compatibility
+    alt_statements_file_path = os.path.normpath(alt_statements_file_path)
+
+    student_goals_statements_content = None
+    try:
+        app.logger.info(f"Attempting to load 100 statements from: {alt_statements_file_path}")
+        with open(alt_statements_file_path, 'r', encoding='utf-8') as f:
+            student_goals_statements_content = f.read()
+        app.logger.info("Successfully loaded '100 statements - 2023.txt' using UTF-8")
+    except FileNotFoundError:
+        app.logger.error(f"'100 statements - 2023.txt' not found at {alt_statements_file_path}. Also tried {statements_file_path}")
+    except UnicodeDecodeError:
+        app.logger.warning(f"UTF-8 decoding failed for '100 statements - 2023.txt' at {alt_statements_file_path}. Attempting with latin-1.")
+        try:
+            with open(alt_statements_file_path, 'r', encoding='latin-1') as f:
+                student_goals_statements_content = f.read()
+            app.logger.info("Successfully loaded '100 statements - 2023.txt' using latin-1 fallback.")
+        except Exception as e_latin1:
+            app.logger.error(f"Error loading '100 statements - 2023.txt' with latin-1 fallback: {e_latin1}")
+    except Exception as e:
+        app.logger.error(f"Error loading '100 statements - 2023.txt': {e}")
+
+
+    # Call LLM to get structured insights
+    # The coaching_kb (dict) and student_goals_statements_content (string) are passed here
+    llm_structured_output, llm_output_from_cache = generate_student_summary_with_llm(student_data_for_llm, coaching_kb, REFLECTIVE_STATEMENTS_DATA, all_scored_questions_from_object29) # Pass all_scored_questions
+    
+    # --- Update Object_10 with the new AI summary for field_3271 ---
+    if llm_structured_output and isinstance(llm_structured_output, dict) and llm_structured_output.get('student_overview_summary'):
+        summary_to_save = llm_structured_output['student_overview_summary']
+        # A cached or unchanged summary is already what field_3271 holds (or held when it was generated).
+        if llm_output_from_cache or summary_to_save == student_vespa_data.get("field_3271"):
+            app.logger.info(f"Skipping update of field_3271 for Object_10 {student_obj10_id_from_request}: summary {'came from the cache' if llm_output_from_cache else 'is unchanged'}.")
+        # Ensure summary is not an error message before saving
+        elif "error" not in summary_to_save.lower() and "unavailable" not in summary_to_save.lower() and summary_to_save:
+            update_payload_obj10 = {
+                "field_3271": summary_to_save
+            }
+            knack_client = get_knack_client()
+            try:
+                if not knack_client:
+                    raise requests.exceptions.RequestException("Knack client is not configured")
+                app.logger.info(f"Attempting to update Object_10 record {student_obj10_id_from_request} with new summary for field_3271. Summary: '{summary_to_save[:100]}...'") # Log summary
+                update_response = knack_client.put("object_10", student_obj10_id_from_request, update_payload_obj10)
+                update_response.raise_for_status()
+                forget_request_record("object_10", student_obj10_id_from_request)
+                app.logger.info(f"Successfully updated field_3271 for Object_10 record {student_obj10_id_from_request}.")
+            except requests.exceptions.HTTPError as e_http:
+                app.logger.error(f"HTTP error updating field_3271 for Object_10 {student_obj10_id_from_request}: {e_http}. Response: {update_response.content}")
+            except requests.exceptions.RequestException as e_req:
+                app.logger.error(f"Request exception updating field_3271 for Object_10 {student_obj10_id_from_request}: {e_req}")
+            except Exception as e_gen:
+                app.logger.error(f"General error updating field_3271 for Object_10 {student_obj10_id_from_request}: {e_gen}")
+        else:
+            app.logger.info(f"Skipping update of field_3271 for Object_10 {student_obj10_id_from_request} as LLM summary was an error or unavailable: '{summary_to_save}'")
+    else:
+        app.logger.warning(f"Could not update field_3271 for Object_10 {student_obj10_id_from_request} as llm_structured_output or student_overview_summary was missing/invalid. LLM Output: {str(llm_structured_output)[:200]}...")
+
+    yield "llm_generated_insights", {"llm_generated_insights": llm_structured_output}
+
+
+@app.route('/api/v1/coaching_suggestions', methods=['POST'])
+def coaching_suggestions():
+    student_obj10_id_from_request, student_vespa_data, error_response = load_coaching_student_record()
+    if error_response:
+        return error_response
+
+    response_data = {}
+    for _, report_block in iter_coaching_suggestion_blocks(student_obj10_id_from_request, student_vespa_data):
+        response_data.update(report_block)
 
     app.logger.info(f"Successfully prepared API response for student_object10_record_id: {student_obj10_id_from_request}")
     return jsonify(response_data)
 
+
+@app.route('/api/v1/coaching_suggestions_stream', methods=['POST'])
+def coaching_suggestions_stream():
+    """
+    Streaming variant of coaching_suggestions. Same request body; the reply is text/event-stream with
+    one event per block (named as in iter_coaching_suggestion_blocks, data = that block's response
+    keys), so the report can render charts and benchmarks before the LLM insights arrive. A final
+    "done" event lists the blocks sent; merging all block payloads gives the coaching_suggestions response.
+    If a block fails after the stream has started, an "error" event is sent in place of "done".
+    """
+    student_obj10_id_from_request, student_vespa_data, error_response = load_coaching_student_record()
+    if error_response:
+        return error_response
+
+    def generate():
+        sent_blocks = []
+        try:
+            for block_name, report_block in iter_coaching_suggestion_blocks(student_obj10_id_from_request, student_vespa_data):
+                sent_blocks.append(block_name)
+                yield sse_event(block_name, report_block)
+        except Exception as e:
+            # The 200 status is already sent, so the failure has to be reported in-band.
+            app.logger.error(f"coaching_suggestions_stream: Error preparing coaching suggestions for {student_obj10_id_from_request}: {e}")
+            yield sse_event("error", {"error": "An error occurred while preparing the coaching report.", "blocks": sent_blocks})
+            return
+        app.logger.info(f"Streamed coaching suggestions for student_object10_record_id: {student_obj10_id_from_request}")
+        yield sse_event("done", {"blocks": sent_blocks})
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 # --- Function to get School VESPA Averages ---
+SCHOOL_VESPA_ELEMENT_FIELDS = {
+    "Vision": "field_147", "Effort": "field_148",
+    "Systems": "field_149", "Practice": "field_150",
+    "Attitude": "field_151", "Overall": "field_152",
+}
+SCHOOL_AVERAGES_SINGLEFLIGHT = SingleFlight("school_vespa_averages")
+
+def aggregate_school_vespa_scores(filters):
+    """
+    Streams a school's Object_10 pages into running sums, dropping each page once it is counted.
+    Returns (sums, counts, record_count, page_stream).
+    """
+    sums = {key: 0.0 for key in SCHOOL_VESPA_ELEMENT_FIELDS}
+    counts = {key: 0 for key in SCHOOL_VESPA_ELEMENT_FIELDS}
+    record_count = 0
+    page_stream = KnackPageStream("object_10", filters=filters)
+    for records_on_page in page_stream:
+        for record in records_on_page:
+            # Ensure record is a dictionary before trying to .get() from it
+            if not isinstance(record, dict):
+                app.logger.warning(f"Skipping an Object_10 item because it is not a dictionary: {type(record)} - Content: {str(record)[:100]}...")
+                continue
+            record_count += 1
+            for element_name, field_key in SCHOOL_VESPA_ELEMENT_FIELDS.items():
+                score_value = record.get(field_key)
+                if score_value is not None:
+                    try:
+                        sums[element_name] += float(score_value)
+                        counts[element_name] += 1
+                    except (ValueError, TypeError):
+                        app.logger.debug(f"Could not convert score '{score_value}' for {element_name} in record {record.get('id', 'N/A')} to float.")
+    return sums, counts, record_count, page_stream
+
+
 def get_school_vespa_averages(school_id):
     """Calculates and caches average VESPA scores for a given school ID."""
     if not school_id:
@@ -1562,139 +3263,265 @@ def get_school_vespa_averages(school_id):
     # Check cache first
     cached_data = SCHOOL_AVERAGES_CACHE.get(school_id)
     if cached_data:
-        if time.time() - cached_data['timestamp'] < CACHE_TTL_SECONDS:
+        cache_age_seconds = time.time() - cached_data['timestamp']
+        if cache_age_seconds < CACHE_TTL_SECONDS:
             app.logger.info(f"Returning cached school VESPA averages for school_id: {school_id}")
             return cached_data['averages']
+        elif SCHOOL_AVERAGES_STALE_WHILE_REVALIDATE and cache_age_seconds < SCHOOL_AVERAGES_HARD_TTL_SECONDS:
+            app.logger.info(f"Returning stale school VESPA averages for school_id: {school_id} (age {int(cache_age_seconds)}s) and refreshing in the background.")
+            refresh_school_vespa_averages_in_background(school_id)
+            return cached_data['averages']
         else:
             app.logger.info(f"Cache expired for school_id: {school_id}")
-            del SCHOOL_AVERAGES_CACHE[school_id]
+            SCHOOL_AVERAGES_CACHE.delete(school_id)
+
+    # Concurrent recomputes for the same school share one streaming pass over Knack.
+    averages, shared = SCHOOL_AVERAGES_SINGLEFLIGHT.do(school_id, lambda: _compute_school_vespa_averages(school_id))
+    if shared:
+        app.logger.info(f"Coalesced school VESPA averages recompute for school_id {school_id} with an identical in-flight request.")
+        return dict(averages) if averages else averages
+    return averages
+
+
+SCHOOL_AVERAGES_REFRESHING = set()
+SCHOOL_AVERAGES_REFRESH_LOCK = threading.Lock()
+SCHOOL_AVERAGES_REFRESH_STATS = {"started": 0, "succeeded": 0, "failed": 0, "skipped_already_running": 0}
+
+def refresh_school_vespa_averages_in_background(school_id):
+    """Starts a background recompute for a school unless one is already running. Returns True if started."""
+    with SCHOOL_AVERAGES_REFRESH_LOCK:
+        if school_id in SCHOOL_AVERAGES_REFRESHING:
+            SCHOOL_AVERAGES_REFRESH_STATS["skipped_already_running"] += 1
+            return False
+        # With a shared backend, the lock entry also stops other workers from refreshing the same school.
+        # Its token makes sure only this refresh releases it, not one that took the lock after it expired.
+        lock_token = f"{os.getpid()}:{uuid.uuid4().hex}"
+        if not SCHOOL_AVERAGES_REFRESH_LOCKS.add(school_id, lock_token):
+            SCHOOL_AVERAGES_REFRESH_STATS["skipped_already_running"] += 1
+            return False
+        SCHOOL_AVERAGES_REFRESHING.add(school_id)
+        SCHOOL_AVERAGES_REFRESH_STATS["started"] += 1
+
+    def run_refresh():
+        try:
+            averages, _ = SCHOOL_AVERAGES_SINGLEFLIGHT.do(school_id, lambda: _compute_school_vespa_averages(school_id))
+            # On failure the stale entry is left in place until it reaches the hard expiry.
+            outcome = "succeeded" if averages else "failed"
+        except Exception as e:
+            app.logger.error(f"Background refresh of school VESPA averages for school_id {school_id} failed: {e}")
+            outcome = "failed"
+        SCHOOL_AVERAGES_REFRESH_LOCKS.delete_if_equal(school_id, lock_token)
+        with SCHOOL_AVERAGES_REFRESH_LOCK:
+            SCHOOL_AVERAGES_REFRESHING.discard(school_id)
+            SCHOOL_AVERAGES_REFRESH_STATS[outcome] += 1
+
+    threading.Thread(target=run_refresh, name=f"school-averages-refresh-{school_id}", daemon=True).start()
+    return True
+
+
+def _compute_school_vespa_averages(school_id):
+    app.logger.info(f"Calculating school VESPA averages for school_id: {school_id} by streaming student records.")
 
-    app.logger.info(f"Calculating school VESPA averages for school_id: {school_id} by fetching all student records.")
-    
     filters_primary = [{'field': 'field_133', 'operator': 'is', 'value': school_id}]
-    app.logger.info(f"Attempting to fetch all records for object_10 with primary filter: {filters_primary}")
-    all_student_records_for_school = get_all_knack_records("object_10", filters=filters_primary)
+    app.logger.info(f"Attempting to stream records for object_10 with primary filter: {filters_primary}")
+    sums, counts, record_count, page_stream = aggregate_school_vespa_scores(filters_primary)
 
-    if not all_student_records_for_school:
+    if not record_count:
         app.logger.warning(f"No student records found for school_id {school_id} using primary filter (field_133). Trying fallback filter (field_133_raw).")
         filters_fallback = [{'field': 'field_133_raw', 'operator': 'contains', 'value': school_id}]
-        app.logger.info(f"Attempting to fetch all records for object_10 with fallback filter: {filters_fallback}")
-        all_student_records_for_school = get_all_knack_records("object_10", filters=filters_fallback)
-        
-        if not all_student_records_for_school:
+        app.logger.info(f"Attempting to stream records for object_10 with fallback filter: {filters_fallback}")
+        sums, counts, record_count, page_stream = aggregate_school_vespa_scores(filters_fallback)
+
+        if not record_count:
             app.logger.error(f"Could not retrieve any student records for school_id: {school_id} using primary or fallback filters. Cannot calculate averages.")
             return None
-        app.logger.info(f"Retrieved {len(all_student_records_for_school)} student records for school_id {school_id} using fallback filter (field_133_raw).")
+        app.logger.info(f"Aggregated {record_count} student records for school_id {school_id} using fallback filter (field_133_raw).")
     else:
-        app.logger.info(f"Retrieved {len(all_student_records_for_school)} student records for school_id {school_id} using primary filter (field_133).")
+        app.logger.info(f"Aggregated {record_count} student records for school_id {school_id} using primary filter (field_133).")
+
+    if page_stream.truncated:
+        app.logger.warning(f"School VESPA averages for school_id {school_id} are based on a truncated record set ({page_stream.truncation_reason}): {record_count} of {page_stream.total_records} records.")
 
-    vespa_elements = {
-        "Vision": "field_147", "Effort": "field_148",
-        "Systems": "field_149", "Practice": "field_150",
-        "Attitude": "field_151", "Overall": "field_152",
-    }
-    sums = {key: 0 for key in vespa_elements}
-    counts = {key: 0 for key in vespa_elements}
-
-    # Now all_student_records_for_school is a flat list of student record dictionaries
-    for record in all_student_records_for_school:
-        # Ensure record is a dictionary before trying to .get() from it
-        if not isinstance(record, dict):
-            app.logger.warning(f"Skipping an item in all_student_records_for_school because it is not a dictionary: {type(record)} - Content: {str(record)[:100]}...")
-            continue # Skip this iteration if record is not a dict
-
-        for element_name, field_key in vespa_elements.items():
-            score_value = record.get(field_key)
-            if score_value is not None:
-                try:
-                    score = float(score_value)
-                    sums[element_name] += score
-                    counts[element_name] += 1
-                except (ValueError, TypeError):
-                    app.logger.debug(f"Could not convert score '{score_value}' for {element_name} in record {record.get('id', 'N/A')} to float.")
-    
     averages = {}
-    for element_name in vespa_elements:
+    for element_name in SCHOOL_VESPA_ELEMENT_FIELDS:
         if counts[element_name] > 0:
             averages[element_name] = round(sums[element_name] / counts[element_name], 2)
         else:
             averages[element_name] = 0 # Or None, or "N/A"
     
     app.logger.info(f"Calculated school VESPA averages for school_id {school_id}: {averages}")
-    SCHOOL_AVERAGES_CACHE[school_id] = {'averages': averages, 'timestamp': time.time()}
+    SCHOOL_AVERAGES_CACHE.set(school_id, {'averages': averages, 'timestamp': time.time()})
     return averages
 
 # --- Function to fetch All Records with Pagination ---
+class KnackRecordList(list):
+    """
+    Flat list of Knack records returned by get_all_knack_records.
+    Also carries the pagination metadata so callers can tell when the list is incomplete:
+    - truncated: True when not every page was fetched.
+    - truncation_reason: "max_pages" or "page_fetch_failed" when truncated.
+    """
+
+    def __init__(self, records=(), total_pages=0, total_records=None, pages_fetched=0, truncated=False, truncation_reason=None):
+        super().__init__(records)
+        self.total_pages = total_pages
+        self.total_records = total_records
+        self.pages_fetched = pages_fetched
+        self.truncated = truncated
+        self.truncation_reason = truncation_reason
+
+    def clone(self):
+        """Shallow copy that keeps the pagination metadata."""
+        return KnackRecordList(self, total_pages=self.total_pages, total_records=self.total_records,
+                               pages_fetched=self.pages_fetched, truncated=self.truncated,
+                               truncation_reason=self.truncation_reason)
+
+
+def _parse_knack_page(object_key, page_number, response_data):
+    """Returns the records list from a Knack page response, or None if the page is unusable."""
+    if not response_data or not isinstance(response_data, dict):
+        app.logger.warning(f"No response_data or unexpected format on page {page_number} for {object_key}. Response: {str(response_data)[:200]}.")
+        return None
+    records_on_page = response_data.get('records', [])
+    if not isinstance(records_on_page, list):
+        app.logger.warning(f"'records' key in response_data for {object_key} page {page_number} is not a list as expected. Type: {type(records_on_page)}. Response (first 200 chars): {str(response_data)[:200]}.")
+        return None
+    return records_on_page
+
+
 def get_all_knack_records(object_key, filters=None, max_pages=20):
-    """Fetches all records from a Knack object using pagination."""
-    all_records = []
-    current_page = 1
-    # Initialize total_pages to a value that allows the loop to start.
-    # It will be updated from the first actual response.
-    total_pages = 1 
+    """
+    Fetches all records from a Knack object using pagination.
+    Page 1 is fetched first to learn total_pages; the remaining pages are then fetched in
+    parallel on a bounded worker pool (KNACK_PAGE_FETCH_WORKERS) and stitched back together
+    in page order. Hitting max_pages is logged and flagged on the returned KnackRecordList.
+    Concurrent identical paginated fetches share one set of upstream calls.
+    """
+    query_key = knack_query_key(object_key, filters, max_pages)
+    result, shared = KNACK_ALL_RECORDS_SINGLEFLIGHT.do(
+        query_key, lambda: _fetch_all_knack_records(object_key, filters, max_pages))
+    if shared:
+        app.logger.info(f"Coalesced paginated fetch for {object_key} with an identical in-flight request ({len(result)} records).")
+        return result.clone()
+    return result
 
-    app.logger.info(f"Starting paginated fetch for {object_key} with filters: {filters}")
 
-    while current_page <= total_pages and current_page <= max_pages:
-        app.logger.info(f"Fetching page {current_page} for {object_key}...")
-        # get_knack_record now returns the full response dictionary from Knack API
-        response_data = get_knack_record(object_key, filters=filters, page=current_page, rows_per_page=1000)
-        
-        if response_data and isinstance(response_data, dict):
-            # Extract the list of records from the response_data dictionary
-            records_on_page = response_data.get('records', []) 
-            
-            if isinstance(records_on_page, list):
-                all_records.extend(records_on_page) # Add records from current page to the main list
-                app.logger.info(f"Fetched {len(records_on_page)} records from page {current_page} for {object_key}. Total so far: {len(all_records)}.")
-            else:
-                app.logger.warning(f"'records' key in response_data for {object_key} page {current_page} is not a list as expected. Type: {type(records_on_page)}. Response (first 200 chars): {str(response_data)[:200]}. Stopping pagination.")
-                break 
-            
-            # Update total_pages from the API response (usually present on each page)
-            # More robustly get total_pages, ensuring it's an int
-            new_total_pages = response_data.get('total_pages')
-            if new_total_pages is not None:
-                try:
-                    total_pages = int(new_total_pages)
-                    if current_page == 1: # Log only on first discovery
-                       app.logger.info(f"Total pages for {object_key} identified from API: {total_pages}")
-                except (ValueError, TypeError):
-                    app.logger.warning(f"Could not parse 'total_pages' ('{new_total_pages}') from response for {object_key} on page {current_page}. Will rely on record count or max_pages.")
-                    # If parsing fails, and total_pages was just the initial 1, it might indicate only one page.
-                    # If records_on_page < rows_per_page, that's a stronger indicator of the last page.
-            
-            # Check if this was the last page
-            if not records_on_page or len(records_on_page) < 1000 or current_page >= total_pages:
-                app.logger.info(f"Last page likely reached for {object_key} on page {current_page} (fetched {len(records_on_page)} records, total pages from API: {total_pages}).")
-                break
-            current_page += 1
-        else:
-            app.logger.warning(f"No response_data or unexpected format on page {current_page} for {object_key}. Response: {str(response_data)[:200]}. Stopping pagination.")
-            break
-            
-    app.logger.info(f"Completed paginated fetch for {object_key}. Total records retrieved: {len(all_records)}.")
+def _fetch_all_knack_records(object_key, filters=None, max_pages=20):
+    app.logger.info(f"Starting paginated fetch for {object_key} with filters: {filters}")
+    page_stream = KnackPageStream(object_key, filters=filters, max_pages=max_pages, prefetch_pages=KNACK_PAGE_FETCH_WORKERS)
+    all_records = KnackRecordList()
+    for records_on_page in page_stream:
+        all_records.extend(records_on_page)
+    all_records.total_pages = page_stream.total_pages
+    all_records.total_records = page_stream.total_records
+    all_records.pages_fetched = page_stream.pages_fetched
+    all_records.truncated = page_stream.truncated
+    all_records.truncation_reason = page_stream.truncation_reason
+    app.logger.info(f"Completed paginated fetch for {object_key}. Pages fetched: {all_records.pages_fetched}/{all_records.total_pages}. Total records retrieved: {len(all_records)}.")
     return all_records # This should NOW be a flat list of record dictionaries
 
-# --- API Endpoint for AI Chat Turn ---
-@app.route('/api/v1/chat_turn', methods=['POST'])
-def chat_turn():
-    data = request.get_json() # Ensure this line is present
-    app.logger.info(f"Received request for /api/v1/chat_turn with data: {str(data)[:500]}...")
 
-    student_object10_id = data.get('student_object10_record_id')
-    chat_history = data.get('chat_history', []) 
-    current_tutor_message = data.get('current_tutor_message')
-    initial_ai_context = data.get('initial_ai_context') 
-    student_level_from_context = initial_ai_context.get('student_level') if initial_ai_context else None
-    app.logger.info(f"Chat turn: student_object10_id: {student_object10_id}, Student level from initial_ai_context: {student_level_from_context}") # ADDED LOG
+class KnackPageStream:
+    """
+    Iterates over the pages of a Knack query, yielding each page's records list in page order.
+    Page 1 is fetched first to learn total_pages; later pages are fetched on a bounded worker pool
+    at most prefetch_pages ahead of the consumer, so a consumer that drops each page after use
+    holds roughly (1 + prefetch_pages) pages in memory regardless of the total size.
+    Pagination metadata (total_pages, total_records, pages_fetched, truncated, truncation_reason)
+    is filled in as the stream is consumed.
+    """
 
-    # --- NEW: Detect if a new topic is being initiated ---
-    new_topic_being_initiated = data.get('new_topic_initiated', False)
-    if new_topic_being_initiated:
-        app.logger.info(f"New topic initiated for student {student_object10_id}.")
+    def __init__(self, object_key, filters=None, max_pages=20, prefetch_pages=KNACK_STREAM_PREFETCH_PAGES):
+        self.object_key = object_key
+        self.filters = filters
+        self.max_pages = max_pages
+        self.prefetch_pages = max(1, prefetch_pages)
+        self.total_pages = 0
+        self.total_records = None
+        self.pages_fetched = 0
+        self.truncated = False
+        self.truncation_reason = None
+
+    def _fetch_page(self, page_number):
+        app.logger.info(f"Fetching page {page_number} for {self.object_key}...")
+        return get_knack_record(self.object_key, filters=self.filters, page=page_number, rows_per_page=KNACK_ROWS_PER_PAGE)
+
+    def _mark_truncated(self, reason):
+        self.truncated = True
+        self.truncation_reason = reason
+
+    def __iter__(self):
+        object_key = self.object_key
+        first_page_data = self._fetch_page(1)
+        first_page_records = _parse_knack_page(object_key, 1, first_page_data)
+        if first_page_records is None:
+            app.logger.warning(f"Stopping paginated fetch for {object_key}: page 1 could not be fetched.")
+            self._mark_truncated("page_fetch_failed")
+            return
+
+        self.total_pages = 1
+        new_total_pages = first_page_data.get('total_pages')
+        if new_total_pages is not None:
+            try:
+                self.total_pages = int(new_total_pages)
+                app.logger.info(f"Total pages for {object_key} identified from API: {self.total_pages}")
+            except (ValueError, TypeError):
+                app.logger.warning(f"Could not parse 'total_pages' ('{new_total_pages}') from response for {object_key}. Will rely on record count.")
+        self.total_records = first_page_data.get('total_records')
+        first_page_is_last = len(first_page_records) < KNACK_ROWS_PER_PAGE or self.total_pages <= 1
+        first_page_data = None # Drop the response wrapper; only the records list is kept alive
+
+        self.pages_fetched = 1
+        app.logger.info(f"Fetched {len(first_page_records)} records from page 1 for {object_key}.")
+        yield first_page_records
+        first_page_records = None
+        if first_page_is_last:
+            return
+
+        last_page_to_fetch = min(self.total_pages, self.max_pages)
+        if self.total_pages > self.max_pages:
+            self._mark_truncated("max_pages")
+            app.logger.warning(f"Paginated fetch for {object_key} is TRUNCATED: Knack reports {self.total_pages} pages ({self.total_records} records) but max_pages is {self.max_pages}. Only the first {self.max_pages} pages will be returned.")
+
+        next_page_number = 2
+        pending_pages = deque()
+        worker_count = max(1, min(self.prefetch_pages, last_page_to_fetch - 1))
+        with ThreadPoolExecutor(max_workers=worker_count, thread_name_prefix="knack-pages") as executor:
+            try:
+                while next_page_number <= last_page_to_fetch and len(pending_pages) < self.prefetch_pages:
+                    pending_pages.append((next_page_number, executor.submit(self._fetch_page, next_page_number)))
+                    next_page_number += 1
+
+                while pending_pages:
+                    page_number, page_future = pending_pages.popleft()
+                    records_on_page = _parse_knack_page(object_key, page_number, page_future.result())
+                    if records_on_page is None:
+                        self._mark_truncated("page_fetch_failed")
+                        app.logger.warning(f"Stopping paginated fetch for {object_key} at page {page_number}; later pages are discarded to keep results contiguous.")
+                        break
+                    # Top the window up before yielding so the next page downloads while this one is consumed.
+                    if next_page_number <= last_page_to_fetch:
+                        pending_pages.append((next_page_number, executor.submit(self._fetch_page, next_page_number)))
+                        next_page_number += 1
+                    self.pages_fetched += 1
+                    app.logger.info(f"Fetched {len(records_on_page)} records from page {page_number} for {object_key}.")
+                    yield records_on_page
+                    records_on_page = None
+            finally:
+                for _, page_future in pending_pages:
+                    page_future.cancel()
 
-    # --- Student Name for Personalization (Fetch if not in initial_ai_context) ---
+# --- API Endpoint for AI Chat Turn ---
+# --- Chat Turn Prompt ---
+CHAT_TURN_LLM_PARAMS = {
+    "model": "gpt-4o-mini", # Using more capable model for better conversational quality
+    "max_tokens": 400, # Slightly increased to allow for thoughtful exploration
+    "temperature": 0.7, # Balanced temperature for natural yet focused conversation
+}
+
+
+def resolve_chat_student_name(student_object10_id, initial_ai_context):
+    """Student name for personalising the chat prompt (from initial_ai_context, else Object_10)."""
     student_name_for_chat = "the student"
     if initial_ai_context and initial_ai_context.get('student_name'):
         student_name_for_chat = initial_ai_context['student_name']
@@ -1702,41 +3529,14 @@ def chat_turn():
         obj10_record = get_knack_record("object_10", record_id=student_object10_id)
         if obj10_record and obj10_record.get("field_187_raw"):
             student_name_for_chat = obj10_record.get("field_187_raw", {}).get("full", "the student")
+    return student_name_for_chat
 
-    if not student_object10_id or not current_tutor_message:
-        app.logger.error("chat_turn: Missing student_object10_record_id or current_tutor_message.")
-        return jsonify({"error": "Missing student_object10_record_id or current_tutor_message"}), 400
-    
-    if not OPENAI_API_KEY:
-        app.logger.error("chat_turn: OpenAI API key not configured.")
-        save_chat_message_to_knack(student_object10_id, "Tutor", current_tutor_message)
-        return jsonify({"ai_response": "I am currently unable to respond (AI not configured). Your message has been logged."}), 200
-
-    tutor_message_saved_id = save_chat_message_to_knack(student_object10_id, "Tutor", current_tutor_message)
-    if not tutor_message_saved_id:
-        app.logger.error(f"chat_turn: Failed to save tutor's message to Knack for student {student_object10_id}.")
-
-    # Calculate conversation depth (number of back-and-forth exchanges)
-    conversation_depth = len([msg for msg in chat_history if msg.get('role') == 'user'])
-    app.logger.info(f"Conversation depth: {conversation_depth} tutor messages")
-    
-    # Check if tutor is explicitly asking for activities
-    tutor_asking_for_activity = any(phrase in current_tutor_message.lower() for phrase in [
-        "suggest an activity", "recommend an activity", "what activity", "any activities",
-        "activity suggestion", "activity recommendation", "activities to suggest", "could you suggest",
-        "what can i suggest", "activities for", "exercises for", "what should we do", "how can i help",
-        "what interventions", "practical steps", "action plan"
-    ])
-
-    # Determine effective conversation depth for activity suggestions
-    effective_conversation_depth_for_activities = 0 if new_topic_being_initiated else conversation_depth
-    app.logger.info(f"Original conversation depth: {conversation_depth}, Effective depth for activities: {effective_conversation_depth_for_activities}, New topic flag: {new_topic_being_initiated}")
 
-    # Prepare student_level_for_prompt for use in the system message string
-    student_level_for_prompt = student_level_from_context if student_level_from_context else 'unknown'
-    
-    messages_for_llm = [
-        {"role": "system", "content": f"""You are an AI coaching colleague, a thought partner, here to help a tutor explore and understand their student, {student_name_for_chat}. Your primary goal is to facilitate the tutor's own thinking and insight generation.
+# The chat prompt is laid out for provider prompt caching, which only reuses an identical leading
+# run of tokens: CHAT_TURN_SYSTEM_PROMPT and the phase guidance never vary between students or turns,
+# so every request opens with the same bytes. The student's context, the chat history and this turn's
+# knowledge-base retrieval follow, in that order (least to most likely to change between turns).
+CHAT_TURN_SYSTEM_PROMPT = """You are an AI coaching colleague, a thought partner, here to help a tutor explore and understand one of their students (named in the student context that follows). Your primary goal is to facilitate the tutor's own thinking and insight generation.
 
 CRITICAL: You are NOT here to provide immediate solutions or act as a "font of all knowledge." You are here to help the tutor understand their student deeply through collaborative exploration and Socratic dialogue. Avoid giving direct advice or lists of recommendations unless the tutor explicitly asks and the conversation has matured.
 
@@ -1780,85 +3580,338 @@ RESPONSE STRUCTURE (General Guideline):
 - If appropriate, make ONE tentative observation or connection to data, framed as a question or a point for the tutor to consider (e.g., "Given their low score in Systems, I'm wondering how they are managing the workload of 5 A-Levels?").
 - End with an open question that invites the tutor to elaborate or consider a new angle.
 
-Remember: The tutor knows their student best. Your job is to be a skilled questioner and a data-informed thought partner to help them unlock deeper understanding and effective strategies."""}
-    ]
-    
-    # Add conversation depth guidance
-    conversation_guidance = ""
-
-    # Use effective_conversation_depth_for_activities for phase determination
-    if effective_conversation_depth_for_activities < 3 and not tutor_asking_for_activity:
-        conversation_guidance = f"""
+Remember: The tutor knows their student best. Your job is to be a skilled questioner and a data-informed thought partner to help them unlock deeper understanding and effective strategies."""
 
-CONVERSATION PHASE: Initial Exploration (turn {effective_conversation_depth_for_activities + 1} for {student_name_for_chat})
+# Conversation-phase guidance, chosen by build_chat_turn_messages from the conversation depth.
+CHAT_TURN_PHASE_GUIDANCE = {
+    "initial_exploration": """CONVERSATION PHASE: Initial Exploration
 Your SOLE FOCUS is to help the tutor fully articulate their observations and concerns. You MUST NOT suggest any activities or solutions at this stage.
 
 - Start by acknowledging the tutor's input and asking open-ended questions to understand their perspective more deeply.
 - If the tutor mentions a general problem (e.g., "lazy," "unmotivated"), ask for specific examples: "Can you describe a recent situation where you observed this 'laziness'?" or "What does 'unfocused' look like in their work on a typical day?"
 - Probe the context: "Does this happen in all subjects, or more in some than others?" "When did you first start noticing this?"
-- Use data from the initial_ai_context (student snapshot, academic benchmarks, questionnaire summary - if provided in the RAG section) to formulate insightful, open-ended questions, but DO NOT state the data directly to the tutor. Instead, let the data inform your curiosity. For example, if Vision is low, you might ask, "I'm curious, how clear do you think {student_name_for_chat} is about why these A-Levels are important for their future?"
+- Use data from the initial_ai_context (student snapshot, academic benchmarks, questionnaire summary - if provided in the RAG section) to formulate insightful, open-ended questions, but DO NOT state the data directly to the tutor. Instead, let the data inform your curiosity. For example, if Vision is low, you might ask, "I'm curious, how clear do you think [student's name] is about why these A-Levels are important for their future?"
 - ABSOLUTELY NO MENTION of activities, solutions, or direct advice from KBs. Stick to questions that encourage the tutor to elaborate and reflect. If any activity suggestions or details appear in the RAG context provided to you, you MUST IGNORE them for this turn and focus SOLELY on asking the tutor exploratory questions about the student.
 
 Example AI Responses (Focus on questions):
-"That sounds like a tricky situation with {student_name_for_chat}. When you say they seem 'lazy,' could you tell me more about what specific behaviors make you say that?"
-"It's interesting you mention {student_name_for_chat} is 'bright but unfocused.' In what specific tasks or subjects does their brightness shine through, and where does the lack of focus become most apparent?"
-"You've mentioned {student_name_for_chat} is doing 5 A-Levels, which is a significant workload. How do you see them managing the demands of that workload day-to-day?" """
-    elif effective_conversation_depth_for_activities >= 3 and effective_conversation_depth_for_activities < 5 and not tutor_asking_for_activity:
-        conversation_guidance = f"""
-
-CONVERSATION PHASE: Deepening Understanding & Connecting Dots (turn {effective_conversation_depth_for_activities + 1} for {student_name_for_chat})
+"That sounds like a tricky situation with [student's name]. When you say they seem 'lazy,' could you tell me more about what specific behaviors make you say that?"
+"It's interesting you mention [student's name] is 'bright but unfocused.' In what specific tasks or subjects does their brightness shine through, and where does the lack of focus become most apparent?"
+"You've mentioned [student's name] is doing 5 A-Levels, which is a significant workload. How do you see them managing the demands of that workload day-to-day?" """,
+    "deepening_understanding": """CONVERSATION PHASE: Deepening Understanding & Connecting Dots
 Continue to prioritize the tutor's insights. You are guiding them to connect information. NO DIRECT SOLUTIONS or activity suggestions unless explicitly asked by the tutor.
 
 - Synthesize what the tutor has shared so far and ask questions that help them link their observations to potential underlying factors or data points (from initial_ai_context or RAG).
-- Frame data-informed questions tentatively: "You've described {student_name_for_chat} as [tutor's observation, e.g., 'struggling with deadlines']. I also recall their Systems score was [e.g., 'quite low']. I wonder, do you see any connection there? How might their approach to organization be impacting this?"
-- If RAG provides relevant VESPA statements or coaching insights, use them to inspire questions that probe deeper. E.g., if a RAG insight mentions procrastination related to low Vision, ask: "Sometimes, when students aren't crystal clear on their 'why,' tasks can feel less urgent. To what extent do you think {student_name_for_chat} has a strong sense of purpose for these subjects?"
-- Explore contradictions or patterns: "So, on one hand, {student_name_for_chat} [shows strength X], but on the other hand, [shows challenge Y]. What are your thoughts on what might be happening there?"
-- If the tutor is stuck, you can offer a very gentle, open-ended framing question based on a general coaching principle, e.g., "Often, behaviors like [observed behavior] can stem from various places like [general factor 1, e.g., skill gaps] or [general factor 2, e.g., mindset blocks]. Does either of those resonate more in {student_name_for_chat}'s case, or perhaps something else?"
-- STILL NO unsolicited activity suggestions. If activity details are present in your RAG context, do NOT suggest them directly. Instead, if the conversation naturally leads to strategies, you might ask the TUTOR something like: "We've discussed [student's issue]. I'm seeing some potentially relevant activities in our resources, like [Activity Name from RAG, if highly relevant]. Would exploring that type of intervention be helpful for your planning with {student_name_for_chat} at this stage, or are there other areas you'd like to explore first?" The goal is to help the tutor build their own hypothesis and decide if/when to introduce an activity.
+- Frame data-informed questions tentatively: "You've described [student's name] as [tutor's observation, e.g., 'struggling with deadlines']. I also recall their Systems score was [e.g., 'quite low']. I wonder, do you see any connection there? How might their approach to organization be impacting this?"
+- If RAG provides relevant VESPA statements or coaching insights, use them to inspire questions that probe deeper. E.g., if a RAG insight mentions procrastination related to low Vision, ask: "Sometimes, when students aren't crystal clear on their 'why,' tasks can feel less urgent. To what extent do you think [student's name] has a strong sense of purpose for these subjects?"
+- Explore contradictions or patterns: "So, on one hand, [student's name] [shows strength X], but on the other hand, [shows challenge Y]. What are your thoughts on what might be happening there?"
+- If the tutor is stuck, you can offer a very gentle, open-ended framing question based on a general coaching principle, e.g., "Often, behaviors like [observed behavior] can stem from various places like [general factor 1, e.g., skill gaps] or [general factor 2, e.g., mindset blocks]. Does either of those resonate more in [student's name]'s case, or perhaps something else?"
+- STILL NO unsolicited activity suggestions. If activity details are present in your RAG context, do NOT suggest them directly. Instead, if the conversation naturally leads to strategies, you might ask the TUTOR something like: "We've discussed [student's issue]. I'm seeing some potentially relevant activities in our resources, like [Activity Name from RAG, if highly relevant]. Would exploring that type of intervention be helpful for your planning with [student's name] at this stage, or are there other areas you'd like to explore first?" The goal is to help the tutor build their own hypothesis and decide if/when to introduce an activity.
 
 Example AI Responses (Focus on synthesis and deeper questioning):
-"So, it sounds like this 'laziness' you mentioned earlier with {student_name_for_chat} is particularly noticeable when it comes to [specific task/subject], even though they're clearly capable in other areas like [strength]. What do you think is different about [specific task/subject] for them?"
-"Given {student_name_for_chat}'s low Systems score (X/10) and the challenge of 5 A-Levels, I'm curious how they approach planning and organizing their work. What have you observed about their methods?"
-"We've talked about [observation A] and [observation B]. Do you see any underlying themes or connections emerging in {student_name_for_chat}'s approach that might explain both?" """
-    elif effective_conversation_depth_for_activities >= 5 and not tutor_asking_for_activity:
-        conversation_guidance = f"""
-
-CONVERSATION PHASE: Moving Towards Potential Strategies (turn {effective_conversation_depth_for_activities + 1} for {student_name_for_chat})
+"So, it sounds like this 'laziness' you mentioned earlier with [student's name] is particularly noticeable when it comes to [specific task/subject], even though they're clearly capable in other areas like [strength]. What do you think is different about [specific task/subject] for them?"
+"Given [student's name]'s low Systems score (X/10) and the challenge of 5 A-Levels, I'm curious how they approach planning and organizing their work. What have you observed about their methods?"
+"We've talked about [observation A] and [observation B]. Do you see any underlying themes or connections emerging in [student's name]'s approach that might explain both?" """,
+    "towards_strategies": """CONVERSATION PHASE: Moving Towards Potential Strategies
 NOW, you can begin to gently transition towards exploring solutions, but the tutor MUST lead. Your role is to help them brainstorm or refine their own ideas first.
 
-- Summarize the key insights and patterns that you and the tutor have discussed so far regarding {student_name_for_chat}.
-- Explicitly ask the tutor for their thoughts on next steps or potential strategies: "Based on our conversation, what are your initial thoughts on how you might approach this with {student_name_for_chat}?" or "What kind of support or intervention do you feel would be most beneficial for them right now?"
+- Summarize the key insights and patterns that you and the tutor have discussed so far regarding [student's name].
+- Explicitly ask the tutor for their thoughts on next steps or potential strategies: "Based on our conversation, what are your initial thoughts on how you might approach this with [student's name]?" or "What kind of support or intervention do you feel would be most beneficial for them right now?"
 - If the tutor offers ideas, help them elaborate or consider different angles. Ask clarifying questions about their proposed strategies.
 - ONLY if the tutor seems unsure, or explicitly asks for your input ("What do you think?" or "Do you have any suggestions?"), THEN you can cautiously introduce a relevant idea. Frame it as a possibility, not a directive. Connect it clearly to the preceding discussion.
 - If you do introduce an idea (e.g., a type of activity, a coaching question style), draw from relevant KBs (activities, questions provided in RAG). Present it conversationally: "One approach that sometimes helps in situations where a student [matches student's issue, e.g., 'lacks clear goals'] is to work on [relevant activity type, e.g., 'defining their vision']. For example, an activity like 'Ikigai' (if in RAG context) can help with that. Alternatively, a powerful coaching question could be [example question from RAG]. What are your thoughts on something along those lines?"
-- Offer a MAXIMUM of 1-2 distinct ideas, and always loop back to the tutor: "Does that resonate with what you know about {student_name_for_chat}?" or "How might that fit into your upcoming conversations with them?"
+- Offer a MAXIMUM of 1-2 distinct ideas, and always loop back to the tutor: "Does that resonate with what you know about [student's name]?" or "How might that fit into your upcoming conversations with them?"
 
 Example AI Responses (Focus on tutor-led strategy, then cautious suggestion if asked):
-"We've discussed quite a bit about {student_name_for_chat} – the challenges with [X], their strengths in [Y], and how their VESPA profile (e.g., low Vision at Z/10) might be playing a role. What are your initial thoughts on a good starting point for your next conversation with them?"
-(If tutor asks for ideas): "That's a good question. Given our discussion about [student's specific issue, e.g., 'difficulty managing workload'], one area we could explore is strengthening their 'Systems'. There are activities like 'Pending, Doing, Done' (if in RAG) that focus on task management. Or, you might start by asking them, 'What's one change you could make to how you organize your week that would feel most helpful right now?' How do those options sound as a starting point?" """
-    elif tutor_asking_for_activity:
-        conversation_guidance = f"""
-
-ACTIVITY/SOLUTION SUGGESTION PHASE (Tutor Initiated for {student_name_for_chat})
+"We've discussed quite a bit about [student's name] – the challenges with [X], their strengths in [Y], and how their VESPA profile (e.g., low Vision at Z/10) might be playing a role. What are your initial thoughts on a good starting point for your next conversation with them?"
+(If tutor asks for ideas): "That's a good question. Given our discussion about [student's specific issue, e.g., 'difficulty managing workload'], one area we could explore is strengthening their 'Systems'. There are activities like 'Pending, Doing, Done' (if in RAG) that focus on task management. Or, you might start by asking them, 'What's one change you could make to how you organize your week that would feel most helpful right now?' How do those options sound as a starting point?" """,
+    "activity_request": """ACTIVITY/SOLUTION SUGGESTION PHASE (Tutor Initiated)
 The tutor is explicitly asking for suggestions. Now you can more directly offer relevant ideas based on your conversation and the RAG context.
 
 - Acknowledge the tutor's request clearly.
-- Briefly link your suggestions back to the core issues you've discussed about {student_name_for_chat}. For example: "Okay, since we identified that {student_name_for_chat}'s main challenge seems to be [e.g., 'a lack of clear vision and subsequent motivation'], here are a couple of approaches from our resources that might be helpful..."
+- Briefly link your suggestions back to the core issues you've discussed about [student's name]. For example: "Okay, since we identified that [student's name]'s main challenge seems to be [e.g., 'a lack of clear vision and subsequent motivation'], here are a couple of approaches from our resources that might be helpful..."
 - Prioritize suggestions from the RAG context if relevant items (activities, coaching questions, statements) were provided for the current turn. Refer to activities by Name and mention if resources are available (as per RAG instructions). Suggest a coaching question or an adapted reflective statement as an alternative or complement.
 - Offer 1-2 well-chosen suggestions. Explain the 'why' – how each suggestion addresses the student's specific needs that you've uncovered together.
-- Keep it collaborative: "Which of these feels like it might be a good fit for {student_name_for_chat} and your coaching style?" or "What are your thoughts on trying one of these?"
+- Keep it collaborative: "Which of these feels like it might be a good fit for [student's name] and your coaching style?" or "What are your thoughts on trying one of these?"
 - Be prepared to offer an alternative if the first suggestions don't resonate.
 
 Example AI Response (Tutor has asked for activity suggestions):
-"Okay, you're looking for some specific activities for {student_name_for_chat}. Based on our conversation, particularly around their [low Vision score of X and comments about lacking direction], a couple of things come to mind from the resources:
+"Okay, you're looking for some specific activities for [student's name]. Based on our conversation, particularly around their [low Vision score of X and comments about lacking direction], a couple of things come to mind from the resources:
+
+1.  The 'Ikigai' activity (if in RAG & relevant) could be really powerful. It's designed to help students connect their passions, skills, and what the world needs, which can build that sense of Vision. Resources are available for this one.
+2.  Alternatively, or perhaps as a follow-up, you could explore some coaching questions like, 'If you could wave a magic wand, what would your ideal outcome be for this year, and what's one small step you could take towards that this week?' (adapt from RAG coaching_questions if available).
+
+How do these options sound for [student's name]?" """,
+}
+
+
+# --- Chat Prompt Token Budgets ---
+TOKEN_ESTIMATE_PATTERN = re.compile(r"\w+|[^\w\s]")
+CHAT_MESSAGE_TOKEN_OVERHEAD = 4 # Role and separators the chat format adds around each message
+CHAT_HISTORY_SUMMARY_LLM_PARAMS = {"model": "gpt-4o-mini", "max_tokens": CHAT_HISTORY_SUMMARY_TOKENS, "temperature": 0.2}
+CHAT_HISTORY_SUMMARY_CACHE = CacheNamespace(SHARED_CACHE, "chat_history_summary", CHAT_HISTORY_SUMMARY_TTL_SECONDS)
+# Knowledge-base sections retrieved for a chat turn, most important first; the last ones are dropped first when over CHAT_PROMPT_RAG_TOKENS.
+CHAT_RAG_SECTION_PRIORITY = ("activities", "coaching_insights", "coaching_questions", "vespa_indicators", "reflective_statements", "activities_note")
+CHAT_PROMPT_BUDGET_STATS = {"trimmed": {"system": 0, "context": 0, "rag": 0}, "history_compressed_turns": 0,
+                            "summary_cache_hits": 0, "summary_extended": 0, "summary_llm_calls": 0, "summary_local_digests": 0}
+
+
+def estimated_piece_tokens(piece):
+    return 1 if len(piece) <= 5 else (len(piece) + 4) // 5
+
+
+def estimate_tokens(text):
+    """
+    Offline approximation of the model's token count: one token per punctuation mark or short word,
+    and one per ~5 characters of longer words. Close enough to budget prompts without a tokenizer.
+    """
+    return sum(estimated_piece_tokens(piece) for piece in TOKEN_ESTIMATE_PATTERN.findall(text or ""))
+
+
+def estimate_message_tokens(messages):
+    return sum(estimate_tokens(message.get("content")) + CHAT_MESSAGE_TOKEN_OVERHEAD for message in messages)
+
+
+def truncate_to_token_budget(text, max_tokens, part_name=None):
+    """Cuts text after the last word that fits in max_tokens (estimated), marking the cut."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    used_tokens = 0
+    cut_at = 0
+    for match in TOKEN_ESTIMATE_PATTERN.finditer(text):
+        used_tokens += estimated_piece_tokens(match.group(0))
+        if used_tokens > max_tokens:
+            break
+        cut_at = match.end()
+    if part_name:
+        increment_stat(CHAT_PROMPT_BUDGET_STATS["trimmed"], part_name)
+        app.logger.warning(f"chat_turn prompt: {part_name} part over its {max_tokens}-token budget; truncated.")
+    return text[:cut_at] + " [...]"
+
+
+def trim_sections_to_token_budget(sections, priority, max_tokens, part_name=None):
+    """
+    Keeps whole sections (name -> lines) while they fit in max_tokens, taking them in priority order
+    and skipping any that no longer fit, so no section is cut mid-way. Returns the kept sections in their original order.
+    """
+    remaining_tokens = max_tokens
+    kept_names = set()
+    for name in sorted(sections, key=priority.index):
+        section_tokens = sum(estimate_tokens(line) + 1 for line in sections[name])
+        if section_tokens <= remaining_tokens:
+            kept_names.add(name)
+            remaining_tokens -= section_tokens
+    dropped_names = [name for name in sections if name not in kept_names]
+    if part_name and dropped_names:
+        increment_stat(CHAT_PROMPT_BUDGET_STATS["trimmed"], part_name)
+        app.logger.info(f"chat_turn prompt: dropped {part_name} sections {dropped_names} to fit {max_tokens} tokens.")
+    return {name: lines for name, lines in sections.items() if name in kept_names}
+
+
+def trim_lines_to_token_budget(lines, max_tokens, keep_last=False, part_name=None):
+    """Drops whole lines (from the end, or from the start with keep_last) until the rest fit in max_tokens."""
+    kept_lines = list(lines)
+    while kept_lines and sum(estimate_tokens(line) + 1 for line in kept_lines) > max_tokens:
+        kept_lines.pop(0 if keep_last else -1)
+    if part_name and len(kept_lines) < len(lines):
+        increment_stat(CHAT_PROMPT_BUDGET_STATS["trimmed"], part_name)
+        app.logger.info(f"chat_turn prompt: dropped {len(lines) - len(kept_lines)} of {len(lines)} {part_name} lines to fit {max_tokens} tokens.")
+    return kept_lines
+
+
+def chat_history_message_for_llm(message):
+    """A chat_history entry as sent to the LLM, with liked messages marked."""
+    content = message.get("content", "")
+    # Prepend a marker if the tutor liked this message
+    if message.get("is_liked") and message.get("role") == "assistant": # Mark liked AI responses
+        content = f"[Tutor Liked This Assistant Response]: {content}"
+    elif message.get("is_liked") and message.get("role") == "user": # Or if user message was somehow marked as liked contextually
+        content = f"[Tutor Indicated This Was Important User Context]: {content}"
+    return {"role": message.get("role"), "content": content}
+
+
+def chat_summary_line(message, max_tokens=60):
+    speaker = "Tutor" if message.get("role") == "user" else "AI Coach"
+    return f"{speaker}: {truncate_to_token_budget(' '.join(str(message.get('content', '')).split()), max_tokens)}"
+
+
+def summarize_chat_messages(previous_summary, new_messages):
+    """
+    Folds new_messages into previous_summary. Uses the LLM when enabled and reachable, else a local
+    digest of the opening words of each message. Returns (summary, cacheable).
+    """
+    new_lines = [chat_summary_line(message) for message in new_messages]
+    if CHAT_HISTORY_SUMMARY_USE_LLM and OPENAI_API_KEY:
+        try:
+            response, _ = LLM_CLIENT.create(
+                "chat_history_summary",
+                deadline_seconds=CHAT_HISTORY_SUMMARY_DEADLINE_SECONDS,
+                messages=[
+                    {"role": "system", "content": "You keep a running summary of a coaching conversation between a tutor and an AI coaching colleague about one student. "
+                                                  "Update the summary with the new messages. Keep facts about the student, the tutor's observations and concerns, "
+                                                  f"hypotheses discussed, and any activities or next steps agreed. Plain prose, under {int(CHAT_HISTORY_SUMMARY_TOKENS * 0.7)} words."},
+                    {"role": "user", "content": f"Current summary:\n{previous_summary or '(none yet)'}\n\nNew messages:\n" + "\n".join(new_lines)}
+                ],
+                n=1,
+                **CHAT_HISTORY_SUMMARY_LLM_PARAMS
+            )
+            increment_stat(CHAT_PROMPT_BUDGET_STATS, "summary_llm_calls")
+            return response.choices[0].message.content.strip(), True
+        except Exception as e:
+            app.logger.warning(f"chat_turn prompt: could not summarise older chat history with the LLM ({e}); using a local digest.")
+    increment_stat(CHAT_PROMPT_BUDGET_STATS, "summary_local_digests")
+    summary_lines = (previous_summary.split("\n") if previous_summary else []) + new_lines
+    # Offline digests are cached; a digest written because the LLM failed is not, so the next turn tries again.
+    return "\n".join(trim_lines_to_token_budget(summary_lines, CHAT_HISTORY_SUMMARY_TOKENS, keep_last=True)), not (CHAT_HISTORY_SUMMARY_USE_LLM and OPENAI_API_KEY)
+
+
+def chat_summary_prefix_keys(messages):
+    """Chained hash of every prefix of messages: entry i identifies messages[:i + 1]."""
+    prefix_keys = []
+    chained_hash = ""
+    for message in messages:
+        chained_hash = hashlib.sha256((chained_hash + json.dumps([message.get("role"), message.get("content")], ensure_ascii=False)).encode('utf-8')).hexdigest()
+        prefix_keys.append(chained_hash)
+    return prefix_keys
+
+
+def rolling_chat_summary(folded_messages, resume_lengths=()):
+    """
+    Summary of folded_messages (the oldest messages of a conversation), cached by a chained hash of
+    the messages. If it is not cached yet, the cached summary of the longest earlier fold point
+    (resume_lengths, in messages) is extended rather than the whole history being summarised again.
+    """
+    prefix_keys = chat_summary_prefix_keys(folded_messages)
+
+    previous_summary, summarised_count = "", 0
+    for prefix_length in sorted({len(folded_messages), *(length for length in resume_lengths if 0 < length < len(folded_messages))}, reverse=True):
+        cached_summary = CHAT_HISTORY_SUMMARY_CACHE.get(prefix_keys[prefix_length - 1])
+        if cached_summary is not None:
+            previous_summary, summarised_count = cached_summary, prefix_length
+            break
+    if summarised_count == len(folded_messages):
+        increment_stat(CHAT_PROMPT_BUDGET_STATS, "summary_cache_hits")
+        return previous_summary
+    if summarised_count:
+        increment_stat(CHAT_PROMPT_BUDGET_STATS, "summary_extended")
+
+    summary, cacheable = summarize_chat_messages(previous_summary, folded_messages[summarised_count:])
+    if cacheable:
+        CHAT_HISTORY_SUMMARY_CACHE.set(prefix_keys[-1], summary)
+    return summary
+
+
+def build_chat_history_messages(chat_history, max_tokens=CHAT_PROMPT_HISTORY_TOKENS):
+    """
+    chat_history as LLM messages within max_tokens. If it does not fit, the messages before a fold point
+    are folded into one rolling-summary message at the start, except liked messages, which are folded
+    only if the rest still does not fit. The last CHAT_HISTORY_RECENT_MESSAGES always stay verbatim.
+    Fold points fall on whole CHAT_HISTORY_FOLD_CHUNK_MESSAGES chunks, and a fold point whose summary
+    is cached is kept while the rest still fits, so the summary changes only every few turns.
+    """
+    history_messages = [chat_history_message_for_llm(message) for message in chat_history]
+    message_tokens = [estimate_message_tokens([message]) for message in history_messages]
+    if sum(message_tokens) <= max_tokens:
+        return history_messages
+
+    recent_start = max(0, len(chat_history) - CHAT_HISTORY_RECENT_MESSAGES)
+    fold_points = sorted({*range(CHAT_HISTORY_FOLD_CHUNK_MESSAGES, recent_start, CHAT_HISTORY_FOLD_CHUNK_MESSAGES), recent_start} - {0})
+    if not fold_points:
+        return history_messages
+    verbatim_budget = max_tokens - CHAT_HISTORY_SUMMARY_TOKENS - CHAT_MESSAGE_TOKEN_OVERHEAD
+
+    def folded_indexes(fold_point, fold_liked):
+        return [i for i in range(fold_point) if fold_liked or not chat_history[i].get("is_liked")]
+
+    def verbatim_tokens(folded):
+        return sum(message_tokens) - sum(message_tokens[i] for i in folded)
+
+    # Keep an earlier fold point (one whose summary is cached) while the messages after it still fit.
+    prefix_keys = chat_summary_prefix_keys([chat_history[i] for i in folded_indexes(recent_start, False)])
+    summary, fold_point, fold_liked = None, None, False
+    for candidate in fold_points:
+        folded = folded_indexes(candidate, False)
+        if folded and verbatim_tokens(folded) <= verbatim_budget:
+            summary = CHAT_HISTORY_SUMMARY_CACHE.get(prefix_keys[len(folded) - 1])
+            if summary is not None:
+                fold_point = candidate
+                increment_stat(CHAT_PROMPT_BUDGET_STATS, "summary_cache_hits")
+                break
+
+    if fold_point is None:
+        # Move the fold point far enough to leave room for the next few turns; fold liked messages only if nothing else fits.
+        # Chunk boundaries are preferred; the start of the recent messages is only used when no chunk boundary fits.
+        low_water_budget = int(verbatim_budget * CHAT_HISTORY_FOLD_LOW_WATER)
+        chunk_points = [point for point in fold_points if point % CHAT_HISTORY_FOLD_CHUNK_MESSAGES == 0]
+        fold_point, fold_liked = fold_points[-1], True
+        for candidate_fold_liked in (False, True):
+            candidate = next((point for point in chunk_points if verbatim_tokens(folded_indexes(point, candidate_fold_liked)) <= low_water_budget), None)
+            if candidate is None:
+                candidate = next((point for point in chunk_points[-1:] + fold_points[-1:]
+                                  if verbatim_tokens(folded_indexes(point, candidate_fold_liked)) <= verbatim_budget), None)
+            if candidate is not None:
+                fold_point, fold_liked = candidate, candidate_fold_liked
+                break
+
+    folded = folded_indexes(fold_point, fold_liked)
+    if not folded:
+        return history_messages
+    folded_messages = [chat_history[i] for i in folded]
+    kept_indexes = [i for i in range(len(chat_history)) if i not in set(folded)]
+    increment_stat(CHAT_PROMPT_BUDGET_STATS, "history_compressed_turns")
+    if summary is None:
+        resume_lengths = [len(folded_indexes(point, fold_liked)) for point in fold_points if point < fold_point]
+        summary = rolling_chat_summary(folded_messages, resume_lengths)
+    app.logger.info(f"chat_turn prompt: summarised {len(folded_messages)} older chat messages; {len(kept_indexes)} kept verbatim.")
+    return [{"role": "system", "content": f"Summary of the earlier part of this conversation (older messages condensed):\n{summary}"}] + \
+        [history_messages[i] for i in kept_indexes]
+
+
+def build_chat_turn_messages(chat_history, current_tutor_message, initial_ai_context, new_topic_being_initiated, student_name_for_chat):
+    """
+    Builds the LLM messages for one chat turn, static parts first so they form a cacheable prefix:
+    persona and conversation-phase guidance, the student's name and initial AI context, the chat
+    history, this turn's knowledge-base retrieval and the tutor's message. Each part is held to its
+    CHAT_PROMPT_*_TOKENS budget. Returns (messages_for_llm, suggested_activities_in_chat).
+    Shared by chat_turn and chat_turn_stream.
+    """
+    student_level_from_context = initial_ai_context.get('student_level') if initial_ai_context else None
+    suggested_activities_for_response = []
+
+    # Calculate conversation depth (number of back-and-forth exchanges)
+    conversation_depth = len([msg for msg in chat_history if msg.get('role') == 'user'])
+    app.logger.info(f"Conversation depth: {conversation_depth} tutor messages")
+    
+    # Check if tutor is explicitly asking for activities
+    tutor_asking_for_activity = any(phrase in current_tutor_message.lower() for phrase in [
+        "suggest an activity", "recommend an activity", "what activity", "any activities",
+        "activity suggestion", "activity recommendation", "activities to suggest", "could you suggest",
+        "what can i suggest", "activities for", "exercises for", "what should we do", "how can i help",
+        "what interventions", "practical steps", "action plan"
+    ])
 
-1.  The 'Ikigai' activity (if in RAG & relevant) could be really powerful. It's designed to help students connect their passions, skills, and what the world needs, which can build that sense of Vision. Resources are available for this one.
-2.  Alternatively, or perhaps as a follow-up, you could explore some coaching questions like, 'If you could wave a magic wand, what would your ideal outcome be for this year, and what's one small step you could take towards that this week?' (adapt from RAG coaching_questions if available).
+    # Determine effective conversation depth for activity suggestions
+    effective_conversation_depth_for_activities = 0 if new_topic_being_initiated else conversation_depth
+    app.logger.info(f"Original conversation depth: {conversation_depth}, Effective depth for activities: {effective_conversation_depth_for_activities}, New topic flag: {new_topic_being_initiated}")
 
-How do these options sound for {student_name_for_chat}?" """
+    # Prepare student_level_for_prompt for use in the system message string
+    student_level_for_prompt = student_level_from_context if student_level_from_context else 'unknown'
     
-    if conversation_guidance:
-        messages_for_llm[0]["content"] += conversation_guidance
+    if tutor_asking_for_activity:
+        conversation_phase = "activity_request"
+    elif effective_conversation_depth_for_activities < 3:
+        conversation_phase = "initial_exploration"
+    elif effective_conversation_depth_for_activities < 5:
+        conversation_phase = "deepening_understanding"
+    else:
+        conversation_phase = "towards_strategies"
+
+    # Static prefix: identical bytes for every student in this conversation phase.
+    messages_for_llm = [
+        {"role": "system", "content": CHAT_TURN_SYSTEM_PROMPT},
+        {"role": "system", "content": truncate_to_token_budget(CHAT_TURN_PHASE_GUIDANCE[conversation_phase], CHAT_PROMPT_SYSTEM_TOKENS - estimate_tokens(CHAT_TURN_SYSTEM_PROMPT), "system")},
+    ]
+    student_context = f"STUDENT CONTEXT: The student you are discussing with the tutor is {student_name_for_chat}. Use their name wherever the guidance above says [student's name]."
+    turn_context = f"CURRENT TURN: This is turn {effective_conversation_depth_for_activities + 1} of the conversation about {student_name_for_chat}."
 
     if initial_ai_context:
         context_preamble = "Key previously generated insights for this student (use this as context for the current chat):\n"
@@ -1870,8 +3923,10 @@ How do these options sound for {student_name_for_chat}?" """
             context_preamble += f"- Questionnaire Interpretation: {initial_ai_context['questionnaire_interpretation_and_reflection_summary']}\n"
         if student_level_from_context: # Add student level to initial context if available
              context_preamble += f"- Student Level: {student_level_from_context}\n"
+        context_preamble = truncate_to_token_budget(context_preamble, CHAT_PROMPT_CONTEXT_TOKENS, "context")
+        student_context += "\n\n" + context_preamble
 
-        retrieved_context_parts = []
+        retrieved_context_sections = {} # Section name (see CHAT_RAG_SECTION_PRIORITY) -> prompt lines
         suggested_activities_for_response = [] 
         activity_names_for_llm_introduction = [] # NEW: To hold names of activities for LLM to introduce
 
@@ -1953,16 +4008,17 @@ How do these options sound for {student_name_for_chat}?" """
                 relevant_coaching_insights_for_chat = relevant_coaching_insights_for_chat[:3]
             
             if relevant_coaching_insights_for_chat:
-                retrieved_context_parts.append("\n--- Relevant Research & Coaching Insights ---")
-                retrieved_context_parts.append("Use these insights to inform your exploratory questions and observations:")
+                section_lines = retrieved_context_sections["coaching_insights"] = []
+                section_lines.append("\n--- Relevant Research & Coaching Insights ---")
+                section_lines.append("Use these insights to inform your exploratory questions and observations:")
                 for ci in relevant_coaching_insights_for_chat:
-                    retrieved_context_parts.append(f"\n{ci['name']}:")
-                    retrieved_context_parts.append(f"Research insight: {ci['summary']}")
+                    section_lines.append(f"\n{ci['name']}:")
+                    section_lines.append(f"Research insight: {ci['summary']}")
                     if ci.get('key_points'):
-                        retrieved_context_parts.append("This suggests exploring:")
+                        section_lines.append("This suggests exploring:")
                         for point in ci['key_points']:
-                            retrieved_context_parts.append(f"  • {point}")
-                retrieved_context_parts.append(f"\nUse these insights to ask deeper questions about {student_name_for_chat}'s situation.")
+                            section_lines.append(f"  • {point}")
+                section_lines.append(f"\nUse these insights to ask deeper questions about {student_name_for_chat}'s situation.")
                 app.logger.info(f"chat_turn RAG: Found {len(relevant_coaching_insights_for_chat)} relevant coaching insights.")
             else:
                 app.logger.info("chat_turn RAG: No relevant coaching insights found.")
@@ -2050,15 +4106,17 @@ How do these options sound for {student_name_for_chat}?" """
                 include_activities_in_rag = (effective_conversation_depth_for_activities >= 3 or tutor_asking_for_activity)
                 
                 if current_found_activities_text_for_prompt and include_activities_in_rag: 
-                    retrieved_context_parts.append("\n--- Provided VESPA Activities ---")
-                    retrieved_context_parts.append("ONLY use the following activities if you choose to suggest one. For each, I've provided its Name, VESPA element, a Summary, Level and whether a PDF is available. When suggesting an activity, use its Name. Do NOT mention the ID. If a PDF is indicated as available, you can state that resources are available for it:")
+                    section_lines = retrieved_context_sections["activities"] = []
+                    section_lines.append("\n--- Provided VESPA Activities ---")
+                    section_lines.append("ONLY use the following activities if you choose to suggest one. For each, I've provided its Name, VESPA element, a Summary, Level and whether a PDF is available. When suggesting an activity, use its Name. Do NOT mention the ID. If a PDF is indicated as available, you can state that resources are available for it:")
                     if vespa_element_from_problem and any(a['is_element_match'] for a in all_matched_activities_with_level_info): # Check if any actual element matches were found
-                        retrieved_context_parts.append(f"NOTE: Activities from {vespa_element_from_problem} element are prioritized if relevant, as the problem was identified as {vespa_element_from_problem}-related.")
-                    retrieved_context_parts.extend(current_found_activities_text_for_prompt)
+                        section_lines.append(f"NOTE: Activities from {vespa_element_from_problem} element are prioritized if relevant, as the problem was identified as {vespa_element_from_problem}-related.")
+                    section_lines.extend(current_found_activities_text_for_prompt)
                     app.logger.info(f"chat_turn RAG: Found {found_activities_count} relevant VESPA activities for LLM. LLM prompt text: {current_found_activities_text_for_prompt}")
                 elif current_found_activities_text_for_prompt and conversation_depth >= 2:
                     # Add a note that activities are available but not shown yet
-                    retrieved_context_parts.append(f"\n[Note: There are relevant activities available that could be suggested once you better understand the tutor's needs.]")
+                    section_lines = retrieved_context_sections["activities_note"] = []
+                    section_lines.append(f"\n[Note: There are relevant activities available that could be suggested once you better understand the tutor's needs.]")
                     app.logger.info(f"chat_turn RAG: {found_activities_count} activities found but not included in context yet (conversation depth: {conversation_depth})")
                 else:
                     app.logger.info("chat_turn RAG: No relevant VESPA activities found to provide to LLM.")
@@ -2103,16 +4161,17 @@ How do these options sound for {student_name_for_chat}?" """
                                 break
 
             if relevant_vespa_statements:
-                retrieved_context_parts.append("\n--- VESPA Framework Student Indicators ---")
-                retrieved_context_parts.append("These indicators might help you explore what's happening:")
+                section_lines = retrieved_context_sections["vespa_indicators"] = []
+                section_lines.append("\n--- VESPA Framework Student Indicators ---")
+                section_lines.append("These indicators might help you explore what's happening:")
                 current_element = None
                 for vs in relevant_vespa_statements:
                     if vs['element'] != current_element:
                         current_element = vs['element']
-                        retrieved_context_parts.append(f"\n{current_element} - Students might show:")
+                        section_lines.append(f"\n{current_element} - Students might show:")
                     indicator_prefix = "✓" if vs['type'] == 'positive' else "✗"
-                    retrieved_context_parts.append(f"  {indicator_prefix} {vs['text']}")
-                retrieved_context_parts.append(f"\nExplore with the tutor: Which of these behaviors does {student_name_for_chat} show? What else have they noticed?")
+                    section_lines.append(f"  {indicator_prefix} {vs['text']}")
+                section_lines.append(f"\nExplore with the tutor: Which of these behaviors does {student_name_for_chat} show? What else have they noticed?")
                 app.logger.info(f"chat_turn RAG: Found {len(relevant_vespa_statements)} relevant VESPA statement indicators.")
             
             # Search REFLECTIVE_STATEMENTS_DATA
@@ -2127,8 +4186,9 @@ How do these options sound for {student_name_for_chat}?" """
                             found_statements_count += 1
                             if found_statements_count >= 2: break
                 if current_found_statements:
-                    retrieved_context_parts.append("\nRelevant Reflective Statements (from 100 statements - 2023.txt) the tutor could adapt:")
-                    retrieved_context_parts.extend(current_found_statements)
+                    section_lines = retrieved_context_sections["reflective_statements"] = []
+                    section_lines.append("\nRelevant Reflective Statements (from 100 statements - 2023.txt) the tutor could adapt:")
+                    section_lines.extend(current_found_statements)
                     app.logger.info(f"chat_turn RAG: Found {found_statements_count} relevant reflective statements.")
                 else:
                     app.logger.info("chat_turn RAG: No relevant reflective statements found.")
@@ -2176,10 +4236,11 @@ How do these options sound for {student_name_for_chat}?" """
                                         found_coaching_questions_count += 1
                                         if found_coaching_questions_count >= 2: break 
                 if current_found_coaching_questions:
-                    retrieved_context_parts.append("\n--- Coaching Questions to Explore ---")
-                    retrieved_context_parts.append("These questions from our knowledge base might help you and the tutor explore deeper:")
-                    retrieved_context_parts.extend(current_found_coaching_questions)
-                    retrieved_context_parts.append("\nAdapt these naturally into your conversation - perhaps: 'This makes me wonder...' or 'Have you considered asking {student_name_for_chat}...'")
+                    section_lines = retrieved_context_sections["coaching_questions"] = []
+                    section_lines.append("\n--- Coaching Questions to Explore ---")
+                    section_lines.append("These questions from our knowledge base might help you and the tutor explore deeper:")
+                    section_lines.extend(current_found_coaching_questions)
+                    section_lines.append("\nAdapt these naturally into your conversation - perhaps: 'This makes me wonder...' or 'Have you considered asking {student_name_for_chat}...'")
                     app.logger.info(f"chat_turn RAG: Found {found_coaching_questions_count} relevant coaching questions.")
                 else:
                     app.logger.info("chat_turn RAG: No specific coaching questions found from KB.")
@@ -2189,18 +4250,24 @@ How do these options sound for {student_name_for_chat}?" """
             app.logger.info("chat_turn RAG: No current_tutor_message, skipping keyword-based RAG.")
 
 
+        retrieved_context_sections = trim_sections_to_token_budget(retrieved_context_sections, CHAT_RAG_SECTION_PRIORITY, CHAT_PROMPT_RAG_TOKENS, part_name="rag")
+        if "activities" not in retrieved_context_sections and activity_names_for_llm_introduction:
+            # The activity details did not fit, so they are neither introduced by the model nor linked for the tutor.
+            app.logger.info(f"chat_turn RAG: Activities section dropped for the token budget; not suggesting {activity_names_for_llm_introduction}.")
+            activity_names_for_llm_introduction = []
+            suggested_activities_for_response = []
+        retrieved_context_parts = [line for section_lines in retrieved_context_sections.values() for line in section_lines]
         if retrieved_context_parts: 
             app.logger.info(f"chat_turn RAG: Final retrieved_context_parts count: {len(retrieved_context_parts)}")
-            context_preamble += "\n\n--- Additional Context Retrieved from Knowledge Bases (Based on Tutor's Query) ---\n"
-            context_preamble += "Use the following information to formulate your response. Remember the guidelines on synthesizing, explaining relevance, and practical application.\n"
-            if vespa_element_from_problem:
-                context_preamble += f"IMPORTANT: The tutor has indicated a {vespa_element_from_problem}-related problem. If relevant activities from this element are listed under '--- Provided VESPA Activities ---', prioritize suggesting one.\n"
-            context_preamble += "\n"
-            context_preamble += "\n".join(retrieved_context_parts)
+            turn_context += "\n\n--- Additional Context Retrieved from Knowledge Bases (Based on Tutor's Query) ---\n"
+            turn_context += "Use the following information to formulate your response. Remember the guidelines on synthesizing, explaining relevance, and practical application.\n"
+            if vespa_element_from_problem and "activities" in retrieved_context_sections:
+                turn_context += f"IMPORTANT: The tutor has indicated a {vespa_element_from_problem}-related problem. If relevant activities from this element are listed under '--- Provided VESPA Activities ---', prioritize suggesting one.\n"
+            turn_context += "\n"
+            turn_context += "\n".join(retrieved_context_parts)
 
-        context_preamble += "\n\nGiven the student's overall profile (from initial context) and any specific items just retrieved from the knowledge bases (detailed above), please respond to the tutor's latest message. Adhere to all persona and response guidelines."
-        messages_for_llm.insert(1, {"role": "system", "content": context_preamble}) 
-        app.logger.info(f"chat_turn: Added initial_ai_context and RAG context to LLM prompt. Pre-amble length: {len(context_preamble)}")
+        turn_context += "\n\nGiven the student's overall profile (from initial context) and any specific items just retrieved from the knowledge bases (detailed above), please respond to the tutor's latest message. Adhere to all persona and response guidelines."
+        app.logger.info(f"chat_turn: Added initial_ai_context and RAG context to LLM prompt. Student context length: {len(student_context)}, turn context length: {len(turn_context)}")
 
         # NEW: Add instruction for LLM to introduce activities if they are being suggested
         if activity_names_for_llm_introduction: # If we have activities for the frontend
@@ -2216,49 +4283,96 @@ How do these options sound for {student_name_for_chat}?" """
                 f"For example, you might say something like: 'Based on our discussion about [issue], the \"{first_activity_example}\" activity could be a useful tool to explore. You'll find it and others in the Suggested Activities links below.' " # Escaped quotes around {first_activity_example}
                 f"Make this feel like a natural part of the conversation."
             )
-            # Append this to the main system prompt or the RAG context preamble
-            if len(messages_for_llm) > 1 and messages_for_llm[1]['role'] == 'system':
-                messages_for_llm[1]['content'] += introduction_prompt_for_llm
-            else:
-                messages_for_llm[0]['content'] += introduction_prompt_for_llm
+            turn_context += introduction_prompt_for_llm
             app.logger.info(f"Added activity introduction guidance to LLM prompt for activities: {activity_names_str}")
     else: # if not initial_ai_context
         app.logger.info("chat_turn: No initial_ai_context provided. Proceeding without RAG for this turn.")
 
 
-    # Add existing chat history
-    for message in chat_history:
-        # Prepend a marker if the tutor liked this message
-        content = message.get("content", "")
-        if message.get("is_liked") and message.get("role") == "assistant": # Mark liked AI responses
-            content = f"[Tutor Liked This Assistant Response]: {content}"
-        elif message.get("is_liked") and message.get("role") == "user": # Or if user message was somehow marked as liked contextually
-            content = f"[Tutor Indicated This Was Important User Context]: {content}"
-        messages_for_llm.append({"role": message.get("role"), "content": content}) 
+    messages_for_llm.append({"role": "system", "content": student_context})
+    # Add existing chat history (older turns summarised if it is over its token budget)
+    messages_for_llm.extend(build_chat_history_messages(chat_history))
+    messages_for_llm.append({"role": "system", "content": turn_context})
     # Add current tutor message
     messages_for_llm.append({"role": "user", "content": current_tutor_message})
 
+    # Prepend new topic instruction if applicable
+    final_user_message_for_llm = current_tutor_message
+    if new_topic_being_initiated:
+        final_user_message_for_llm = f"[TUTOR IS STARTING A COMPLETELY NEW DISCUSSION TOPIC. Focus your response solely on the following message as if it's the beginning of a new conversation. Do not refer to previous topics unless the tutor explicitly does so in this new message.] {current_tutor_message}"
+        # Remove the last user message (which is the original current_tutor_message) and add the modified one
+        if messages_for_llm[-1]["role"] == "user":
+            messages_for_llm.pop()
+        messages_for_llm.append({"role": "user", "content": final_user_message_for_llm})
+        app.logger.info("Prepended NEW TOPIC instruction to user message for LLM.")
+
+    return messages_for_llm, suggested_activities_for_response
+
+
+def start_chat_turn(data):
+    """
+    Shared front half of chat_turn and chat_turn_stream: validates the request, saves the tutor's
+    message and builds the prompt. Returns (turn, None), or (None, (response, status)) when the
+    request cannot go to the LLM.
+    """
+    student_object10_id = data.get('student_object10_record_id')
+    chat_history = data.get('chat_history', []) 
+    current_tutor_message = data.get('current_tutor_message')
+    initial_ai_context = data.get('initial_ai_context') 
+    student_level_from_context = initial_ai_context.get('student_level') if initial_ai_context else None
+    app.logger.info(f"Chat turn: student_object10_id: {student_object10_id}, Student level from initial_ai_context: {student_level_from_context}") # ADDED LOG
+
+    # --- NEW: Detect if a new topic is being initiated ---
+    new_topic_being_initiated = data.get('new_topic_initiated', False)
+    if new_topic_being_initiated:
+        app.logger.info(f"New topic initiated for student {student_object10_id}.")
+
+    # --- Student Name for Personalization (Fetch if not in initial_ai_context) ---
+    student_name_for_chat = resolve_chat_student_name(student_object10_id, initial_ai_context)
+
+    if not student_object10_id or not current_tutor_message:
+        app.logger.error("chat_turn: Missing student_object10_record_id or current_tutor_message.")
+        return None, (jsonify({"error": "Missing student_object10_record_id or current_tutor_message"}), 400)
+    
+    if not OPENAI_API_KEY:
+        app.logger.error("chat_turn: OpenAI API key not configured.")
+        save_chat_message_to_knack(student_object10_id, "Tutor", current_tutor_message)
+        return None, (jsonify({"ai_response": "I am currently unable to respond (AI not configured). Your message has been logged."}), 200)
+
+    tutor_message_saved_id = save_chat_message_to_knack(student_object10_id, "Tutor", current_tutor_message)
+    if not tutor_message_saved_id:
+        app.logger.error(f"chat_turn: Failed to save tutor's message to Knack for student {student_object10_id}.")
+
+    messages_for_llm, suggested_activities_for_response = build_chat_turn_messages(
+        chat_history, current_tutor_message, initial_ai_context, new_topic_being_initiated, student_name_for_chat)
+    app.logger.info(f"chat_turn: Sending to LLM. Number of messages: {len(messages_for_llm)} (~{estimate_message_tokens(messages_for_llm)} tokens). Static prefix length: {len(messages_for_llm[0]['content']) + len(messages_for_llm[1]['content'])}. Student context length: {len(messages_for_llm[2]['content'])}")
+    return {
+        "student_object10_id": student_object10_id,
+        "tutor_message_saved_id": tutor_message_saved_id,
+        "messages_for_llm": messages_for_llm,
+        "suggested_activities_in_chat": suggested_activities_for_response,
+    }, None
+
+
+@app.route('/api/v1/chat_turn', methods=['POST'])
+def chat_turn():
+    data = request.get_json() # Ensure this line is present
+    app.logger.info(f"Received request for /api/v1/chat_turn with data: {str(data)[:500]}...")
+
+    turn, error_response = start_chat_turn(data)
+    if error_response:
+        return error_response
+    student_object10_id = turn["student_object10_id"]
+
     ai_response_text = "An error occurred while generating my response."
     try:
-        app.logger.info(f"chat_turn: Sending to LLM. Number of messages: {len(messages_for_llm)}. First system message length: {len(messages_for_llm[0]['content'])}. Second system message (context) length (if present): {len(messages_for_llm[1]['content']) if len(messages_for_llm) > 1 and messages_for_llm[1]['role'] == 'system' else 'N/A'}")
-        
-        # Prepend new topic instruction if applicable
-        final_user_message_for_llm = current_tutor_message
-        if new_topic_being_initiated:
-            final_user_message_for_llm = f"[TUTOR IS STARTING A COMPLETELY NEW DISCUSSION TOPIC. Focus your response solely on the following message as if it's the beginning of a new conversation. Do not refer to previous topics unless the tutor explicitly does so in this new message.] {current_tutor_message}"
-            # Remove the last user message (which is the original current_tutor_message) and add the modified one
-            if messages_for_llm[-1]["role"] == "user":
-                messages_for_llm.pop()
-            messages_for_llm.append({"role": "user", "content": final_user_message_for_llm})
-            app.logger.info("Prepended NEW TOPIC instruction to user message for LLM.")
-
-        response = openai.chat.completions.create(
-            model="gpt-4o-mini", # Using more capable model for better conversational quality
-            messages=messages_for_llm,
-            max_tokens=400, # Slightly increased to allow for thoughtful exploration
-            temperature=0.7, # Balanced temperature for natural yet focused conversation
+        response, _ = LLM_CLIENT.create(
+            "chat_turn",
+            deadline_seconds=CHAT_TURN_LLM_DEADLINE_SECONDS,
+            messages=turn["messages_for_llm"],
             n=1,
-            stop=None
+            stop=None,
+            **CHAT_TURN_LLM_PARAMS
         )
         ai_response_text = response.choices[0].message.content.strip()
         app.logger.info(f"chat_turn: LLM raw response: {ai_response_text}")
@@ -2273,16 +4387,556 @@ How do these options sound for {student_name_for_chat}?" """
 
     return jsonify({
         "ai_response": ai_response_text, 
-        "suggested_activities_in_chat": suggested_activities_for_response,
+        "suggested_activities_in_chat": turn["suggested_activities_in_chat"],
         "ai_message_knack_id": ai_message_saved_id # Ensure this is returned
     })
 
+
+def sse_event(event, payload):
+    """One Server-Sent Events frame with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+@app.route('/api/v1/chat_turn_stream', methods=['POST'])
+def chat_turn_stream():
+    """
+    Streaming variant of chat_turn. Same request body; the reply is text/event-stream:
+      event: start  {"tutor_message_id"}
+      event: token  {"delta"}  -- one per chunk from the model
+      event: done   {"ai_response", "suggested_activities_in_chat", "ai_message_knack_id"}
+      event: error  {"error"}  -- sent before done if the model call fails
+    The AI message is saved once the stream finishes (or with whatever arrived if the client disconnects).
+    """
+    data = request.get_json()
+    app.logger.info(f"Received request for /api/v1/chat_turn_stream with data: {str(data)[:500]}...")
+
+    turn, error_response = start_chat_turn(data)
+    if error_response:
+        return error_response
+    student_object10_id = turn["student_object10_id"]
+
+    def generate():
+        chunks = []
+        completed = False
+        try:
+            yield sse_event("start", {"tutor_message_id": turn["tutor_message_saved_id"]})
+            try:
+                stream, _ = LLM_CLIENT.create(
+                    "chat_turn_stream",
+                    deadline_seconds=CHAT_TURN_LLM_DEADLINE_SECONDS,
+                    messages=turn["messages_for_llm"],
+                    n=1,
+                    stop=None,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    **CHAT_TURN_LLM_PARAMS
+                )
+                for chunk in stream:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        chunks.append(delta)
+                        yield sse_event("token", {"delta": delta})
+            except Exception as e:
+                app.logger.error(f"chat_turn_stream: Error calling OpenAI API: {e}")
+                yield sse_event("error", {"error": "An error occurred while generating my response."})
+            ai_response_text = "".join(chunks).strip() or "An error occurred while generating my response."
+            app.logger.info(f"chat_turn_stream: LLM raw response: {ai_response_text}")
+            ai_message_saved_id = save_chat_message_to_knack(student_object10_id, "AI Coach", ai_response_text)
+            completed = True
+            if not ai_message_saved_id:
+                app.logger.error(f"chat_turn_stream: Failed to save AI's response to Knack for student {student_object10_id}.")
+            yield sse_event("done", {
+                "ai_response": ai_response_text,
+                "suggested_activities_in_chat": turn["suggested_activities_in_chat"],
+                "ai_message_knack_id": ai_message_saved_id,
+            })
+        finally:
+            # Client went away mid-stream: keep the part of the reply it was shown.
+            if not completed and chunks:
+                app.logger.warning(f"chat_turn_stream: Client disconnected for student {student_object10_id}; saving partial AI response.")
+                save_chat_message_to_knack(student_object10_id, "AI Coach", "".join(chunks).strip())
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# --- Local SQLite Stores ---
+class SQLiteStore:
+    """Base for local SQLite-backed stores: one connection per thread (and per process after a fork), WAL mode."""
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or getattr(self.local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """Write transaction taken up front, so read-then-write sequences are atomic across workers."""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+
+# --- Chat Message Write-Behind Journal ---
+class ChatMessageJournal(SQLiteStore):
+    """
+    Durable local spool for Object_118 chat messages.
+    Rows move pending -> flushing -> saved (or failed after CHAT_JOURNAL_MAX_ATTEMPTS). Every worker
+    runs a flusher against the same file, and each row is claimed in a write transaction right before
+    it is posted. A POST that failed before reaching Knack goes back to pending; one that may have
+    created the record (timeout, 5xx, unreadable reply) goes to unknown, and unknown or abandoned
+    flushing rows are looked up in Knack before being posted again, so a message is never saved twice.
+    A like made before the Knack record exists is stored with the row and applied right after it is saved.
+    Saved rows are deleted after CHAT_JOURNAL_SAVED_RETENTION_SECONDS.
+    Local ids embed the journal's instance_id ("local-<instance_id>-<uuid>"), which is shared by every
+    worker using the same file, so an id from another journal can be told apart from an expired one.
+    """
+    LOCAL_ID_PREFIX = "local-"
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.flusher_pid = None
+        self.flusher_lock = threading.Lock()
+        self.wake_event = threading.Event()
+        self.counters = {"journaled": 0, "flushed": 0, "reconciled": 0, "retried": 0, "failed": 0, "likes_applied": 0, "pruned": 0}
+        self._connection().execute("""CREATE TABLE IF NOT EXISTS chat_journal (
+            local_id TEXT PRIMARY KEY,
+            student_obj10_id TEXT NOT NULL,
+            sender TEXT NOT NULL,
+            message_text TEXT NOT NULL,
+            message_timestamp TEXT NOT NULL,
+            status TEXT NOT NULL,
+            knack_id TEXT,
+            pending_liked INTEGER,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            claimed_at REAL,
+            last_error TEXT,
+            created_at REAL NOT NULL)""")
+        self._connection().execute("CREATE INDEX IF NOT EXISTS chat_journal_due ON chat_journal (status, next_attempt_at)")
+        with self.transaction() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS chat_journal_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO chat_journal_meta (key, value) VALUES ('instance_id', ?)", (uuid.uuid4().hex[:12],))
+            self.instance_id = conn.execute("SELECT value FROM chat_journal_meta WHERE key = 'instance_id'").fetchone()["value"]
+
+    @classmethod
+    def is_local_id(cls, message_id):
+        return isinstance(message_id, str) and message_id.startswith(cls.LOCAL_ID_PREFIX)
+
+    def issued_local_id(self, local_id):
+        """True if local_id was issued by this journal (even if its row has since been pruned)."""
+        return local_id.startswith(f"{self.LOCAL_ID_PREFIX}{self.instance_id}-")
+
+    def enqueue(self, student_obj10_id, sender, message_text, message_timestamp):
+        local_id = f"{self.LOCAL_ID_PREFIX}{self.instance_id}-{uuid.uuid4().hex}"
+        now = time.time()
+        self._connection().execute(
+            "INSERT INTO chat_journal (local_id, student_obj10_id, sender, message_text, message_timestamp, status, next_attempt_at, created_at) "
+            "VALUES (?, ?, ?, ?, ?, 'pending', ?, ?)",
+            (local_id, student_obj10_id, sender, message_text, message_timestamp, now, now))
+        increment_stat(self.counters, "journaled")
+        self.ensure_flusher()
+        self.wake_event.set()
+        return local_id
+
+    def get(self, local_id):
+        row = self._connection().execute("SELECT * FROM chat_journal WHERE local_id = ?", (local_id,)).fetchone()
+        return dict(row) if row else None
+
+    def set_pending_like(self, local_id, is_liked):
+        """Records a like for a message not yet in Knack. Returns the Knack id instead if it was saved meanwhile."""
+        with self.transaction() as conn:
+            row = conn.execute("SELECT status, knack_id FROM chat_journal WHERE local_id = ?", (local_id,)).fetchone()
+            if row and row["status"] != "saved":
+                conn.execute("UPDATE chat_journal SET pending_liked = ? WHERE local_id = ?", (1 if is_liked else 0, local_id))
+        return row["knack_id"] if row and row["status"] == "saved" else None
+
+    def claim_next(self):
+        """Atomically claims the oldest due row for this worker. The returned row still shows its status before the claim."""
+        now = time.time()
+        with self.transaction() as conn:
+            row = conn.execute(
+                "SELECT * FROM chat_journal WHERE (status IN ('pending', 'unknown') AND next_attempt_at <= ?) "
+                "OR (status = 'flushing' AND claimed_at <= ?) ORDER BY created_at LIMIT 1",
+                (now, now - CHAT_JOURNAL_CLAIM_TIMEOUT_SECONDS)).fetchone()
+            if row:
+                conn.execute("UPDATE chat_journal SET status = 'flushing', claimed_at = ? WHERE local_id = ?", (now, row["local_id"]))
+        return dict(row) if row else None
+
+    def mark_saved(self, local_id, knack_id):
+        """Marks a row saved and returns its pending like (True/False) if one was recorded, else None."""
+        with self.transaction() as conn:
+            row = conn.execute("SELECT pending_liked FROM chat_journal WHERE local_id = ?", (local_id,)).fetchone()
+            conn.execute("UPDATE chat_journal SET status = 'saved', knack_id = ?, pending_liked = NULL, last_error = NULL WHERE local_id = ?",
+                         (knack_id, local_id))
+        increment_stat(self.counters, "flushed")
+        return None if row is None or row["pending_liked"] is None else bool(row["pending_liked"])
+
+    def mark_retry(self, row, error, outcome_unknown=False):
+        """Schedules another attempt. outcome_unknown means Knack may have created the record, so it is looked up first."""
+        attempts = row["attempts"] + 1
+        if attempts >= CHAT_JOURNAL_MAX_ATTEMPTS:
+            status, next_attempt_at = "failed", row["next_attempt_at"]
+            increment_stat(self.counters, "failed")
+            app.logger.error(f"Giving up on journaled chat message {row['local_id']} after {attempts} attempts: {error}")
+        else:
+            status = "unknown" if outcome_unknown else "pending"
+            next_attempt_at = time.time() + random.uniform(0, min(CHAT_JOURNAL_RETRY_MAX_SECONDS, 2 ** attempts))
+            increment_stat(self.counters, "retried")
+        self._connection().execute(
+            "UPDATE chat_journal SET status = ?, attempts = ?, next_attempt_at = ?, claimed_at = NULL, last_error = ? WHERE local_id = ?",
+            (status, attempts, next_attempt_at, str(error)[:500], row["local_id"]))
+
+    def prune_saved(self):
+        """Deletes rows saved (claimed for their successful POST) more than CHAT_JOURNAL_SAVED_RETENTION_SECONDS ago."""
+        deleted = self._connection().execute("DELETE FROM chat_journal WHERE status = 'saved' AND claimed_at <= ?",
+                                             (time.time() - CHAT_JOURNAL_SAVED_RETENTION_SECONDS,)).rowcount
+        increment_stat(self.counters, "pruned", deleted)
+        return deleted
+
+    def flush_row(self, row):
+        """Saves one claimed row to Knack."""
+        if row["status"] in ("unknown", "flushing"):
+            # An earlier POST may have created the record (or its worker died mid-POST): look before posting again.
+            knack_id, lookup_ok = find_chat_message_in_knack(row["student_obj10_id"], row["sender"], row["message_timestamp"])
+            if not lookup_ok:
+                self.mark_retry(row, "Could not check Knack for an earlier attempt", outcome_unknown=True)
+                return
+            if knack_id:
+                increment_stat(self.counters, "reconciled")
+                app.logger.info(f"Journaled chat message {row['local_id']} was already saved to Knack as {knack_id}.")
+                self._complete(row, knack_id)
+                return
+        try:
+            knack_id = _post_chat_message_to_knack(row["student_obj10_id"], row["sender"], row["message_text"], row["message_timestamp"],
+                                                   raise_errors=True)
+        except Exception as e:
+            self.mark_retry(row, e, outcome_unknown=not getattr(e, "record_not_created", False))
+            return
+        self._complete(row, knack_id)
+
+    def _complete(self, row, knack_id):
+        pending_liked = self.mark_saved(row["local_id"], knack_id)
+        mirror_chat_update("mark_saved", row["local_id"], knack_id)
+        if pending_liked is not None:
+            if update_chat_like_in_knack(knack_id, pending_liked) is not None:
+                increment_stat(self.counters, "likes_applied")
+
+    def flush_once(self):
+        """Saves up to CHAT_JOURNAL_BATCH_SIZE due messages, in journal order, claiming each just before its POST. Returns the number attempted."""
+        attempted = 0
+        while attempted < CHAT_JOURNAL_BATCH_SIZE:
+            row = self.claim_next()
+            if row is None:
+                break
+            attempted += 1
+            self.flush_row(row)
+        return attempted
+
+    def _run_flusher(self):
+        app.logger.info(f"Chat journal flusher started in worker {os.getpid()} ({self.path}).")
+        while True:
+            self.wake_event.wait(CHAT_JOURNAL_FLUSH_INTERVAL_SECONDS)
+            self.wake_event.clear()
+            try:
+                while self.flush_once() == CHAT_JOURNAL_BATCH_SIZE:
+                    pass
+                self.prune_saved()
+            except Exception as e:
+                app.logger.error(f"Chat journal flush failed: {e}")
+
+    def ensure_flusher(self):
+        """Starts this process's flusher thread (again after a fork)."""
+        with self.flusher_lock:
+            if self.flusher_pid == os.getpid():
+                return
+            self.flusher_pid = os.getpid()
+            threading.Thread(target=self._run_flusher, name="chat-journal-flusher", daemon=True).start()
+
+    def stats(self):
+        counts = {row["status"]: row["count"] for row in
+                  self._connection().execute("SELECT status, COUNT(*) AS count FROM chat_journal GROUP BY status")}
+        return dict(self.counters, by_status=counts)
+
+
+def create_chat_journal():
+    if not CHAT_JOURNAL_ENABLED:
+        return None
+    try:
+        return ChatMessageJournal(CHAT_JOURNAL_PATH)
+    except sqlite3.Error as e:
+        app.logger.error(f"Could not open chat journal at {CHAT_JOURNAL_PATH}: {e}. Chat messages will be saved synchronously.")
+        return None
+
+
+CHAT_JOURNAL = create_chat_journal()
+
+
+# --- Local Mirror of Object_118 Chat Logs ---
+def knack_chat_timestamp_sort_key(ts_str):
+    """Seconds since the epoch for a field_3276 value; unparseable values sort as the oldest."""
+    try:
+        return (datetime.strptime(ts_str, '%d/%m/%Y %H:%M:%S') - datetime(1970, 1, 1)).total_seconds()
+    except (TypeError, ValueError):
+        return -1e18
+
+
+class ChatLogMirror(SQLiteStore):
+    """
+    Indexed local copy of Object_118 chat messages, keyed by student Object_10 id and timestamp.
+    Rows are returned in the same shape as Knack records (id, field_3276, field_3273, field_3277,
+    field_3279) so callers don't care which store served them. Messages still waiting in the
+    write-behind journal are mirrored under their local id with pending=1. mirrored_at is when a row
+    was last written, so a sync only replaces rows older than the Knack snapshot it read.
+    """
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.reconciler_pid = None
+        self.reconciler_lock = threading.Lock()
+        self.sync_singleflight = SingleFlight("chat_mirror_sync")
+        self.counters = {"local_reads": 0, "syncs": 0, "sync_failures": 0, "reconciled": 0}
+        conn = self._connection()
+        conn.execute("""CREATE TABLE IF NOT EXISTS chat_messages (
+            record_id TEXT PRIMARY KEY,
+            student_obj10_id TEXT NOT NULL,
+            sort_ts REAL NOT NULL,
+            timestamp TEXT,
+            sender TEXT,
+            content TEXT,
+            liked INTEGER NOT NULL DEFAULT 0,
+            pending INTEGER NOT NULL DEFAULT 0,
+            mirrored_at REAL NOT NULL DEFAULT 0)""")
+        if "mirrored_at" not in {column["name"] for column in conn.execute("PRAGMA table_info(chat_messages)")}:
+            conn.execute("ALTER TABLE chat_messages ADD COLUMN mirrored_at REAL NOT NULL DEFAULT 0")
+        conn.execute("CREATE INDEX IF NOT EXISTS chat_messages_student_ts ON chat_messages (student_obj10_id, sort_ts DESC, record_id DESC)")
+        conn.execute("""CREATE TABLE IF NOT EXISTS chat_mirror_students (
+            student_obj10_id TEXT PRIMARY KEY,
+            synced_at REAL NOT NULL,
+            last_read_at REAL NOT NULL,
+            truncated INTEGER NOT NULL DEFAULT 0)""")
+
+    @staticmethod
+    def _row_to_record(row):
+        return {"id": row["record_id"], "field_3275": row["student_obj10_id"], "field_3276": row["timestamp"],
+                "field_3273": row["sender"], "field_3277": row["content"], "field_3279": "Yes" if row["liked"] else "No",
+                "pending": bool(row["pending"])}
+
+    def is_fresh(self, student_obj10_id):
+        row = self._connection().execute("SELECT synced_at FROM chat_mirror_students WHERE student_obj10_id = ?",
+                                         (student_obj10_id,)).fetchone()
+        return row is not None and time.time() - row["synced_at"] < CHAT_MIRROR_RECONCILE_SECONDS
+
+    def ensure_synced(self, student_obj10_id):
+        """Read-through: re-syncs the student's messages from Knack if the local copy is missing or stale."""
+        self._connection().execute("UPDATE chat_mirror_students SET last_read_at = ? WHERE student_obj10_id = ?",
+                                   (time.time(), student_obj10_id))
+        if self.is_fresh(student_obj10_id):
+            return True
+        synced, _ = self.sync_singleflight.do(student_obj10_id, lambda: self.sync_student(student_obj10_id))
+        return synced
+
+    def sync_student(self, student_obj10_id):
+        """Replaces the student's mirrored Knack rows with a fresh copy. Returns False if Knack could not be read."""
+        # Rows written locally once the Knack read has started may be newer than the snapshot, so they are kept.
+        sync_started_at = time.time()
+        filters = [{'field': 'field_3275', 'operator': 'is', 'value': student_obj10_id}]
+        knack_records = get_all_knack_records("object_118", filters=filters, max_pages=50)
+        if knack_records.pages_fetched == 0 or knack_records.truncation_reason == "page_fetch_failed":
+            increment_stat(self.counters, "sync_failures")
+            app.logger.warning(f"Chat mirror sync for student {student_obj10_id} could not read Object_118.")
+            return False
+        rows = [(record.get('id'), student_obj10_id, knack_chat_timestamp_sort_key(record.get('field_3276')), record.get('field_3276'),
+                 record.get('field_3273'), record.get('field_3277', ""), 1 if record.get('field_3279') == "Yes" else 0, sync_started_at)
+                for record in knack_records if record.get('id')]
+        now = time.time()
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM chat_messages WHERE student_obj10_id = ? AND pending = 0 AND mirrored_at < ?",
+                         (student_obj10_id, sync_started_at))
+            # Any row still present with a snapshot id was written after the read started and wins.
+            conn.executemany("INSERT OR IGNORE INTO chat_messages (record_id, student_obj10_id, sort_ts, timestamp, sender, content, liked, pending, mirrored_at) "
+                             "VALUES (?, ?, ?, ?, ?, ?, ?, 0, ?)", rows)
+            # Journaled messages that reached Knack during the sync are now present under their Knack id.
+            for pending_row in conn.execute("SELECT record_id FROM chat_messages WHERE student_obj10_id = ? AND pending = 1",
+                                            (student_obj10_id,)).fetchall():
+                journal_row = CHAT_JOURNAL.get(pending_row["record_id"]) if CHAT_JOURNAL is not None else None
+                if journal_row is None or journal_row["status"] in ("saved", "failed"):
+                    conn.execute("DELETE FROM chat_messages WHERE record_id = ?", (pending_row["record_id"],))
+            conn.execute("INSERT INTO chat_mirror_students (student_obj10_id, synced_at, last_read_at, truncated) VALUES (?, ?, ?, ?) "
+                         "ON CONFLICT(student_obj10_id) DO UPDATE SET synced_at = excluded.synced_at, truncated = excluded.truncated",
+                         (student_obj10_id, now, now, 1 if knack_records.truncated else 0))
+        increment_stat(self.counters, "syncs")
+        app.logger.info(f"Chat mirror synced {len(rows)} messages for student {student_obj10_id}.")
+        return True
+
+    def add_message(self, record_id, student_obj10_id, sender, message_text, message_timestamp, pending):
+        self._connection().execute(
+            "INSERT OR REPLACE INTO chat_messages (record_id, student_obj10_id, sort_ts, timestamp, sender, content, liked, pending, mirrored_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, 0, ?, ?)",
+            (record_id, student_obj10_id, knack_chat_timestamp_sort_key(message_timestamp), message_timestamp, sender, message_text,
+             1 if pending else 0, time.time()))
+
+    def mark_saved(self, local_id, knack_id):
+        """Re-keys a journaled message under its new Knack record id."""
+        with self.transaction() as conn:
+            if conn.execute("SELECT 1 FROM chat_messages WHERE record_id = ?", (knack_id,)).fetchone():
+                conn.execute("DELETE FROM chat_messages WHERE record_id = ?", (local_id,))
+            else:
+                conn.execute("UPDATE chat_messages SET record_id = ?, pending = 0, mirrored_at = ? WHERE record_id = ?",
+                             (knack_id, time.time(), local_id))
+
+    def set_liked(self, record_id, is_liked):
+        self._connection().execute("UPDATE chat_messages SET liked = ?, mirrored_at = ? WHERE record_id = ?",
+                                   (1 if is_liked else 0, time.time(), record_id))
+
+    def delete_records(self, record_ids):
+        with self.transaction() as conn:
+            conn.executemany("DELETE FROM chat_messages WHERE record_id = ?", [(record_id,) for record_id in record_ids])
+
+    def history_page(self, student_obj10_id, page_size, cursor=None):
+        """Returns (records newest first, has_more), using the same cursor as fetch_chat_history_page."""
+        query = "SELECT * FROM chat_messages WHERE student_obj10_id = ?"
+        params = [student_obj10_id]
+        if cursor:
+            cursor_ts = knack_chat_timestamp_sort_key(cursor.get('before'))
+            seen_ids = list(cursor.get('seen_ids') or [])
+            query += f" AND (sort_ts < ? OR (sort_ts = ? AND record_id NOT IN ({','.join('?' * len(seen_ids)) or 'NULL'})))"
+            params += [cursor_ts, cursor_ts] + seen_ids
+        query += " ORDER BY sort_ts DESC, record_id DESC LIMIT ?"
+        params.append(page_size + 1)
+        rows = self._connection().execute(query, params).fetchall()
+        increment_stat(self.counters, "local_reads")
+        return [self._row_to_record(row) for row in rows[:page_size]], len(rows) > page_size
+
+    def chat_index_oldest_first(self, student_obj10_id):
+        """Just the id, timestamp, liked flag and pending flag of each message, oldest first (for clear_old_chats)."""
+        rows = self._connection().execute(
+            "SELECT record_id, timestamp, liked, pending FROM chat_messages WHERE student_obj10_id = ? ORDER BY sort_ts ASC, record_id ASC",
+            (student_obj10_id,)).fetchall()
+        increment_stat(self.counters, "local_reads")
+        return [{"id": row["record_id"], "field_3276": row["timestamp"], "field_3279": "Yes" if row["liked"] else "No",
+                 "pending": bool(row["pending"])} for row in rows]
+
+    def counts(self, student_obj10_id):
+        """(total messages, liked messages) for a student."""
+        row = self._connection().execute("SELECT COUNT(*) AS total, COALESCE(SUM(liked), 0) AS liked FROM chat_messages WHERE student_obj10_id = ?",
+                                         (student_obj10_id,)).fetchone()
+        return row["total"], row["liked"]
+
+    def is_truncated(self, student_obj10_id):
+        row = self._connection().execute("SELECT truncated FROM chat_mirror_students WHERE student_obj10_id = ?", (student_obj10_id,)).fetchone()
+        return bool(row and row["truncated"])
+
+    def reconcile_once(self):
+        """Re-syncs stale copies of recently read students. Returns how many were refreshed."""
+        now = time.time()
+        students = [row["student_obj10_id"] for row in self._connection().execute(
+            "SELECT student_obj10_id FROM chat_mirror_students WHERE synced_at < ? AND last_read_at > ? ORDER BY synced_at LIMIT ?",
+            (now - CHAT_MIRROR_RECONCILE_SECONDS, now - CHAT_MIRROR_ACTIVE_SECONDS, CHAT_MIRROR_RECONCILE_BATCH)).fetchall()]
+        reconciled = 0
+        for student_obj10_id in students:
+            synced, _ = self.sync_singleflight.do(student_obj10_id, lambda: self.sync_student(student_obj10_id))
+            reconciled += 1 if synced else 0
+        increment_stat(self.counters, "reconciled", reconciled)
+        return reconciled
+
+    def _run_reconciler(self):
+        while True:
+            time.sleep(CHAT_MIRROR_RECONCILE_SECONDS)
+            try:
+                self.reconcile_once()
+            except Exception as e:
+                app.logger.error(f"Chat mirror reconcile failed: {e}")
+
+    def ensure_reconciler(self):
+        with self.reconciler_lock:
+            if self.reconciler_pid == os.getpid():
+                return
+            self.reconciler_pid = os.getpid()
+            threading.Thread(target=self._run_reconciler, name="chat-mirror-reconciler", daemon=True).start()
+
+    def stats(self):
+        row = self._connection().execute("SELECT COUNT(*) AS messages, COUNT(DISTINCT student_obj10_id) AS students FROM chat_messages").fetchone()
+        return dict(self.counters, messages=row["messages"], students=row["students"])
+
+
+def create_chat_mirror():
+    if not CHAT_MIRROR_ENABLED:
+        return None
+    try:
+        return ChatLogMirror(CHAT_MIRROR_PATH)
+    except sqlite3.Error as e:
+        app.logger.error(f"Could not open chat mirror at {CHAT_MIRROR_PATH}: {e}. Chat history will be read from Knack.")
+        return None
+
+
+CHAT_MIRROR = create_chat_mirror()
+
+
+def mirror_chat_update(action, *args):
+    """Applies a write to the chat mirror; a mirror failure only costs an earlier re-sync, so it is logged and ignored."""
+    if CHAT_MIRROR is None:
+        return
+    try:
+        getattr(CHAT_MIRROR, action)(*args)
+    except sqlite3.Error as e:
+        app.logger.warning(f"Chat mirror {action} failed: {e}")
+
+
 def save_chat_message_to_knack(student_obj10_id, sender, message_text):
-    """Saves a chat message to the new Object_118 in Knack."""
+    """
+    Saves a chat message to Object_118. With the write-behind journal enabled this returns a
+    local id ("local-...") as soon as the message is journaled; /api/v1/chat_message_status maps
+    it to the Knack record id once flushed. Otherwise the message is posted synchronously.
+    """
     if not student_obj10_id or not sender or not message_text:
         app.logger.error("save_chat_message_to_knack: Missing required parameters.")
         return None
 
+    # Timestamp the message when it happens, not when the flusher gets to it.
+    current_timestamp_knack_format = datetime.now().strftime('%d/%m/%Y %H:%M:%S')
+    if CHAT_JOURNAL is not None:
+        try:
+            local_id = CHAT_JOURNAL.enqueue(student_obj10_id, sender, message_text, current_timestamp_knack_format)
+            app.logger.info(f"Journaled chat message from {sender} for student {student_obj10_id} as {local_id}.")
+            mirror_chat_update("add_message", local_id, student_obj10_id, sender, message_text, current_timestamp_knack_format, True)
+            return local_id
+        except sqlite3.Error as e:
+            app.logger.error(f"Could not journal chat message, saving synchronously instead: {e}")
+    knack_id = _post_chat_message_to_knack(student_obj10_id, sender, message_text, current_timestamp_knack_format)
+    if knack_id:
+        mirror_chat_update("add_message", knack_id, student_obj10_id, sender, message_text, current_timestamp_knack_format, False)
+    return knack_id
+
+
+class ChatMessagePostError(Exception):
+    """A failed Object_118 create. record_not_created is True only when Knack certainly did not create the record."""
+
+    def __init__(self, message, record_not_created):
+        super().__init__(message)
+        self.record_not_created = record_not_created
+
+
+def _post_chat_message_to_knack(student_obj10_id, sender, message_text, current_timestamp_knack_format, raise_errors=False):
+    """
+    Creates the Object_118 record in Knack. Returns the new record id, or None on failure.
+    With raise_errors a failure raises ChatMessagePostError instead, saying whether the record may exist.
+    """
+
     # --- Knack Field Mappings for Object_118 (AIChatLog) ---
     # Object Key: object_118
     # field_3275: Tutor Report Conversation (Connection to Object_10)
@@ -2295,26 +4949,10 @@ def save_chat_message_to_knack(student_obj10_id, sender, message_text):
 
     knack_object_key_chatlog = "object_118"
     
-    # 1. Fetch the Object_10 record to get the connection to Object_6 (Student)
-    student_object_6_id = None
-    if student_obj10_id:
-        object_10_record = get_knack_record("object_10", record_id=student_obj10_id)
-        if object_10_record and isinstance(object_10_record, dict): # specific record fetch returns dict directly
-            # field_132 in Object_10 is 'Student' connecting to Object_6 'Students'
-            student_connection_raw = object_10_record.get("field_132_raw")
-            if isinstance(student_connection_raw, list) and student_connection_raw:
-                student_object_6_id = student_connection_raw[0].get('id')
-                app.logger.info(f"Found student Object_6 ID: {student_object_6_id} from Object_10.field_132_raw")
-            else:
-                app.logger.warning(f"Could not extract student Object_6 ID from Object_10 record's field_132_raw. Data: {student_connection_raw}")
-        else:
-            app.logger.warning(f"Could not fetch Object_10 record for ID: {student_obj10_id} to get student connection.")
+    # 1. Resolve the connection to Object_6 (Student) from Object_10 (cached identity mapping)
+    student_object_6_id = get_student_object6_id(student_obj10_id)
 
-    # 2. Prepare current timestamp for Knack
-    # Knack often prefers 'MM/DD/YYYY HH:MM:SS AM/PM' or ISO 8601. Let's try ISO.
-    # Or, if Knack field is Date/Time, often 'MM/DD/YYYY HH:mm' is fine.
-    # Let's use a common format Knack usually accepts for Date/Time fields.
-    current_timestamp_knack_format = datetime.now().strftime('%d/%m/%Y %H:%M:%S')
+    # 2. The timestamp (dd/mm/yyyy HH:MM:SS) is taken by the caller when the message was sent.
 
     payload = {
         "field_3275": student_obj10_id, 
@@ -2330,42 +4968,58 @@ def save_chat_message_to_knack(student_obj10_id, sender, message_text):
     else:
         app.logger.warning(f"student_object_6_id is None for Object_10 ID {student_obj10_id}. Chat log will not be linked to Object_6.")
 
-    headers = {
-        'X-Knack-Application-Id': KNACK_APP_ID,
-        'X-Knack-REST-API-Key': KNACK_API_KEY,
-        'Content-Type': 'application/json'
-    }
-    url = f"{KNACK_BASE_URL}/{knack_object_key_chatlog}/records"
+    knack_client = get_knack_client()
+    if not knack_client:
+        if raise_errors:
+            raise ChatMessagePostError("Knack API is not configured", record_not_created=True)
+        return None
 
     try:
         app.logger.info(f"Saving chat message to Knack ({knack_object_key_chatlog}). Payload: {payload}")
-        response = requests.post(url, headers=headers, json=payload)
+        response = knack_client.post(knack_object_key_chatlog, payload)
         response.raise_for_status()
         saved_record = response.json()
         app.logger.info(f"Successfully saved chat message to Knack. Record ID: {saved_record.get('id')}")
+        if raise_errors and not saved_record.get('id'):
+            raise ChatMessagePostError("Knack did not return a record id", record_not_created=False)
         return saved_record.get('id')
     except requests.exceptions.HTTPError as e:
         app.logger.error(f"HTTP error saving chat message to Knack: {e}")
         app.logger.error(f"Response content: {response.content}")
+        # Knack turns away requests it does not process with a 4xx (429 included); a 5xx may follow the insert.
+        failure = ChatMessagePostError(e, record_not_created=response.status_code < 500)
     except requests.exceptions.RequestException as e:
         app.logger.error(f"Request exception saving chat message to Knack: {e}")
-    except json.JSONDecodeError:
+        failure = ChatMessagePostError(e, record_not_created=knack_request_was_not_sent(e))
+    except json.JSONDecodeError as e:
         app.logger.error(f"JSON decode error for Knack response when saving chat. Response: {response.text}")
+        failure = ChatMessagePostError(e, record_not_created=False)
+    if raise_errors:
+        raise failure
     return None
 
-# --- API Endpoint for Updating Chat Like Status ---
-@app.route('/api/v1/update_chat_like', methods=['POST'])
-def update_chat_like():
-    data = request.get_json()
-    app.logger.info(f"Received request for /api/v1/update_chat_like with data: {data}")
-
-    message_knack_id = data.get('message_id')
-    is_liked_status = data.get('is_liked') # This should be a boolean true/false
 
-    if not message_knack_id or is_liked_status is None:
-        app.logger.error("update_chat_like: Missing message_id or is_liked status.")
-        return jsonify({"error": "Missing message_id or is_liked status"}), 400
+def find_chat_message_in_knack(student_obj10_id, sender, message_timestamp):
+    """
+    Looks for the Object_118 record a journaled message may already have created, by student, sender and
+    field_3276 (stamped to the second when the message was sent). Returns (record_id or None, lookup_ok).
+    """
+    filters = {'match': 'and', 'rules': [
+        {'field': 'field_3275', 'operator': 'is', 'value': student_obj10_id},
+        {'field': 'field_3273', 'operator': 'is', 'value': sender}]}
+    response = get_knack_record("object_118", filters=filters, rows_per_page=KNACK_ROWS_PER_PAGE,
+                                sort_field='field_3276', sort_order='desc')
+    if not (response and isinstance(response, dict) and isinstance(response.get('records'), list)):
+        return None, False
+    message_time = parse_knack_chat_timestamp(message_timestamp)
+    for record in response['records']:
+        if parse_knack_chat_timestamp(record.get('field_3276')) == message_time:
+            return record.get('id'), True
+    return None, True
 
+# --- API Endpoint for Updating Chat Like Status ---
+def update_chat_like_in_knack(message_knack_id, is_liked_status):
+    """Sets field_3279 (Liked) on an Object_118 record. Returns the updated record, or None on failure."""
     # Convert boolean to Knack's expected Yes/No string for field_3279
     knack_liked_value = "Yes" if is_liked_status else "No"
 
@@ -2374,97 +5028,214 @@ def update_chat_like():
         "field_3279": knack_liked_value
     }
 
-    headers = {
-        'X-Knack-Application-Id': KNACK_APP_ID,
-        'X-Knack-REST-API-Key': KNACK_API_KEY,
-        'Content-Type': 'application/json'
-    }
-    url = f"{KNACK_BASE_URL}/{knack_object_key_chatlog}/records/{message_knack_id}"
+    knack_client = get_knack_client()
+    if not knack_client:
+        return None
 
     try:
         app.logger.info(f"Updating chat message like status in Knack ({knack_object_key_chatlog}, record: {message_knack_id}). Payload: {payload}")
-        response = requests.put(url, headers=headers, json=payload) # Use PUT for updates
+        response = knack_client.put(knack_object_key_chatlog, message_knack_id, payload) # Use PUT for updates
         response.raise_for_status()
         updated_record = response.json()
         app.logger.info(f"Successfully updated like status for chat message. Record: {updated_record}")
-        return jsonify({"success": True, "message": "Like status updated", "record": updated_record}), 200
+        return updated_record
     except requests.exceptions.HTTPError as e:
         app.logger.error(f"HTTP error updating like status in Knack: {e}")
         app.logger.error(f"Response content: {response.content}")
-        return jsonify({"error": "Failed to update like status in Knack", "details": str(e)}), 500
     except requests.exceptions.RequestException as e:
         app.logger.error(f"Request exception updating like status in Knack: {e}")
-        return jsonify({"error": "Failed to communicate with Knack API", "details": str(e)}), 500
     except json.JSONDecodeError:
         app.logger.error(f"JSON decode error for Knack response when updating like status. Response: {response.text}")
-        return jsonify({"error": "Invalid response from Knack API"}), 500
+    return None
+
+def unresolved_local_id_response(local_id):
+    """
+    Response for a journal local id with no row here. Either another journal issued it (a server instance
+    that does not share CHAT_JOURNAL_PATH with this one), or this journal already pruned it after it was
+    saved. In both cases the message's Knack id comes from reloading chat history.
+    """
+    if CHAT_JOURNAL is not None and CHAT_JOURNAL.issued_local_id(local_id):
+        return jsonify({"error": f"Message {local_id} was saved and its local id has expired; reload chat history for its Knack id.",
+                        "message_id": local_id, "status": "expired"}), 410
+    app.logger.warning(f"Local message id {local_id} was issued by another server instance's chat journal.")
+    return jsonify({"error": f"Message {local_id} was journaled by another server instance; reload chat history for its Knack id.",
+                    "message_id": local_id, "status": "other_instance"}), 409
+
+@app.route('/api/v1/update_chat_like', methods=['POST'])
+def update_chat_like():
+    data = request.get_json()
+    app.logger.info(f"Received request for /api/v1/update_chat_like with data: {data}")
+
+    message_knack_id = data.get('message_id')
+    is_liked_status = data.get('is_liked') # This should be a boolean true/false
+
+    if not message_knack_id or is_liked_status is None:
+        app.logger.error("update_chat_like: Missing message_id or is_liked status.")
+        return jsonify({"error": "Missing message_id or is_liked status"}), 400
+
+    if ChatMessageJournal.is_local_id(message_knack_id):
+        # The message may still be waiting in the write-behind journal.
+        journal_row = CHAT_JOURNAL.get(message_knack_id) if CHAT_JOURNAL is not None else None
+        if not journal_row:
+            return unresolved_local_id_response(message_knack_id)
+        saved_knack_id = CHAT_JOURNAL.set_pending_like(message_knack_id, is_liked_status)
+        if not saved_knack_id:
+            # The journal applies the like right after the message is saved.
+            mirror_chat_update("set_liked", message_knack_id, is_liked_status)
+            app.logger.info(f"Queued like status {is_liked_status} for journaled chat message {message_knack_id}.")
+            return jsonify({"success": True, "message": "Like status queued until the message is saved", "queued": True}), 202
+        message_knack_id = saved_knack_id
+
+    if not get_knack_client():
+        return jsonify({"error": "Knack API is not configured"}), 500
+
+    updated_record = update_chat_like_in_knack(message_knack_id, is_liked_status)
+    if updated_record is None:
+        return jsonify({"error": "Failed to update like status in Knack"}), 500
+    mirror_chat_update("set_liked", message_knack_id, is_liked_status)
+    return jsonify({"success": True, "message": "Like status updated", "record": updated_record}), 200
+
+@app.route('/api/v1/chat_message_status/<message_id>', methods=['GET'])
+def chat_message_status(message_id):
+    """Follow-up for journaled messages: reports whether a local id has reached Knack and its record id."""
+    if not ChatMessageJournal.is_local_id(message_id):
+        return jsonify({"message_id": message_id, "status": "saved", "knack_id": message_id}), 200
+    journal_row = CHAT_JOURNAL.get(message_id) if CHAT_JOURNAL is not None else None
+    if not journal_row:
+        return unresolved_local_id_response(message_id)
+    return jsonify({
+        "message_id": message_id,
+        "status": "pending" if journal_row["status"] in ("flushing", "unknown") else journal_row["status"],
+        "knack_id": journal_row["knack_id"],
+        "attempts": journal_row["attempts"]
+    }), 200
 
 # --- API Endpoint for Fetching Chat History ---
+# Knack stores field_3276 (Message Timestamp) in this format.
+KNACK_CHAT_TIMESTAMP_FORMAT = '%d/%m/%Y %H:%M:%S'
+# Upper bound on Knack pages scanned to fill one chat history page (only reached when many
+# messages share the cursor's day, since the 'is before' filter is day-granular).
+CHAT_HISTORY_MAX_SCAN_PAGES = 5
+
+def parse_knack_chat_timestamp(ts_str):
+    """Parses a field_3276 value; unparseable or missing timestamps sort as the oldest possible."""
+    if not ts_str:
+        return datetime.min
+    try:
+        return datetime.strptime(ts_str, KNACK_CHAT_TIMESTAMP_FORMAT)
+    except ValueError:
+        app.logger.warning(f"Could not parse Knack timestamp: {ts_str}. Using fallback date for sorting.")
+        return datetime.min
+
+def _chat_record_is_before_cursor(record, cursor_time, cursor_seen_ids):
+    record_time = parse_knack_chat_timestamp(record.get('field_3276'))
+    return record_time < cursor_time or (record_time == cursor_time and record.get('id') not in cursor_seen_ids)
+
+def fetch_chat_history_page(student_obj10_id, page_size, cursor=None):
+    """
+    Returns (records newest first, total_records, has_more, scan_resume) for one page of a student's chat
+    history. Knack sorts by field_3276 descending. With a cursor ({"before": timestamp, "seen_ids": [...]})
+    a day-granular 'is before' filter narrows the query server-side and records at or after the cursor
+    are dropped here; seen_ids covers messages that share the cursor's exact second.
+
+    scan_resume ({"scan_page": n, "rows_per_page": r}, or None) is where a later query with the same
+    cursor day can start scanning, so a busy day is not rescanned from its newest message each time.
+    """
+    base_filters = [{'field': 'field_3275', 'operator': 'is', 'value': student_obj10_id}]
+    query_filters = base_filters
+    cursor_time, cursor_seen_ids = None, set()
+    start_page, rows_per_page = 1, None
+    if cursor:
+        start_page = cursor.get('scan_page') or 1
+        rows_per_page = cursor.get('rows_per_page')
+        cursor_time = parse_knack_chat_timestamp(cursor.get('before'))
+        cursor_seen_ids = set(cursor.get('seen_ids') or [])
+        day_after_cursor = (cursor_time + timedelta(days=1)).strftime('%d/%m/%Y')
+        query_filters = {'match': 'and', 'rules': base_filters + [
+            {'field': 'field_3276', 'operator': 'is before', 'value': day_after_cursor}]}
+
+    page_records = []
+    total_records = None
+    knack_exhausted = False
+    # Page offsets only carry over between queries that use the same rows_per_page.
+    if not rows_per_page:
+        # One extra row is requested so has_more is known without a second round trip.
+        rows_per_page = min(KNACK_ROWS_PER_PAGE, page_size + len(cursor_seen_ids) + 1)
+    last_record_page = knack_page = start_page
+    for knack_page in range(start_page, start_page + CHAT_HISTORY_MAX_SCAN_PAGES):
+        response = get_knack_record("object_118", filters=query_filters, page=knack_page, rows_per_page=rows_per_page,
+                                    sort_field='field_3276', sort_order='desc')
+        if not (response and isinstance(response, dict) and isinstance(response.get('records'), list)):
+            if knack_page == start_page:
+                return None, 0, False, None
+            break
+        if total_records is None:
+            total_records = response.get('total_records', len(response['records']))
+        candidates = response['records']
+        if cursor_time is not None:
+            candidates = [record for record in candidates if _chat_record_is_before_cursor(record, cursor_time, cursor_seen_ids)]
+        if len(page_records) < page_size and candidates:
+            last_record_page = knack_page
+        page_records.extend(candidates)
+        if len(page_records) > page_size:
+            break
+        if knack_page >= int(response.get('total_pages') or 1):
+            knack_exhausted = True
+            break
+
+    has_more = len(page_records) > page_size or not knack_exhausted
+    # Every row before the page holding the last returned record is newer than it. With nothing
+    # returned, the whole scan was newer than the cursor and the next scan carries on after it.
+    scan_resume = {"scan_page": last_record_page if page_records else knack_page + 1, "rows_per_page": rows_per_page}
+    return page_records[:page_size], total_records or 0, has_more, scan_resume if cursor else None
+
+def count_student_chat_records(student_obj10_id):
+    """Total Object_118 messages for a student, from Knack's total_records on a one-row page."""
+    response = get_knack_record("object_118", filters=[{'field': 'field_3275', 'operator': 'is', 'value': student_obj10_id}],
+                                page=1, rows_per_page=1)
+    if response and isinstance(response, dict):
+        return response.get('total_records', 0)
+    return 0
+
 @app.route('/api/v1/chat_history', methods=['POST'])
 def get_chat_history():
     data = request.get_json()
     app.logger.info(f"Received request for /api/v1/chat_history with data: {data}")
 
     student_obj10_id = data.get('student_object10_record_id')
-    max_messages = data.get('max_messages', 50)
-    # days_back = data.get('days_back', 30) # We'll sort by date and take latest, days_back is complex with Knack filters
+    try:
+        max_messages = max(1, min(int(data.get('max_messages', 50)), KNACK_ROWS_PER_PAGE - 1))
+    except (TypeError, ValueError):
+        return jsonify({"error": "max_messages must be an integer"}), 400
+    # Infinite scroll: pass back the previous response's next_cursor to load older messages.
+    cursor = data.get('cursor')
     include_metadata = data.get('include_metadata', True) # Assumed true by frontend
 
     if not student_obj10_id:
         app.logger.error("get_chat_history: Missing student_object10_record_id.")
         return jsonify({"error": "Missing student_object10_record_id"}), 400
-
-    knack_object_key_chatlog = "object_118"
-    filters = [
-        {'field': 'field_3275', 'operator': 'is', 'value': student_obj10_id}
-    ]
-    # Knack sort order: field_key | direction (asc/desc)
-    sort_order = 'field_3276|desc' # Sort by Message Timestamp descending (latest first)
-
-    # Fetch records using a potentially modified get_all_knack_records or a specific fetch for this
-    # For now, let's assume get_knack_record can handle sort and limit if we adapt it slightly
-    # or we fetch a larger set and process. get_all_knack_records fetches all, then we sort/slice.
-
-    app.logger.info(f"Fetching chat history for {student_obj10_id} from {knack_object_key_chatlog} with filters: {filters} and sort: {sort_order}")    
-    
-    # Knack API v1 doesn't directly support `sort` in GET /records, only `sort_field` and `sort_order`
-    # and `rows_per_page` for limiting. We might need to fetch more and sort in Python if complex sorting is needed.
-    # However, for simple sort by one field, we can try to use the Knack parameters.
-    
-    # Let's use get_knack_record and fetch up to a reasonable number (e.g. 2*max_messages) and then sort and slice in Python
-    # as Knack's direct sorting in query params can be tricky with all record fetching.
-    # For simplicity, we will fetch all records for the student and then sort/slice.
-    # This might be inefficient for students with vast histories, but aligns with the 50 record idea.
-    
-    all_student_chats_response = get_knack_record(
-        knack_object_key_chatlog, 
-        filters=filters, 
-        page=1, # Start with page 1
-        rows_per_page=max_messages * 2 # Fetch a bit more to ensure we have enough after potential filtering, max 1000 for Knack
-    )
-
-    all_student_chat_records = []
-    if all_student_chats_response and isinstance(all_student_chats_response, dict) and 'records' in all_student_chats_response:
-        all_student_chat_records = all_student_chats_response['records']
-        app.logger.info(f"Fetched initial {len(all_student_chat_records)} chat records for student {student_obj10_id}.")
+    if cursor is not None and not (isinstance(cursor, dict) and cursor.get('before')
+                                   and all(isinstance(cursor.get(key, 1), int) and cursor.get(key, 1) > 0
+                                           for key in ('scan_page', 'rows_per_page'))):
+        return jsonify({"error": "cursor must be the next_cursor object returned by a previous chat_history call"}), 400
+
+    student_liked_count = None
+    scan_resume = None
+    if CHAT_MIRROR is not None and CHAT_MIRROR.ensure_synced(student_obj10_id):
+        app.logger.info(f"Serving chat history for {student_obj10_id} from the local mirror (page size {max_messages}, cursor {cursor}).")
+        recent_chat_records, has_more = CHAT_MIRROR.history_page(student_obj10_id, max_messages, cursor)
+        total_chat_count_for_student, student_liked_count = CHAT_MIRROR.counts(student_obj10_id)
     else:
-        app.logger.warning(f"No chat records found or unexpected response format for student {student_obj10_id}. Response: {all_student_chats_response}")
-        return jsonify({"chat_history": [], "total_count": 0, "liked_count": 0, "summary": "No chat history found."}), 200
-
-    # Sort the records by timestamp (field_3276) in descending order (latest first)
-    # Knack date format is dd/mm/yyyy HH:MM:SS. Need to parse this for correct sorting.
-    def get_datetime_from_knack_timestamp(ts_str):
-        if not ts_str: return datetime.min
-        try:
-            return datetime.strptime(ts_str, '%d/%m/%Y %H:%M:%S')
-        except ValueError:
-            app.logger.warning(f"Could not parse Knack timestamp: {ts_str}. Using fallback date for sorting.")
-            return datetime.min # Fallback for unparseable dates
-
-    all_student_chat_records.sort(key=lambda r: get_datetime_from_knack_timestamp(r.get('field_3276')), reverse=True)
+        app.logger.info(f"Fetching chat history for {student_obj10_id} from object_118 sorted by field_3276 desc (page size {max_messages}, cursor {cursor}).")
+        recent_chat_records, total_chat_count_for_student, has_more, scan_resume = fetch_chat_history_page(student_obj10_id, max_messages, cursor)
 
-    # Slice to get the actual max_messages
-    recent_chat_records = all_student_chat_records[:max_messages]
+        if recent_chat_records is None:
+            app.logger.warning(f"No chat records found or unexpected response format for student {student_obj10_id}.")
+            return jsonify({"chat_history": [], "total_count": 0, "liked_count": 0, "summary": "No chat history found.",
+                            "next_cursor": None, "has_more": False}), 200
+        if cursor:
+            # total_records of a cursor query only counts older messages; report the student's full total.
+            total_chat_count_for_student = count_student_chat_records(student_obj10_id)
 
     chat_history_for_frontend = []
     liked_count = 0
@@ -2481,27 +5252,179 @@ def get_chat_history():
             "timestamp": record.get('field_3276') # Keep original timestamp for display if needed
         })
     
-    # Reverse again to have chronological order for display (oldest of the recent batch first)
+    # Reverse to have chronological order for display (oldest of the recent batch first)
     chat_history_for_frontend.reverse()
 
+    next_cursor = None
+    if has_more and recent_chat_records:
+        oldest_timestamp = recent_chat_records[-1].get('field_3276')
+        seen_at_oldest = [record.get('id') for record in recent_chat_records if record.get('field_3276') == oldest_timestamp]
+        if cursor and cursor.get('before') == oldest_timestamp:
+            seen_at_oldest = list(set(seen_at_oldest) | set(cursor.get('seen_ids') or []))
+        next_cursor = {"before": oldest_timestamp, "seen_ids": seen_at_oldest}
+        # Knack page offsets stay valid while the next query filters on the same day.
+        if scan_resume and parse_knack_chat_timestamp(oldest_timestamp).date() == parse_knack_chat_timestamp(cursor.get('before')).date():
+            next_cursor.update(scan_resume)
+    elif has_more and scan_resume:
+        # The whole scan was newer than the cursor (a busy day): continue further into that day.
+        next_cursor = dict(cursor, **scan_resume)
+
     # Summary: Use the one from Object_10, field_3271 if available
-    # This requires fetching the Object_10 record again, or passing it if available elsewhere
     summary_text = "Could not load conversation summary."
     object_10_record_for_summary = get_knack_record("object_10", record_id=student_obj10_id)
     if object_10_record_for_summary and isinstance(object_10_record_for_summary, dict):
         summary_text = object_10_record_for_summary.get("field_3271", "No summary available in Object_10.")
-    
-    total_chat_count_for_student = len(all_student_chat_records) # This is the count before slicing for max_messages
 
-    app.logger.info(f"Returning {len(chat_history_for_frontend)} messages for chat history. Total for student: {total_chat_count_for_student}. Liked: {liked_count}")
+    app.logger.info(f"Returning {len(chat_history_for_frontend)} messages for chat history. Total for student: {total_chat_count_for_student}. Liked: {liked_count}. More: {has_more}")
     return jsonify({
         "chat_history": chat_history_for_frontend,
-        "total_count": total_chat_count_for_student, # Total messages for this student
-        "liked_count": liked_count,
-        "summary": summary_text
+        "total_count": total_chat_count_for_student, # Total messages for this student (Knack total_records)
+        "liked_count": student_liked_count if student_liked_count is not None else liked_count, # All liked messages when served from the mirror
+        "summary": summary_text,
+        "next_cursor": next_cursor,
+        "has_more": has_more
     }), 200
 
 # --- API Endpoint for Clearing Old Chats ---
+class ChatClearJobStore(SQLiteStore):
+    """Status and progress of background clear_old_chats jobs, readable from every worker."""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self._connection().execute("""CREATE TABLE IF NOT EXISTS chat_clear_jobs (
+            job_id TEXT PRIMARY KEY,
+            student_obj10_id TEXT NOT NULL,
+            status TEXT NOT NULL,
+            total_to_delete INTEGER NOT NULL,
+            deleted_count INTEGER NOT NULL DEFAULT 0,
+            failed_count INTEGER NOT NULL DEFAULT 0,
+            remaining_count INTEGER NOT NULL,
+            history_truncated INTEGER NOT NULL DEFAULT 0,
+            deleted_ids TEXT,
+            error TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL)""")
+        self._connection().execute("CREATE INDEX IF NOT EXISTS chat_clear_jobs_student ON chat_clear_jobs (student_obj10_id, status)")
+
+    def create_unless_active(self, student_obj10_id, total_to_delete, remaining_count, history_truncated):
+        """
+        Queues a job unless the student already has an active one, in a single transaction so two
+        workers cannot both create one. Returns (job_id, created); job_id is the active job when not created.
+        """
+        with self.transaction() as conn:
+            active_job_id = self._active_job_for(conn, student_obj10_id)
+            if active_job_id:
+                return active_job_id, False
+            job_id = uuid.uuid4().hex
+            now = time.time()
+            conn.execute(
+                "INSERT INTO chat_clear_jobs (job_id, student_obj10_id, status, total_to_delete, remaining_count, history_truncated, created_at, updated_at) "
+                "VALUES (?, ?, 'queued', ?, ?, ?, ?, ?)",
+                (job_id, student_obj10_id, total_to_delete, remaining_count, 1 if history_truncated else 0, now, now))
+        return job_id, True
+
+    def active_job_for(self, student_obj10_id):
+        return self._active_job_for(self._connection(), student_obj10_id)
+
+    @staticmethod
+    def _active_job_for(conn, student_obj10_id):
+        row = conn.execute(
+            "SELECT job_id FROM chat_clear_jobs WHERE student_obj10_id = ? AND status IN ('queued', 'running') AND updated_at > ? "
+            "ORDER BY created_at DESC LIMIT 1", (student_obj10_id, time.time() - CHAT_CLEAR_JOB_STALE_SECONDS)).fetchone()
+        return row["job_id"] if row else None
+
+    def update(self, job_id, **changes):
+        changes["updated_at"] = time.time()
+        assignments = ", ".join(f"{column} = ?" for column in changes)
+        self._connection().execute(f"UPDATE chat_clear_jobs SET {assignments} WHERE job_id = ?", list(changes.values()) + [job_id])
+
+    def record_progress(self, job_id, deleted, failed):
+        self._connection().execute(
+            "UPDATE chat_clear_jobs SET deleted_count = deleted_count + ?, failed_count = failed_count + ?, "
+            "remaining_count = remaining_count - ?, updated_at = ? WHERE job_id = ?",
+            (deleted, failed, deleted, time.time(), job_id))
+
+    def get(self, job_id):
+        row = self._connection().execute("SELECT * FROM chat_clear_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["history_truncated"] = bool(job["history_truncated"])
+        job["deleted_ids"] = json.loads(job["deleted_ids"]) if job["deleted_ids"] else []
+        if job["status"] in ("queued", "running") and time.time() - job["updated_at"] > CHAT_CLEAR_JOB_STALE_SECONDS:
+            job["status"] = "interrupted"
+        return job
+
+
+CHAT_CLEAR_JOBS = ChatClearJobStore(CHAT_CLEAR_JOBS_PATH)
+CHAT_CLEAR_JOB_EXECUTOR = ThreadPoolExecutor(max_workers=CHAT_CLEAR_MAX_CONCURRENT_JOBS, thread_name_prefix="chat-clear-job")
+CHAT_CLEAR_DELETE_EXECUTOR = ThreadPoolExecutor(max_workers=CHAT_CLEAR_DELETE_WORKERS, thread_name_prefix="chat-clear-delete")
+
+
+def fetch_chat_index_from_knack(student_obj10_id):
+    """
+    Streams the student's Object_118 records and keeps only id, timestamp and liked for each.
+    Knack's records API cannot project fields, so full pages are downloaded but dropped page by page.
+    Returns (records, history_truncated).
+    """
+    filters = [{'field': 'field_3275', 'operator': 'is', 'value': student_obj10_id}]
+    page_stream = KnackPageStream("object_118", filters=filters, max_pages=50, prefetch_pages=KNACK_PAGE_FETCH_WORKERS)
+    chat_index = []
+    for page_records in page_stream:
+        chat_index.extend({"id": record.get('id'), "field_3276": record.get('field_3276'), "field_3279": record.get('field_3279')}
+                          for record in page_records)
+    if page_stream.truncated:
+        app.logger.warning(f"clear_old_chats: chat history for student {student_obj10_id} was truncated ({page_stream.truncation_reason}); only {len(chat_index)} of {page_stream.total_records} records were considered.")
+    return chat_index, page_stream.truncated
+
+
+def chat_clear_sort_key(record):
+    """Oldest first. Missing or unparseable timestamps sort last, so they are never the first deleted."""
+    try:
+        return datetime.strptime(record.get('field_3276'), KNACK_CHAT_TIMESTAMP_FORMAT)
+    except (TypeError, ValueError):
+        return datetime.max
+
+
+def delete_chat_record(record_id):
+    """Deletes one Object_118 record. A record that is already gone counts as deleted."""
+    knack_client = get_knack_client()
+    if not knack_client:
+        return False
+    try:
+        response = knack_client.delete("object_118", record_id)
+        if response.status_code == 404:
+            app.logger.info(f"Chat record {record_id} was already deleted.")
+            return True
+        response.raise_for_status()
+        app.logger.info(f"Successfully deleted chat record ID: {record_id}")
+        return True
+    except requests.exceptions.HTTPError as e:
+        app.logger.error(f"HTTP error deleting chat record {record_id}: {e}. Response: {response.content}")
+    except requests.exceptions.RequestException as e:
+        app.logger.error(f"Request exception deleting chat record {record_id}: {e}")
+    return False
+
+
+def run_chat_clear_job(job_id, student_obj10_id, record_ids):
+    """Deletes record_ids on the shared delete pool, recording progress as each delete completes."""
+    CHAT_CLEAR_JOBS.update(job_id, status="running")
+    deleted_ids = []
+    try:
+        delete_futures = {CHAT_CLEAR_DELETE_EXECUTOR.submit(delete_chat_record, record_id): record_id for record_id in record_ids}
+        for future in as_completed(delete_futures):
+            deleted = future.result()
+            if deleted:
+                deleted_ids.append(delete_futures[future])
+                mirror_chat_update("delete_records", [delete_futures[future]])
+            CHAT_CLEAR_JOBS.record_progress(job_id, 1 if deleted else 0, 0 if deleted else 1)
+        CHAT_CLEAR_JOBS.update(job_id, status="complete", deleted_ids=json.dumps(deleted_ids))
+        app.logger.info(f"Clear old chats job {job_id} for student {student_obj10_id} deleted {len(deleted_ids)} of {len(record_ids)} chats.")
+    except Exception as e:
+        app.logger.error(f"Clear old chats job {job_id} for student {student_obj10_id} failed: {e}")
+        CHAT_CLEAR_JOBS.update(job_id, status="failed", error=str(e)[:500], deleted_ids=json.dumps(deleted_ids))
+
+
 @app.route('/api/v1/clear_old_chats', methods=['POST'])
 def clear_old_chats():
     data = request.get_json()
@@ -2514,72 +5437,222 @@ def clear_old_chats():
     if not student_obj10_id:
         app.logger.error("clear_old_chats: Missing student_object10_record_id.")
         return jsonify({"error": "Missing student_object10_record_id"}), 400
-
-    knack_object_key_chatlog = "object_118"
-    filters = [
-        {'field': 'field_3275', 'operator': 'is', 'value': student_obj10_id}
-    ]
-
-    # Fetch ALL chat records for the student
-    all_chats_for_student = get_all_knack_records(knack_object_key_chatlog, filters=filters, max_pages=50) # Limit pages to prevent runaway
+    if not get_knack_client():
+        return jsonify({"error": "Knack API is not configured"}), 500
+
+    # Cheap early answer; create_unless_active below is what actually stops a second job.
+    active_job_id = CHAT_CLEAR_JOBS.active_job_for(student_obj10_id)
+    if active_job_id:
+        return active_chat_clear_job_response(student_obj10_id, active_job_id)
+
+    if CHAT_MIRROR is not None and CHAT_MIRROR.ensure_synced(student_obj10_id):
+        # The mirror already holds the student's messages sorted by timestamp; unsaved journal rows are not deletable yet.
+        all_chats_for_student = CHAT_MIRROR.chat_index_oldest_first(student_obj10_id)
+        history_truncated = CHAT_MIRROR.is_truncated(student_obj10_id)
+    else:
+        all_chats_for_student, history_truncated = fetch_chat_index_from_knack(student_obj10_id)
 
     if not all_chats_for_student:
         app.logger.info(f"No chat records found for student {student_obj10_id} to clear.")
         return jsonify({"message": "No chats to clear.", "deleted_count": 0, "remaining_count": 0}), 200
 
-    # Sort by timestamp ascending (oldest first)
-    def get_datetime_from_knack_timestamp_for_clear(ts_str):
-        if not ts_str: return datetime.max # Sort None/empty to the end if sorting ascending
-        try:
-            return datetime.strptime(ts_str, '%d/%m/%Y %H:%M:%S')
-        except ValueError:
-            return datetime.max
-            
-    all_chats_for_student.sort(key=lambda r: get_datetime_from_knack_timestamp_for_clear(r.get('field_3276')))
-
+    all_chats_for_student.sort(key=chat_clear_sort_key)
     num_to_delete = len(all_chats_for_student) - target_count_after_clear
-    deleted_count = 0
-    actual_records_deleted_ids = []
-
-    if num_to_delete > 0:
-        app.logger.info(f"Need to delete {num_to_delete} chats for student {student_obj10_id} to reach target of {target_count_after_clear}.")
-        delete_candidates = []
-        for record in all_chats_for_student:
-            if keep_liked and record.get('field_3279') == "Yes":
-                continue # Skip liked messages
+    if num_to_delete <= 0:
+        app.logger.info(f"No chats need to be deleted for student {student_obj10_id}. Current count: {len(all_chats_for_student)}, Target: {target_count_after_clear}.")
+        return jsonify({"message": "No chats need to be cleared.", "deleted_count": 0, "remaining_count": len(all_chats_for_student),
+                        "deleted_ids": [], "history_truncated": history_truncated}), 200
+
+    app.logger.info(f"Need to delete {num_to_delete} chats for student {student_obj10_id} to reach target of {target_count_after_clear}.")
+    delete_candidates = []
+    for record in all_chats_for_student:
+        if keep_liked and record.get('field_3279') == "Yes":
+            continue # Skip liked messages
+        if record.get('pending'):
+            continue # Still in the write-behind journal, not in Knack yet
+        if record.get('id'):
             delete_candidates.append(record.get('id'))
-        
-        # Delete from the oldest of the candidates
-        records_to_actually_delete_ids = delete_candidates[:num_to_delete]
 
-        headers = {
-            'X-Knack-Application-Id': KNACK_APP_ID,
-            'X-Knack-REST-API-Key': KNACK_API_KEY
-        }
+    # Delete from the oldest of the candidates
+    records_to_actually_delete_ids = delete_candidates[:num_to_delete]
+    expected_remaining_count = len(all_chats_for_student) - len(records_to_actually_delete_ids)
+    job_id, created = CHAT_CLEAR_JOBS.create_unless_active(student_obj10_id, len(records_to_actually_delete_ids),
+                                                           len(all_chats_for_student), history_truncated)
+    if not created:
+        return active_chat_clear_job_response(student_obj10_id, job_id)
+    CHAT_CLEAR_JOB_EXECUTOR.submit(run_chat_clear_job, job_id, student_obj10_id, records_to_actually_delete_ids)
+
+    # Nothing has been deleted yet: planned_* describe the queued job, and the real deleted/failed
+    # counts and deleted_ids are reported by status_url once the job has run.
+    return jsonify({
+        "message": f"Deleting {len(records_to_actually_delete_ids)} unliked chats in the background.",
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": f"/api/v1/clear_old_chats/{job_id}",
+        "planned_count": len(records_to_actually_delete_ids),
+        "planned_ids": records_to_actually_delete_ids,
+        "planned_remaining_count": expected_remaining_count,
+        "history_truncated": history_truncated
+    }), 202
+
+def active_chat_clear_job_response(student_obj10_id, job_id):
+    app.logger.info(f"clear_old_chats: job {job_id} is already running for student {student_obj10_id}.")
+    return jsonify(dict(CHAT_CLEAR_JOBS.get(job_id), message="A clear old chats job is already running for this student.",
+                        status_url=f"/api/v1/clear_old_chats/{job_id}")), 202
+
+@app.route('/api/v1/clear_old_chats/<job_id>', methods=['GET'])
+def clear_old_chats_status(job_id):
+    job = CHAT_CLEAR_JOBS.get(job_id)
+    if not job:
+        return jsonify({"error": f"Unknown job_id {job_id}"}), 404
+    return jsonify(job), 200
+
+# --- API Endpoint for Invalidating Cached Identity Mappings ---
+@app.route('/api/v1/identity_cache/invalidate', methods=['POST'])
+def invalidate_identity_cache():
+    data = request.get_json() or {}
+    app.logger.info(f"Received request for /api/v1/identity_cache/invalidate with data: {data}")
+
+    if data.get('all'):
+        IDENTITY_CACHE.clear()
+        app.logger.info("Cleared all cached identity mappings.")
+        return jsonify({"success": True, "message": "All identity mappings cleared."}), 200
+
+    student_obj10_id = data.get('student_object10_record_id')
+    student_obj3_id = data.get('student_object3_id')
+    if not student_obj10_id and not student_obj3_id:
+        return jsonify({"error": "Provide student_object10_record_id, student_object3_id or all=true"}), 400
+
+    invalidate_student_identity(student_obj10_id, student_obj3_id)
+    return jsonify({"success": True, "message": "Identity mappings invalidated."}), 200
+
+# --- School Averages Pre-warming ---
+PREWARM_STATUS_LOCK = threading.Lock()
+PREWARM_STATUS = {"state": "idle", "total": 0, "completed": 0, "failed": 0, "started_at": None, "finished_at": None}
+
+def list_school_ids_for_prewarm():
+    """Returns the school record ids to warm: PREWARM_SCHOOL_IDS if set, otherwise every record of the school object."""
+    if PREWARM_SCHOOL_IDS:
+        return list(PREWARM_SCHOOL_IDS)
+    school_records = get_all_knack_records(KNACK_SCHOOL_OBJECT_KEY)
+    return [record['id'] for record in school_records if record.get('id')]
+
+def _update_prewarm_status(**changes):
+    with PREWARM_STATUS_LOCK:
+        PREWARM_STATUS.update(changes)
+
+def _count_prewarm_result(counter):
+    with PREWARM_STATUS_LOCK:
+        PREWARM_STATUS[counter] += 1
 
-        for record_id_to_delete in records_to_actually_delete_ids:
-            if not record_id_to_delete: continue
-            delete_url = f"{KNACK_BASE_URL}/{knack_object_key_chatlog}/records/{record_id_to_delete}"
+def prewarm_school_vespa_averages(school_ids=None, workers=PREWARM_WORKERS):
+    """
+    Computes VESPA averages for every school in parallel so the cache is warm before users arrive.
+    Schools already fresh in a shared cache are skipped by get_school_vespa_averages itself.
+    Returns the final status dict.
+    """
+    with PREWARM_STATUS_LOCK:
+        if PREWARM_STATUS["state"] == "running":
+            app.logger.info("School averages pre-warm already running; not starting another.")
+            return dict(PREWARM_STATUS)
+        PREWARM_STATUS.update(state="running", total=0, completed=0, failed=0, started_at=time.time(), finished_at=None)
+
+    try:
+        if school_ids is None:
+            school_ids = list_school_ids_for_prewarm()
+        _update_prewarm_status(total=len(school_ids))
+        app.logger.info(f"Pre-warming school VESPA averages for {len(school_ids)} schools with {workers} workers.")
+
+        def warm_one(school_id):
             try:
-                response = requests.delete(delete_url, headers=headers)
-                response.raise_for_status()
-                app.logger.info(f"Successfully deleted chat record ID: {record_id_to_delete}")
-                deleted_count += 1
-                actual_records_deleted_ids.append(record_id_to_delete)
-            except requests.exceptions.HTTPError as e:
-                app.logger.error(f"HTTP error deleting chat record {record_id_to_delete}: {e}. Response: {response.content}")
-            except requests.exceptions.RequestException as e:
-                app.logger.error(f"Request exception deleting chat record {record_id_to_delete}: {e}")
-    else:
-        app.logger.info(f"No chats need to be deleted for student {student_obj10_id}. Current count: {len(all_chats_for_student)}, Target: {target_count_after_clear}.")
+                averages = get_school_vespa_averages(school_id)
+                _count_prewarm_result("completed" if averages is not None else "failed")
+            except Exception as e:
+                app.logger.error(f"Pre-warm of school VESPA averages for school_id {school_id} failed: {e}")
+                _count_prewarm_result("failed")
+
+        if school_ids:
+            with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="prewarm") as executor:
+                list(executor.map(warm_one, school_ids))
+        _update_prewarm_status(state="complete", finished_at=time.time())
+    except Exception as e:
+        app.logger.error(f"School averages pre-warm failed: {e}")
+        _update_prewarm_status(state="failed", finished_at=time.time())
+
+    with PREWARM_STATUS_LOCK:
+        final_status = dict(PREWARM_STATUS)
+    app.logger.info(f"School averages pre-warm finished: {final_status}")
+    return final_status
+
+def start_prewarm_on_startup():
+    """Honours PREWARM_ON_STARTUP in a worker about to serve traffic. Returns immediately; the warm-up runs in a thread."""
+    if PREWARM_ON_STARTUP in ('blocking', 'background'):
+        # Marked before the thread starts so /api/v1/ready cannot report ready in between.
+        _update_prewarm_status(state="starting")
+        threading.Thread(target=prewarm_school_vespa_averages, name="school-averages-prewarm", daemon=True).start()
+    elif PREWARM_ON_STARTUP != 'off':
+        app.logger.warning(f"Unknown PREWARM_ON_STARTUP '{PREWARM_ON_STARTUP}'. Skipping pre-warm.")
+
+@app.cli.command("prewarm-school-averages")
+@click.option("--school-id", "school_ids", multiple=True, help="School record id to warm. Repeatable; defaults to all schools.")
+@click.option("--workers", default=PREWARM_WORKERS, show_default=True, help="Schools computed in parallel.")
+def prewarm_school_averages_command(school_ids, workers):
+    """Fills the school VESPA averages cache for every school (run after a deploy with a shared cache backend)."""
+    final_status = prewarm_school_vespa_averages(list(school_ids) or None, workers=workers)
+    click.echo(json.dumps(final_status))
+    if final_status["state"] != "complete":
+        raise SystemExit(1)
+
+@app.route('/api/v1/ready', methods=['GET'])
+def readiness():
+    """Readiness probe: with PREWARM_ON_STARTUP=blocking, 503 until the startup pre-warm has finished; 200 otherwise."""
+    with PREWARM_STATUS_LOCK:
+        prewarm_status = dict(PREWARM_STATUS)
+    ready = PREWARM_ON_STARTUP != 'blocking' or prewarm_status["state"] not in ("starting", "running")
+    return jsonify({"ready": ready, "prewarm": prewarm_status}), 200 if ready else 503
+
+# --- API Endpoint for Operational Metrics ---
+def collect_metrics():
+    """Gathers in-process performance counters for this worker."""
+    knack_client = get_knack_client()
+    return {
+        "worker_pid": os.getpid(),
+        "cache_backend": SHARED_CACHE.name,
+        "memory_caches": {
+            "shared": SHARED_CACHE.stats() if isinstance(SHARED_CACHE, MemoryCacheBackend) else None,
+            "parsed_profiles": PARSED_PROFILE_CACHE.stats(),
+        },
+        "knack_client": {
+            "retries": knack_client.retry_count if knack_client else 0,
+            "rate_limiter_wait_seconds": round(knack_client.rate_limiter.total_wait_seconds, 3) if knack_client else 0.0
+        },
+        "request_record_memo": dict(REQUEST_MEMO_STATS),
+        "identity_cache": IDENTITY_CACHE.stats(),
+        "school_averages_refresh": dict(SCHOOL_AVERAGES_REFRESH_STATS),
+        "task_graphs": TaskGraph.collect_stats(),
+        "llm_summary_cache": dict(LLM_SUMMARY_CACHE_STATS),
+        "llm_client": LLM_CLIENT.stats(),
+        "chat_prompt_budget": copy.deepcopy(CHAT_PROMPT_BUDGET_STATS),
+        "chat_journal": CHAT_JOURNAL.stats() if CHAT_JOURNAL is not None else None,
+        "chat_mirror": CHAT_MIRROR.stats() if CHAT_MIRROR is not None else None,
+        "academic_profile_lookup": {"wins": dict(PROFILE_LOOKUP_STATS["wins"]),
+                                    "remembered_strategy_hits": PROFILE_LOOKUP_STATS["remembered_strategy_hits"],
+                                    "not_found": PROFILE_LOOKUP_STATS["not_found"]},
+        "knack_coalescing": {
+            KNACK_RECORD_SINGLEFLIGHT.name: KNACK_RECORD_SINGLEFLIGHT.stats(),
+            KNACK_ALL_RECORDS_SINGLEFLIGHT.name: KNACK_ALL_RECORDS_SINGLEFLIGHT.stats(),
+            SCHOOL_AVERAGES_SINGLEFLIGHT.name: SCHOOL_AVERAGES_SINGLEFLIGHT.stats()
+        }
+    }
 
-    remaining_count = len(all_chats_for_student) - deleted_count
-    return jsonify({
-        "message": f"Clear old chats process completed. Deleted {deleted_count} unliked chats.",
-        "deleted_count": deleted_count,
-        "remaining_count": remaining_count,
-        "deleted_ids": actual_records_deleted_ids
-    }), 200
+@app.route('/api/v1/metrics', methods=['GET'])
+def get_metrics():
+    return jsonify(collect_metrics()), 200
+
+if CHAT_JOURNAL is not None:
+    CHAT_JOURNAL.ensure_flusher() # Picks up anything left unflushed by a previous worker
+if CHAT_MIRROR is not None:
+    CHAT_MIRROR.ensure_reconciler()
 
 if __name__ == '__main__':
     # Ensure the FLASK_ENV is set to development for debug mode if not using `flask run`
@@ -2588,4 +5661,5 @@ if __name__ == '__main__':
     # When running locally with `python app.py`, debug should be True.
     # Heroku will set PORT, and debug should ideally be False in production.
     is_local_run = __name__ == '__main__' and not os.environ.get('DYNO')
+    start_prewarm_on_startup()
     app.run(debug=is_local_run, port=port, host='0.0.0.0') 
\ No newline at end of file
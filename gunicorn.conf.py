@@ -0,0 +1,31 @@
+# Gunicorn settings for the Heroku web dyno (see Procfile).
+#
+# Requests spend almost all their time waiting on Knack and OpenAI, so each worker runs a pool
+# of threads instead of serving one request at a time. The default of 256 threads lets one process
+# hold a few hundred in-flight coaching requests; an idle thread blocked on a socket costs little
+# beyond its stack. Shared state in backend/app.py must therefore be guarded by locks.
+import os
+
+# Exported so the workers, which inherit this environment, size per-worker budgets (e.g. the Knack
+# rate limit and connection pool in backend/app.py) from the worker and thread counts gunicorn uses.
+os.environ.setdefault('WEB_CONCURRENCY', '2')
+os.environ.setdefault('GUNICORN_THREADS', '256')
+workers = int(os.environ['WEB_CONCURRENCY'])
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ['GUNICORN_THREADS'])
+
+# A coaching_suggestions round trip (Knack + LLM) can take well over the 30s default.
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+
+accesslog = '-'
+errorlog = '-'
+
+
+def post_worker_init(worker):
+    # Starts the school averages pre-warm (PREWARM_ON_STARTUP) once the worker has loaded the app.
+    # It runs in a background thread, so it never holds the worker past `timeout`, and importing
+    # backend.app elsewhere (e.g. for `flask` CLI commands) does not trigger it.
+    from backend.app import start_prewarm_on_startup
+    start_prewarm_on_startup()
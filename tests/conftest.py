@@ -0,0 +1,18 @@
+import os
+import sys
+import tempfile
+
+# backend.app reads its configuration at import time; point every on-disk store at a throwaway
+# directory and keep background workers off so importing it in tests has no side effects.
+_TEST_STATE_DIR = tempfile.mkdtemp(prefix="vespa_coach_tests_")
+os.environ.setdefault("CACHE_BACKEND", "memory")
+os.environ.setdefault("CACHE_SQLITE_PATH", os.path.join(_TEST_STATE_DIR, "cache.sqlite3"))
+os.environ.setdefault("LLM_SUMMARY_CACHE_SQLITE_PATH", os.path.join(_TEST_STATE_DIR, "llm_cache.sqlite3"))
+os.environ.setdefault("CHAT_JOURNAL_PATH", os.path.join(_TEST_STATE_DIR, "chat_journal.sqlite3"))
+os.environ.setdefault("CHAT_MIRROR_PATH", os.path.join(_TEST_STATE_DIR, "chat_mirror.sqlite3"))
+os.environ.setdefault("CHAT_CLEAR_JOBS_PATH", os.path.join(_TEST_STATE_DIR, "chat_clear_jobs.sqlite3"))
+os.environ.setdefault("CHAT_JOURNAL_ENABLED", "false")
+os.environ.setdefault("CHAT_MIRROR_ENABLED", "false")
+os.environ.setdefault("PREWARM_ON_STARTUP", "off")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,21 @@
+import json
+
+import backend.app as app_module
+
+
+def test_name_only_profile_match_is_not_cached_or_remembered(monkeypatch):
+    profile = {"id": "obj112_same_name", "field_3066": "Sam Smith",
+               "field_3080": json.dumps({"subject": "Maths", "currentGrade": "B", "targetGrade": "A"})}
+
+    def fake_get_knack_record(object_key, record_id=None, filters=None, **kwargs):
+        if filters and filters[0]["field"] == "field_3066":
+            return {"records": [profile]}
+        return {"records": []}
+
+    monkeypatch.setattr(app_module, "get_knack_record", fake_get_knack_record)
+    app_module.IDENTITY_CACHE.set("obj3_to_obj112_strategy", "obj3_sam", "user_id")
+
+    result = app_module.get_academic_profile("obj3_sam", "Sam Smith", "obj10_sam")
+    assert result["profile_record"] is profile
+    assert app_module.IDENTITY_CACHE.get("obj3_to_obj112", "obj3_sam") is None
+    assert app_module.IDENTITY_CACHE.get("obj3_to_obj112_strategy", "obj3_sam") is None
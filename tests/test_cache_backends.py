@@ -0,0 +1,41 @@
+import pytest
+
+import backend.app as app_module
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def cache_backend(request, tmp_path):
+    if request.param == "memory":
+        return app_module.MemoryCacheBackend()
+    return app_module.SQLiteCacheBackend(str(tmp_path / "cache.sqlite3"))
+
+
+def test_add_is_a_lock_only_its_owner_can_release(cache_backend):
+    locks = app_module.CacheNamespace(cache_backend, "refresh_lock", 300)
+    assert locks.add("school-1", "owner-a")
+    assert not locks.add("school-1", "owner-b")
+
+    assert not locks.delete_if_equal("school-1", "owner-b")
+    assert locks.get("school-1") == "owner-a"
+    assert locks.delete_if_equal("school-1", "owner-a")
+    assert locks.get("school-1") is None
+    assert locks.add("school-1", "owner-b")
+
+
+def test_expired_lock_retaken_by_another_owner_is_not_released_by_the_first(cache_backend):
+    locks = app_module.CacheNamespace(cache_backend, "refresh_lock", 300)
+    assert locks.add("school-1", "owner-a", ttl_seconds=-1)  # Already expired, as if owner-a overran its TTL.
+    assert locks.add("school-1", "owner-b")
+    assert not locks.delete_if_equal("school-1", "owner-a")
+    assert locks.get("school-1") == "owner-b"
+
+
+def test_explicit_zero_ttl_is_not_replaced_by_the_default(cache_backend):
+    entries = app_module.CacheNamespace(cache_backend, "entries", 300)
+    entries.set("kept", "value")
+    entries.set("expires_now", "value", ttl_seconds=0)
+    assert entries.get("kept") == "value"
+    assert entries.get("expires_now") is None
+
+    entries.delete("kept")
+    assert entries.get("kept") is None
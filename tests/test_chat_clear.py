@@ -0,0 +1,61 @@
+import backend.app as app_module
+
+
+STUDENT_ID = "obj10-student"
+
+
+class RecordingExecutor:
+    def __init__(self):
+        self.jobs = []
+
+    def submit(self, fn, *args):
+        self.jobs.append(args)
+
+
+def test_only_one_active_clear_job_is_created_per_student(tmp_path):
+    jobs = app_module.ChatClearJobStore(str(tmp_path / "jobs.sqlite3"))
+    first_job_id, first_created = jobs.create_unless_active(STUDENT_ID, 3, 10, False)
+    second_job_id, second_created = jobs.create_unless_active(STUDENT_ID, 3, 10, False)
+    assert (first_created, second_created) == (True, False)
+    assert second_job_id == first_job_id
+
+
+def test_clear_deletes_oldest_first_keeps_unparseable_timestamps_last_and_reports_ids(tmp_path, monkeypatch):
+    chat_index = [
+        {"id": "no_timestamp", "field_3276": None, "field_3279": "No"},
+        {"id": "garbled", "field_3276": "yesterday-ish", "field_3279": "No"},
+        {"id": "newest", "field_3276": "16/10/2026 09:00:00", "field_3279": "No"},
+        {"id": "oldest", "field_3276": "01/10/2026 09:00:00", "field_3279": "No"},
+        {"id": "middle", "field_3276": "10/10/2026 09:00:00", "field_3279": "No"},
+    ]
+    executor = RecordingExecutor()
+    monkeypatch.setattr(app_module, "CHAT_CLEAR_JOBS", app_module.ChatClearJobStore(str(tmp_path / "jobs.sqlite3")))
+    monkeypatch.setattr(app_module, "CHAT_CLEAR_JOB_EXECUTOR", executor)
+    monkeypatch.setattr(app_module, "get_knack_client", lambda: object())
+    monkeypatch.setattr(app_module, "fetch_chat_index_from_knack", lambda student_obj10_id: (list(chat_index), False))
+
+    with app_module.app.test_client() as client:
+        response = client.post("/api/v1/clear_old_chats", json={"student_object10_record_id": STUDENT_ID, "target_count": 2})
+        repeat = client.post("/api/v1/clear_old_chats", json={"student_object10_record_id": STUDENT_ID, "target_count": 2})
+
+    body = response.get_json()
+    assert response.status_code == 202
+    assert body["planned_ids"] == ["oldest", "middle", "newest"]
+    assert "deleted_ids" not in body and "deleted_count" not in body
+    assert repeat.get_json()["job_id"] == body["job_id"]
+    assert len(executor.jobs) == 1
+
+
+def test_job_status_reports_what_was_actually_deleted(tmp_path, monkeypatch):
+    jobs = app_module.ChatClearJobStore(str(tmp_path / "jobs.sqlite3"))
+    monkeypatch.setattr(app_module, "CHAT_CLEAR_JOBS", jobs)
+    monkeypatch.setattr(app_module, "delete_chat_record", lambda record_id: record_id != "knack_refused")
+    job_id, _ = jobs.create_unless_active(STUDENT_ID, 2, 5, False)
+
+    app_module.run_chat_clear_job(job_id, STUDENT_ID, ["deleted", "knack_refused"])
+    with app_module.app.test_client() as client:
+        job = client.get(f"/api/v1/clear_old_chats/{job_id}").get_json()
+
+    assert job["status"] == "complete"
+    assert (job["deleted_count"], job["failed_count"], job["remaining_count"]) == (1, 1, 4)
+    assert job["deleted_ids"] == ["deleted"]
@@ -0,0 +1,66 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import backend.app as app_module
+
+
+STUDENT_ID = "obj10-student"
+
+
+class PagedChatKnack:
+    """Serves object_118 the way Knack does: filtered on field_3275 and a day-granular 'is before', sorted desc, paged."""
+
+    def __init__(self, monkeypatch, timestamps):
+        self.records = [{"id": f"msg{index:03d}", "field_3275": STUDENT_ID, "field_3273": "Student", "field_3277": f"message {index}",
+                         "field_3276": timestamp.strftime(app_module.KNACK_CHAT_TIMESTAMP_FORMAT)}
+                        for index, timestamp in enumerate(timestamps)]
+        self.pages_read = 0
+        monkeypatch.setattr(app_module, "get_knack_record", self.get_knack_record)
+
+    def get_knack_record(self, object_key, record_id=None, filters=None, page=1, rows_per_page=1000, sort_field=None, sort_order=None):
+        if object_key == "object_10":
+            return {"id": record_id, "field_3271": "summary"}
+        rules = filters["rules"] if isinstance(filters, dict) else filters
+        records = self.records
+        for rule in rules:
+            if rule["operator"] == "is before":
+                day = datetime.strptime(rule["value"], "%d/%m/%Y")
+                records = [record for record in records if app_module.parse_knack_chat_timestamp(record["field_3276"]) < day]
+        records = sorted(records, key=lambda record: (app_module.parse_knack_chat_timestamp(record["field_3276"]), record["id"]), reverse=True)
+        self.pages_read += 1
+        total_pages = max(1, -(-len(records) // rows_per_page))
+        return {"records": records[(page - 1) * rows_per_page:page * rows_per_page],
+                "total_records": len(records), "total_pages": total_pages}
+
+
+def post_chat_history(**payload):
+    with app_module.app.test_client() as client:
+        return client.post("/api/v1/chat_history", json=dict(payload, student_object10_record_id=STUDENT_ID))
+
+
+@pytest.mark.parametrize("max_messages", ["lots", None, [5]])
+def test_invalid_max_messages_is_a_bad_request(monkeypatch, max_messages):
+    PagedChatKnack(monkeypatch, [])
+    response = post_chat_history(max_messages=max_messages)
+    assert response.status_code == 400
+
+
+def test_cursor_keeps_paging_through_a_day_longer_than_the_scan_limit(monkeypatch):
+    busy_day = datetime(2026, 10, 16, 8, 0, 0)
+    timestamps = [busy_day - timedelta(days=1)] + [busy_day + timedelta(seconds=second) for second in range(120)]
+    knack = PagedChatKnack(monkeypatch, timestamps)
+
+    # Jump deep into the busy day so the next query's first CHAT_HISTORY_MAX_SCAN_PAGES pages are all newer.
+    cursor = {"before": knack.records[100]["field_3276"], "seen_ids": ["msg100"]}
+    seen = []
+    for _ in range(100):
+        body = post_chat_history(max_messages=2, cursor=cursor).get_json()
+        seen.extend(message["id"] for message in body["chat_history"])
+        if not body["has_more"]:
+            break
+        assert body["next_cursor"] is not None
+        cursor = body["next_cursor"]
+
+    assert not body["has_more"]
+    assert sorted(seen) == [f"msg{index:03d}" for index in range(100)]  # Every older message once, none skipped.
@@ -0,0 +1,201 @@
+import os
+
+import pytest
+import requests
+from urllib3.exceptions import MaxRetryError, NewConnectionError, ProtocolError
+
+import backend.app as app_module
+
+
+STUDENT_ID = "obj10-student"
+TIMESTAMP = "17/10/2026 09:30:15"
+
+
+@pytest.fixture
+def journal(tmp_path, monkeypatch):
+    journal = app_module.ChatMessageJournal(str(tmp_path / "chat_journal.sqlite3"))
+    journal.flusher_pid = os.getpid()  # Rows are flushed by the test, not a background thread.
+    monkeypatch.setattr(app_module, "update_chat_like_in_knack", lambda knack_id, is_liked: {"id": knack_id})
+    return journal
+
+
+class FakeKnack:
+    """Stands in for the Knack calls the journal makes: each POST pops the next planned outcome."""
+
+    def __init__(self, monkeypatch, post_outcomes, existing_record_id=None, lookup_ok=True):
+        self.post_outcomes = list(post_outcomes)
+        self.existing_record_id = existing_record_id
+        self.lookup_ok = lookup_ok
+        self.posts = 0
+        self.lookups = 0
+        monkeypatch.setattr(app_module, "_post_chat_message_to_knack", self.post)
+        monkeypatch.setattr(app_module, "find_chat_message_in_knack", self.find)
+
+    def post(self, student_obj10_id, sender, message_text, message_timestamp, raise_errors=False):
+        self.posts += 1
+        outcome = self.post_outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    def find(self, student_obj10_id, sender, message_timestamp):
+        self.lookups += 1
+        return self.existing_record_id, self.lookup_ok
+
+
+def make_due(journal, local_id):
+    journal._connection().execute("UPDATE chat_journal SET next_attempt_at = 0 WHERE local_id = ?", (local_id,))
+
+
+def test_saved_message_maps_local_id_to_knack_id_and_applies_pending_like(journal, monkeypatch):
+    knack = FakeKnack(monkeypatch, ["knack-1"])
+    local_id = journal.enqueue(STUDENT_ID, "Student", "Hello", TIMESTAMP)
+    assert journal.set_pending_like(local_id, True) is None
+
+    assert journal.flush_once() == 1
+    row = journal.get(local_id)
+    assert (row["status"], row["knack_id"], row["pending_liked"]) == ("saved", "knack-1", None)
+    assert journal.counters["likes_applied"] == 1
+    assert knack.posts == 1 and knack.lookups == 0
+
+
+def test_post_that_never_reached_knack_is_simply_retried(journal, monkeypatch):
+    knack = FakeKnack(monkeypatch, [app_module.ChatMessagePostError("connect failed", record_not_created=True), "knack-2"])
+    local_id = journal.enqueue(STUDENT_ID, "Student", "Hello", TIMESTAMP)
+
+    journal.flush_once()
+    assert journal.get(local_id)["status"] == "pending"
+    make_due(journal, local_id)
+    journal.flush_once()
+    assert journal.get(local_id)["knack_id"] == "knack-2"
+    assert knack.posts == 2 and knack.lookups == 0
+
+
+def test_post_with_unknown_outcome_is_reconciled_instead_of_reposted(journal, monkeypatch):
+    knack = FakeKnack(monkeypatch, [app_module.ChatMessagePostError("read timeout", record_not_created=False)],
+                      existing_record_id="knack-3")
+    local_id = journal.enqueue(STUDENT_ID, "Student", "Hello", TIMESTAMP)
+
+    journal.flush_once()
+    assert journal.get(local_id)["status"] == "unknown"
+    make_due(journal, local_id)
+    journal.flush_once()
+    assert journal.get(local_id)["knack_id"] == "knack-3"
+    assert knack.posts == 1 and knack.lookups == 1
+    assert journal.counters["reconciled"] == 1
+
+
+def test_unknown_outcome_is_reposted_only_once_knack_confirms_the_record_is_missing(journal, monkeypatch):
+    knack = FakeKnack(monkeypatch, [RuntimeError("worker crashed mid-POST"), "knack-4"], lookup_ok=False)
+    local_id = journal.enqueue(STUDENT_ID, "Student", "Hello", TIMESTAMP)
+
+    journal.flush_once()
+    make_due(journal, local_id)
+    journal.flush_once()  # Knack could not be read: stays unknown without posting.
+    assert journal.get(local_id)["status"] == "unknown"
+    assert knack.posts == 1
+
+    knack.lookup_ok = True
+    make_due(journal, local_id)
+    journal.flush_once()
+    assert journal.get(local_id)["knack_id"] == "knack-4"
+    assert knack.posts == 2 and knack.lookups == 2
+
+
+def test_abandoned_claim_is_reconciled_before_reposting(journal, monkeypatch):
+    knack = FakeKnack(monkeypatch, [], existing_record_id="knack-5")
+    local_id = journal.enqueue(STUDENT_ID, "Student", "Hello", TIMESTAMP)
+    assert journal.claim_next()["local_id"] == local_id
+    assert journal.claim_next() is None  # Claimed rows are not handed to a second flusher.
+
+    journal._connection().execute("UPDATE chat_journal SET claimed_at = 0 WHERE local_id = ?", (local_id,))
+    journal.flush_once()
+    assert journal.get(local_id)["knack_id"] == "knack-5"
+    assert knack.posts == 0
+
+
+def test_saved_rows_are_pruned_after_the_retention_window(journal, monkeypatch):
+    FakeKnack(monkeypatch, ["knack-6"])
+    local_id = journal.enqueue(STUDENT_ID, "Student", "Hello", TIMESTAMP)
+    journal.flush_once()
+    assert journal.prune_saved() == 0
+
+    monkeypatch.setattr(app_module, "CHAT_JOURNAL_SAVED_RETENTION_SECONDS", -1)
+    assert journal.prune_saved() == 1
+    assert journal.get(local_id) is None
+
+
+@pytest.mark.parametrize("error, not_sent", [
+    (requests.exceptions.ConnectTimeout("connect timed out"), True),
+    (requests.exceptions.ConnectionError(MaxRetryError(None, "/", NewConnectionError(None, "refused"))), True),
+    (requests.exceptions.ConnectionError(ProtocolError("Connection aborted.")), False),
+    (requests.exceptions.ReadTimeout("read timed out"), False),
+])
+def test_only_failures_before_the_request_was_sent_count_as_not_created(error, not_sent):
+    assert app_module.knack_request_was_not_sent(error) is not_sent
+
+
+@pytest.mark.parametrize("status_code, record_not_created", [(422, True), (429, True), (502, False)])
+def test_http_errors_are_classified_by_whether_knack_may_have_saved_the_record(monkeypatch, status_code, record_not_created):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = b"{}"
+
+    class FakeClient:
+        def post(self, object_key, payload):
+            return response
+
+    monkeypatch.setattr(app_module, "get_knack_client", lambda: FakeClient())
+    monkeypatch.setattr(app_module, "get_student_object6_id", lambda student_obj10_id: None)
+    with pytest.raises(app_module.ChatMessagePostError) as excinfo:
+        app_module._post_chat_message_to_knack(STUDENT_ID, "Student", "Hello", TIMESTAMP, raise_errors=True)
+    assert excinfo.value.record_not_created is record_not_created
+    assert app_module._post_chat_message_to_knack(STUDENT_ID, "Student", "Hello", TIMESTAMP) is None
+
+
+@pytest.mark.parametrize("first_error, retried", [
+    (requests.exceptions.ConnectionError(MaxRetryError(None, "/", NewConnectionError(None, "refused"))), True),
+    (requests.exceptions.ReadTimeout("read timed out"), False),
+])
+def test_knack_client_retries_a_post_only_when_it_was_never_sent(monkeypatch, first_error, retried):
+    client = app_module.KnackClient("app", "key", rate_limiter=app_module.TokenBucket(1000, 1000), max_retries=2)
+    attempts = []
+
+    def fake_request(method, url, **kwargs):
+        attempts.append(method)
+        if len(attempts) == 1:
+            raise first_error
+        response = requests.Response()
+        response.status_code = 200
+        return response
+
+    monkeypatch.setattr(client.session, "request", fake_request)
+    monkeypatch.setattr(app_module.KnackClient, "backoff_delay", staticmethod(lambda attempt: 0))
+    if retried:
+        assert client.post("object_118", {}).status_code == 200
+        assert attempts == ["POST", "POST"]
+    else:
+        with pytest.raises(requests.exceptions.ReadTimeout):
+            client.post("object_118", {})
+        assert attempts == ["POST"]
+
+
+def test_local_ids_this_server_cannot_resolve_get_a_distinct_status(journal, tmp_path, monkeypatch):
+    other_instance_journal = app_module.ChatMessageJournal(str(tmp_path / "other_instance.sqlite3"))
+    other_instance_journal.flusher_pid = os.getpid()
+    other_local_id = other_instance_journal.enqueue(STUDENT_ID, "Student", "Hello", TIMESTAMP)
+    FakeKnack(monkeypatch, ["knack-7"])
+    pruned_local_id = journal.enqueue(STUDENT_ID, "Student", "Hello", TIMESTAMP)
+    journal.flush_once()
+    monkeypatch.setattr(app_module, "CHAT_JOURNAL_SAVED_RETENTION_SECONDS", -1)
+    journal.prune_saved()
+    monkeypatch.setattr(app_module, "CHAT_JOURNAL", journal)
+
+    with app_module.app.test_client() as client:
+        other_status = client.get(f"/api/v1/chat_message_status/{other_local_id}")
+        other_like = client.post("/api/v1/update_chat_like", json={"message_id": other_local_id, "is_liked": True})
+        pruned_status = client.get(f"/api/v1/chat_message_status/{pruned_local_id}")
+
+    assert (other_status.status_code, other_status.get_json()["status"]) == (409, "other_instance")
+    assert other_like.status_code == 409
+    assert (pruned_status.status_code, pruned_status.get_json()["status"]) == (410, "expired")
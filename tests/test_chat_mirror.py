@@ -0,0 +1,54 @@
+import backend.app as app_module
+
+
+STUDENT_ID = "obj10-student"
+
+
+def knack_chat_record(record_id, timestamp, liked="No"):
+    return {"id": record_id, "field_3275": STUDENT_ID, "field_3276": timestamp, "field_3273": "Student",
+            "field_3277": f"text of {record_id}", "field_3279": liked}
+
+
+def test_sync_keeps_rows_written_while_it_was_reading_knack(tmp_path, monkeypatch):
+    mirror = app_module.ChatLogMirror(str(tmp_path / "mirror.sqlite3"))
+    mirror.add_message("old", STUDENT_ID, "Student", "old text", "15/10/2026 09:00:00", pending=False)
+
+    def read_knack_while_a_message_is_saved_and_liked(object_key, filters=None, max_pages=None):
+        # Knack's snapshot predates both of these writes.
+        mirror.add_message("new", STUDENT_ID, "Student", "new text", "16/10/2026 09:00:00", pending=False)
+        mirror.set_liked("old", True)
+        return app_module.KnackRecordList([knack_chat_record("old", "15/10/2026 09:00:00")], total_pages=1, pages_fetched=1)
+
+    monkeypatch.setattr(app_module, "get_all_knack_records", read_knack_while_a_message_is_saved_and_liked)
+    assert mirror.sync_student(STUDENT_ID)
+
+    records, _ = mirror.history_page(STUDENT_ID, 10)
+    assert [(record["id"], record["field_3279"]) for record in records] == [("new", "No"), ("old", "Yes")]
+
+
+def test_sync_drops_rows_that_are_no_longer_in_knack(tmp_path, monkeypatch):
+    mirror = app_module.ChatLogMirror(str(tmp_path / "mirror.sqlite3"))
+    mirror.add_message("deleted_elsewhere", STUDENT_ID, "Student", "text", "15/10/2026 09:00:00", pending=False)
+    monkeypatch.setattr(app_module, "get_all_knack_records", lambda object_key, filters=None, max_pages=None: app_module.KnackRecordList(
+        [knack_chat_record("kept", "16/10/2026 09:00:00")], total_pages=1, pages_fetched=1))
+
+    assert mirror.sync_student(STUDENT_ID)
+    assert [record["id"] for record in mirror.history_page(STUDENT_ID, 10)[0]] == ["kept"]
+
+
+def test_like_reaches_the_mirror_only_once_knack_accepts_it(tmp_path, monkeypatch):
+    mirror = app_module.ChatLogMirror(str(tmp_path / "mirror.sqlite3"))
+    mirror.add_message("msg1", STUDENT_ID, "Student", "text", "15/10/2026 09:00:00", pending=False)
+    monkeypatch.setattr(app_module, "CHAT_MIRROR", mirror)
+    monkeypatch.setattr(app_module, "get_knack_client", lambda: object())
+    knack_accepts = []
+    monkeypatch.setattr(app_module, "update_chat_like_in_knack", lambda record_id, is_liked: {"id": record_id} if knack_accepts else None)
+
+    with app_module.app.test_client() as client:
+        failed = client.post("/api/v1/update_chat_like", json={"message_id": "msg1", "is_liked": True})
+        assert failed.status_code == 500
+        assert mirror.counts(STUDENT_ID) == (1, 0)
+
+        knack_accepts.append(True)
+        assert client.post("/api/v1/update_chat_like", json={"message_id": "msg1", "is_liked": True}).status_code == 200
+        assert mirror.counts(STUDENT_ID) == (1, 1)
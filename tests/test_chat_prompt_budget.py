@@ -0,0 +1,100 @@
+import pytest
+
+import backend.app as app_module
+
+
+@pytest.fixture
+def summary_calls(monkeypatch):
+    """Uses the offline digest for history summaries and records each summarisation."""
+    monkeypatch.setattr(app_module, "CHAT_HISTORY_SUMMARY_USE_LLM", False)
+    app_module.CHAT_HISTORY_SUMMARY_CACHE.clear()
+    calls = []
+    summarize = app_module.summarize_chat_messages
+
+    def recording_summarize(previous_summary, new_messages):
+        calls.append((previous_summary, len(new_messages)))
+        return summarize(previous_summary, new_messages)
+
+    monkeypatch.setattr(app_module, "summarize_chat_messages", recording_summarize)
+    return calls
+
+
+def conversation(turns, liked_indexes=()):
+    history = []
+    for turn in range(turns):
+        history.append({"role": "user", "content": f"Tutor message {turn}: " + "the student seems unsure about revision " * 8})
+        history.append({"role": "assistant", "content": f"Coach reply {turn}: " + "let's explore what is getting in the way " * 12})
+    for index in liked_indexes:
+        history[index]["is_liked"] = True
+    return history
+
+
+def test_estimate_tokens_counts_words_and_punctuation():
+    assert app_module.estimate_tokens("") == 0
+    assert app_module.estimate_tokens("Hi, there!") == 4
+    assert app_module.estimate_tokens("extraordinarily") == 3  # Long words cost one token per ~5 characters.
+
+
+def test_truncate_to_token_budget_cuts_at_a_word_and_marks_the_cut():
+    text = "one two three four five six"
+    assert app_module.truncate_to_token_budget(text, 10) == text
+    assert app_module.truncate_to_token_budget(text, 3) == "one two three [...]"
+
+
+def test_rag_sections_are_kept_whole_in_priority_order():
+    sections = {
+        "coaching_insights": ["--- Insights ---", "word " * 40],
+        "activities": ["--- Activities ---", "word " * 40],
+        "reflective_statements": ["--- Statements ---", "short"],
+    }
+    kept = app_module.trim_sections_to_token_budget(sections, app_module.CHAT_RAG_SECTION_PRIORITY, 70)
+    # Activities outrank insights; the small low-priority section still fits in what is left.
+    assert list(kept) == ["activities", "reflective_statements"]
+    assert kept["activities"] == sections["activities"]
+
+
+def test_short_history_is_sent_verbatim(summary_calls):
+    history = conversation(2)
+    messages = app_module.build_chat_history_messages(history)
+    assert [message["content"] for message in messages] == [message["content"] for message in history]
+    assert summary_calls == []
+
+
+def test_long_history_keeps_recent_and_liked_messages_verbatim(summary_calls):
+    history = conversation(30, liked_indexes=[3])
+    messages = app_module.build_chat_history_messages(history, max_tokens=3000)
+
+    assert messages[0]["role"] == "system" and messages[0]["content"].startswith("Summary of the earlier part")
+    verbatim_contents = [message["content"] for message in messages[1:]]
+    assert verbatim_contents[-app_module.CHAT_HISTORY_RECENT_MESSAGES:] == [message["content"] for message in history[-app_module.CHAT_HISTORY_RECENT_MESSAGES:]]
+    assert any(content.startswith("[Tutor Liked This Assistant Response]") for content in verbatim_contents)
+    assert app_module.estimate_message_tokens(messages) <= 3000
+
+
+def test_fold_point_moves_in_chunks_so_the_summary_is_reused_across_turns(summary_calls):
+    summaries = []
+    for turns in range(20, 40):
+        messages = app_module.build_chat_history_messages(conversation(turns), max_tokens=3000)
+        assert app_module.estimate_message_tokens(messages) <= 3000
+        summaries.append(messages[0]["content"])
+
+    # 20 turns need only a few summaries, each extending the previous one rather than starting over.
+    assert len(summary_calls) <= 5
+    assert all(previous_summary for previous_summary, _ in summary_calls[1:])
+    assert len(set(summaries)) == len(summary_calls)
+
+
+def test_activities_are_only_introduced_when_their_section_fits_the_rag_budget(monkeypatch):
+    history = [{"role": "user", "content": "They lack direction."}, {"role": "assistant", "content": "Tell me more."}]
+    initial_ai_context = {"student_name": "Ann", "student_level": "Level 3", "student_overview_summary": "Ann is doing ok"}
+    tutor_message = "can you suggest an activity for vision related motivation"
+    messages, suggested_activities = app_module.build_chat_turn_messages(history, tutor_message, initial_ai_context, False, "Ann")
+    if not suggested_activities:
+        pytest.skip("knowledge base has no matching activities")
+    assert "--- Activity Introduction Guidance ---" in messages[-2]["content"]
+
+    monkeypatch.setattr(app_module, "CHAT_PROMPT_RAG_TOKENS", 20)
+    messages, suggested_activities = app_module.build_chat_turn_messages(history, tutor_message, initial_ai_context, False, "Ann")
+    assert suggested_activities == []
+    assert "Activity Introduction Guidance" not in messages[-2]["content"]
+    assert "Provided VESPA Activities" not in messages[-2]["content"]
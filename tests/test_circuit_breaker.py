@@ -0,0 +1,31 @@
+import backend.app as app_module
+
+
+def test_opens_after_consecutive_failures_and_fails_fast():
+    breaker = app_module.CircuitBreaker("test", failure_threshold=3, reset_seconds=60)
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record_failure()
+    breaker.record_success()  # A success resets the run of failures.
+    for _ in range(3):
+        assert breaker.allow()
+        breaker.record_failure()
+
+    assert breaker.is_open()
+    assert not breaker.allow()
+    assert breaker.stats() == {"state": "open", "consecutive_failures": 3, "open_count": 1}
+
+
+def test_lets_one_probe_through_after_the_reset_period():
+    breaker = app_module.CircuitBreaker("test", failure_threshold=1, reset_seconds=0)
+    breaker.record_failure()
+
+    assert breaker.allow()  # The probe.
+    assert not breaker.allow()  # Everyone else keeps failing fast while it runs.
+    breaker.record_failure()
+    assert breaker.stats()["state"] == "open" and breaker.stats()["open_count"] == 2
+
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.stats()["state"] == "closed"
+    assert breaker.allow() and breaker.allow()
@@ -0,0 +1,17 @@
+import backend.app as app_module
+
+
+def test_stream_reports_a_failed_block_as_an_error_event(monkeypatch):
+    def blocks_then_failure(student_obj10_id, student_vespa_data):
+        yield "vespa_profile", {"vespa_profile": {}}
+        raise RuntimeError("Knack is down")
+
+    monkeypatch.setattr(app_module, "load_coaching_student_record", lambda: ("obj10-student", {}, None))
+    monkeypatch.setattr(app_module, "iter_coaching_suggestion_blocks", blocks_then_failure)
+
+    with app_module.app.test_client() as client:
+        body = client.post("/api/v1/coaching_suggestions_stream", json={}).get_data(as_text=True)
+
+    assert "event: vespa_profile" in body
+    assert "event: error" in body
+    assert "event: done" not in body
@@ -0,0 +1,19 @@
+import backend.app as app_module
+
+
+def test_memoised_record_copies_do_not_share_nested_records(monkeypatch):
+    fetches = []
+
+    def fake_fetch(object_key, record_id=None, *args):
+        fetches.append(record_id)
+        return {"id": record_id, "records": [{"id": "connected", "field_1": "original"}]}
+
+    monkeypatch.setattr(app_module, "_fetch_knack_record", fake_fetch)
+    with app_module.app.test_request_context():
+        first = app_module.get_knack_record("object_10", record_id="rec1")
+        first["records"][0]["field_1"] = "edited by the first caller"
+        first["records"].append({"id": "added"})
+        second = app_module.get_knack_record("object_10", record_id="rec1")
+
+    assert fetches == ["rec1"]
+    assert second["records"] == [{"id": "connected", "field_1": "original"}]
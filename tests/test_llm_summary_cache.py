@@ -0,0 +1,69 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import backend.app as app_module
+
+
+PREVIOUS_SUMMARY_BLOCK = "\n\n--- Previous AI Interaction Summary (For Context) ---\n  Last time we talked about revision plans..."
+
+
+def summary_request(user_content):
+    return {
+        "model": "gpt-4o-mini",
+        "messages": [
+            {"role": "system", "content": "You are an academic mentor."},
+            {"role": "user", "content": user_content},
+        ],
+        "max_tokens": 100,
+        "temperature": 0.7,
+    }
+
+
+class FakeLLMClient:
+    def __init__(self, outputs):
+        self.outputs = outputs
+        self.calls = []
+
+    def create(self, call_name, deadline_seconds=None, **request):
+        self.calls.append(request)
+        message = SimpleNamespace(content=json.dumps(self.outputs))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)]), request["model"]
+
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    fake = FakeLLMClient({key: f"{key} text" for key in app_module.LLM_SUMMARY_SECTION_KEYS})
+    monkeypatch.setattr(app_module, "LLM_CLIENT", fake)
+    app_module.LLM_SUMMARY_CACHE.clear()
+    return fake
+
+
+def test_cache_key_is_stable_and_sensitive_to_prompt_and_parameters():
+    request = summary_request("Vision 7/10")
+    assert app_module.llm_request_cache_key(request) == app_module.llm_request_cache_key(summary_request("Vision 7/10"))
+    assert app_module.llm_request_cache_key(request) != app_module.llm_request_cache_key(summary_request("Vision 8/10"))
+    assert app_module.llm_request_cache_key(request) != app_module.llm_request_cache_key(dict(request, temperature=0.2))
+
+
+def test_volatile_text_is_left_out_of_the_cache_key():
+    without_summary = summary_request("Scores...\n\n--- TASKS ---")
+    with_summary = summary_request(f"Scores...{PREVIOUS_SUMMARY_BLOCK}\n\n--- TASKS ---")
+    assert app_module.llm_request_cache_key(with_summary, PREVIOUS_SUMMARY_BLOCK) == app_module.llm_request_cache_key(without_summary)
+    assert app_module.llm_request_cache_key(with_summary) != app_module.llm_request_cache_key(without_summary)
+
+
+def test_reopening_a_report_after_its_summary_was_written_back_hits_the_cache(fake_llm):
+    section_keys = app_module.LLM_SUMMARY_SECTION_KEYS
+    first_request = summary_request("Scores...\n\n--- TASKS ---")
+    outputs, from_cache = app_module._cached_student_summary_request(first_request, "Sam", section_keys)
+    assert not from_cache
+    assert outputs["student_overview_summary"] == "student_overview_summary text"
+
+    # The next open sees the summary just written back to field_3271 embedded in the prompt.
+    second_request = summary_request(f"Scores...{PREVIOUS_SUMMARY_BLOCK}\n\n--- TASKS ---")
+    outputs, from_cache = app_module._cached_student_summary_request(second_request, "Sam", section_keys, PREVIOUS_SUMMARY_BLOCK)
+    assert from_cache
+    assert outputs["student_overview_summary"] == "student_overview_summary text"
+    assert len(fake_llm.calls) == 1
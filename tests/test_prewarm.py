@@ -0,0 +1,42 @@
+import threading
+
+import pytest
+
+import backend.app as app_module
+
+
+@pytest.mark.parametrize("mode, state, expected_status", [
+    ("blocking", "starting", 503),
+    ("blocking", "running", 503),
+    ("blocking", "complete", 200),
+    ("background", "running", 200),
+    ("off", "idle", 200),
+])
+def test_readiness_is_only_held_back_by_a_blocking_prewarm(monkeypatch, mode, state, expected_status):
+    monkeypatch.setattr(app_module, "PREWARM_ON_STARTUP", mode)
+    monkeypatch.setitem(app_module.PREWARM_STATUS, "state", state)
+    response = app_module.app.test_client().get("/api/v1/ready")
+    assert response.status_code == expected_status
+
+
+def test_startup_prewarm_returns_without_waiting_for_the_warm_up(monkeypatch):
+    monkeypatch.setattr(app_module, "PREWARM_ON_STARTUP", "blocking")
+    monkeypatch.setitem(app_module.PREWARM_STATUS, "state", "idle")
+    release_warm_up = threading.Event()
+    warm_up_started = threading.Event()
+    warm_up_threads = []
+
+    def blocking_warm_up():
+        warm_up_threads.append(threading.get_ident())
+        warm_up_started.set()
+        release_warm_up.wait(5)
+
+    monkeypatch.setattr(app_module, "prewarm_school_vespa_averages", blocking_warm_up)
+    try:
+        app_module.start_prewarm_on_startup()
+        assert not release_warm_up.is_set()  # Returned while the warm-up is still blocked.
+        assert app_module.PREWARM_STATUS["state"] == "starting"
+        assert warm_up_started.wait(5)
+        assert len(warm_up_threads) == 1 and warm_up_threads[0] != threading.get_ident()
+    finally:
+        release_warm_up.set()
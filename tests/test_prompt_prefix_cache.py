@@ -0,0 +1,33 @@
+import backend.app as app_module
+
+
+SYSTEM_PROMPT = {"role": "system", "content": " ".join(f"instruction{index}" for index in range(400))}
+
+
+def test_repeated_prefix_is_reported_as_cached_up_to_the_first_difference():
+    cache = app_module.PromptPrefixCache(min_tokens=100, block_tokens=50, ttl_seconds=60, max_prefixes=100)
+    first = [SYSTEM_PROMPT, {"role": "user", "content": "first question " * 20}]
+    second = [SYSTEM_PROMPT, {"role": "user", "content": "second question " * 20}]
+
+    assert cache.observe("gpt-test", first) == 0
+    cached_tokens = cache.observe("gpt-test", second)
+    total_tokens = cache.prefix_hashes("gpt-test", second)[-1][0]
+    assert 100 <= cached_tokens < total_tokens
+    assert cache.observe("gpt-test", second) == total_tokens
+
+
+def test_prefixes_are_per_model_and_expire():
+    cache = app_module.PromptPrefixCache(min_tokens=100, block_tokens=50, ttl_seconds=60, max_prefixes=100)
+    cache.observe("gpt-test", [SYSTEM_PROMPT])
+    assert cache.observe("another-model", [SYSTEM_PROMPT]) == 0
+
+    expired = app_module.PromptPrefixCache(min_tokens=100, block_tokens=50, ttl_seconds=-1, max_prefixes=100)
+    expired.observe("gpt-test", [SYSTEM_PROMPT])
+    assert expired.observe("gpt-test", [SYSTEM_PROMPT]) == 0
+
+
+def test_prompts_shorter_than_min_tokens_are_never_cached():
+    cache = app_module.PromptPrefixCache(min_tokens=100, block_tokens=50, ttl_seconds=60, max_prefixes=100)
+    short_prompt = [{"role": "user", "content": "hello there"}]
+    cache.observe("gpt-test", short_prompt)
+    assert cache.observe("gpt-test", short_prompt) == 0
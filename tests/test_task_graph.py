@@ -0,0 +1,55 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import backend.app as app_module
+
+
+def test_tasks_receive_dependency_results_and_yield_as_they_finish():
+    graph = app_module.TaskGraph("test_deps")
+    graph.add("slow", lambda: time.sleep(0.2) or "slow result")
+    graph.add("fast", lambda: "fast result")
+    graph.add("combined", lambda fast: f"{fast} + more", deps=("fast",))
+
+    order = [task_name for task_name, _, _ in graph.iter_results()]
+    results, report = graph.run()
+    assert order.index("fast") < order.index("slow")
+    assert results == {"slow": "slow result", "fast": "fast result", "combined": "fast result + more"}
+    assert {task_report["status"] for task_report in report.values()} == {"ok"}
+
+
+def test_failed_and_timed_out_tasks_yield_their_defaults_without_holding_up_the_graph():
+    def fail():
+        raise RuntimeError("Knack is down")
+
+    graph = app_module.TaskGraph("test_defaults")
+    graph.add("failing", fail, default="failed default")
+    graph.add("hanging", lambda: time.sleep(2) or "too late", timeout=0.2, default="timeout default")
+
+    started_at = time.time()
+    results, report = graph.run()
+    assert time.time() - started_at < 1
+    assert results == {"failing": "failed default", "hanging": "timeout default"}
+    assert report["failing"]["status"] == "error" and report["hanging"]["status"] == "timeout"
+
+
+def test_deadline_starts_when_the_task_starts_running_not_while_it_is_queued():
+    single_thread = ThreadPoolExecutor(max_workers=1)
+    graph = app_module.TaskGraph("test_queue_wait", single_thread)
+    graph.add("first", lambda: time.sleep(0.4) or "first result", timeout=2)
+    graph.add("queued", lambda: "queued result", timeout=0.2)  # Waits ~0.4s for the only thread.
+
+    results, report = graph.run()
+    single_thread.shutdown()
+    assert results["queued"] == "queued result"
+    assert report["queued"]["status"] == "ok"
+
+
+def test_graph_without_an_executor_runs_every_task_at_once_on_its_own_pool():
+    graph = app_module.TaskGraph("test_own_pool")
+    for index in range(4):
+        graph.add(f"task_{index}", lambda: time.sleep(0.2) or "done")
+
+    started_at = time.time()
+    results, _ = graph.run()
+    assert time.time() - started_at < 0.5
+    assert set(results.values()) == {"done"}